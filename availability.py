@@ -0,0 +1,116 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class TableSchedule:
+    """
+    Расписание столов на одну дату: для каждого стола хранится
+    отсортированный список времен начала броней.
+    Поиск конфликтов - бинарный поиск по окну вокруг нового времени.
+    """
+
+    def __init__(self, min_hours: float):
+        self.window = int(min_hours * 60)
+        # table_number -> (отсортированные минуты, брони в том же порядке)
+        self._tables: Dict[str, tuple] = {}
+
+    @staticmethod
+    def time_to_minutes(time_str: str) -> Optional[int]:
+        """Переводит ЧЧ:ММ в минуты от начала суток (None если формат неверный)"""
+        try:
+            t = datetime.strptime(time_str, "%H:%M")
+        except (ValueError, TypeError):
+            return None
+        return t.hour * 60 + t.minute
+
+    def add(self, reservation: dict) -> None:
+        """Добавление брони в расписание"""
+        table = reservation.get('table_number')
+        if not table or table == 'Не назначен':
+            return
+
+        minutes = self.time_to_minutes(reservation.get('time'))
+        if minutes is None:
+            return
+
+        starts, items = self._tables.setdefault(table, ([], []))
+        pos = bisect_right(starts, minutes)
+        starts.insert(pos, minutes)
+        items.insert(pos, reservation)
+
+    def find_conflicts(self, table_number: str, time: str, exclude_reservation_id: int = None) -> List[dict]:
+        """Брони на стол, которые ближе чем min_hours к указанному времени"""
+        minutes = self.time_to_minutes(time)
+        if minutes is None or table_number not in self._tables:
+            return []
+
+        starts, items = self._tables[table_number]
+        # Конфликт, если разница строго меньше окна
+        lo = bisect_right(starts, minutes - self.window)
+        hi = bisect_left(starts, minutes + self.window)
+
+        conflicts = []
+        for start, res in zip(starts[lo:hi], items[lo:hi]):
+            if exclude_reservation_id and res.get('id') == exclude_reservation_id:
+                continue
+            conflicts.append({
+                'id': res.get('id'),
+                'time': res.get('time'),
+                'name': res.get('name'),
+                'guests': res.get('guests'),
+                'diff_hours': abs(minutes - start) / 60
+            })
+        return conflicts
+
+
+class TableRegistry:
+    """
+    Рассадка ресторана: зоны, столы и их вместимость
+    (настройка TABLE_ZONES в config.py).
+    """
+
+    def __init__(self, zones: Dict[str, Dict[str, int]]):
+        # table_number -> {'table', 'zone', 'capacity'}
+        self.tables: Dict[str, dict] = {}
+        for zone, tables in zones.items():
+            for table_number, capacity in tables.items():
+                self.tables[str(table_number)] = {
+                    'table': str(table_number),
+                    'zone': zone,
+                    'capacity': capacity
+                }
+
+    def get(self, table_number: str) -> Optional[dict]:
+        """Стол из рассадки (None, если такого стола нет)"""
+        return self.tables.get(table_number)
+
+
+def suggest_free_tables(registry: TableRegistry, schedule: TableSchedule, time: str, guests: int,
+                        near_table: str = None, limit: int = 6) -> List[dict]:
+    """
+    Свободные столы на время брони, лучшие первыми:
+    1) вместимость ближе всего к числу гостей (но не меньше),
+    2) та же зона, что у запрошенного стола,
+    3) номер ближе к запрошенному.
+    schedule - расписание всех столов на дату брони.
+    """
+    near = registry.get(near_table) if near_table else None
+    near_number = int(near_table) if near_table and near_table.isdigit() else None
+
+    candidates = []
+    for table in registry.tables.values():
+        if table['table'] == near_table or table['capacity'] < guests:
+            continue
+        if schedule.find_conflicts(table['table'], time):
+            continue
+
+        same_zone = near is not None and table['zone'] == near['zone']
+        if near_number is not None and table['table'].isdigit():
+            distance = abs(int(table['table']) - near_number)
+        else:
+            distance = 0
+        candidates.append(((table['capacity'] - guests, not same_zone, distance, table['table']), table))
+
+    candidates.sort(key=lambda item: item[0])
+    return [table for _, table in candidates[:limit]]
@@ -0,0 +1,93 @@
+"""
+Проверка занятости стола: время одной проверки при 1 000, 10 000 и 100 000
+броней в базе (по 100 броней в день, растет только история).
+Прежняя проверка читала все брони и сравнивала время с каждой бронью
+этого стола на дату; новая загружает брони одного стола на дату
+по индексу и ищет конфликты бинарным поиском (TableSchedule).
+
+Запуск: python benchmarks/bench_availability.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.py при импорте создает restaurant.db в текущей папке
+os.chdir(tempfile.mkdtemp(prefix='bench-availability-'))
+
+from availability import TableSchedule
+from database import Database
+
+MIN_HOURS = 3
+SIZES = (1000, 10000, 100000)
+CHECKS = 200
+PER_DAY = 100
+DATE = '2026-03-14'
+
+
+def legacy_check(db: Database, table_number: str, date: str, time_str: str) -> list:
+    """Прежняя check_table_availability: полный проход по всем броням"""
+    new_time = datetime.strptime(time_str, "%H:%M")
+    conflicts = []
+    for res in db.get_all_reservations():
+        if res.get('date') != date or res.get('table_number') != table_number:
+            continue
+        time_diff = abs((new_time - datetime.strptime(res.get('time'), "%H:%M")).total_seconds() / 3600)
+        if time_diff < MIN_HOURS:
+            conflicts.append(res.get('id'))
+    return conflicts
+
+
+def indexed_check(db: Database, table_number: str, date: str, time_str: str) -> list:
+    schedule = TableSchedule(MIN_HOURS)
+    for res in db.get_table_reservations_for_date(table_number, date):
+        schedule.add(res)
+    return [c['id'] for c in schedule.find_conflicts(table_number, time_str)]
+
+
+def day(n: int) -> str:
+    return (datetime.strptime(DATE, '%Y-%m-%d') + timedelta(days=n)).strftime('%Y-%m-%d')
+
+
+def make_reservations(first: int, count: int, rng: random.Random) -> list:
+    return [{
+        'date': day(n // PER_DAY),
+        'time': f"{rng.randrange(10, 23):02d}:{rng.choice((0, 15, 30, 45)):02d}",
+        'name': f'Гость {n}', 'phone': f'+7912{n:07d}', 'table_number': str(rng.randrange(1, 29)),
+        'guests': 2, 'deposit': 0, 'deposit_paid': 0, 'occasion': '',
+    } for n in range(first, first + count)]
+
+
+def measure(func, queries: list, checks: int) -> float:
+    """Среднее время одной проверки, мс"""
+    started = time.perf_counter()
+    for n in range(checks):
+        func(*queries[n % len(queries)])
+    return (time.perf_counter() - started) / checks * 1000
+
+
+def main():
+    rng = random.Random(1)
+    db = Database('availability.db')
+    stored = 0
+    print(f"{'броней':>8}{'полный проход':>16}{'по индексу':>14}")
+    for size in SIZES:
+        db.add_reservations_bulk(make_reservations(stored, size - stored, rng))
+        stored = size
+        queries = [
+            (str(rng.randrange(1, 29)), day(rng.randrange(size // PER_DAY)), f"{rng.randrange(10, 23):02d}:00")
+            for _ in range(CHECKS)
+        ]
+        for query in queries[:20]:
+            assert sorted(legacy_check(db, *query)) == sorted(indexed_check(db, *query))
+        # Полный проход при 100 000 броней медленный: меньше повторов
+        before = measure(lambda *q: legacy_check(db, *q), queries, max(3, CHECKS * 1000 // size))
+        after = measure(lambda *q: indexed_check(db, *q), queries, CHECKS)
+        print(f"{size:>8}{before:>13.2f} мс{after:>11.3f} мс")
+
+
+if __name__ == '__main__':
+    main()
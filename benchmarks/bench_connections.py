@@ -0,0 +1,65 @@
+"""
+Соединения с БД: операций в секунду для get_reservation_by_id,
+add_reservation и check_notification_sent с новым соединением на каждый
+вызов (как было) и с постоянными соединениями в режиме WAL.
+
+Запуск: python benchmarks/bench_connections.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.py при импорте создает restaurant.db в текущей папке
+os.chdir(tempfile.mkdtemp(prefix='bench-connections-'))
+
+from database import Database
+
+OPERATIONS = 2000
+
+
+class FreshConnectionDatabase(Database):
+    """Прежнее поведение: новое соединение без настроек на каждый вызов, журнал DELETE"""
+
+    def get_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_name)
+
+
+def make_reservation(n: int) -> dict:
+    return {
+        'date': '2026-03-14', 'time': f"{12 + n % 10}:00", 'name': f'Гость {n}',
+        'phone': f'+7912{n:07d}', 'table_number': str(n % 28 + 1), 'guests': 2,
+        'deposit': 0, 'deposit_paid': 0, 'occasion': '',
+    }
+
+
+def measure(func, count: int = OPERATIONS) -> float:
+    started = time.perf_counter()
+    for n in range(count):
+        func(n)
+    return count / (time.perf_counter() - started)
+
+
+def bench(db: Database) -> dict:
+    ids = [db.add_reservation(make_reservation(n)) for n in range(100)]
+    for reservation_id in ids[:50]:
+        db.save_notification(reservation_id, 1, '30min')
+    return {
+        'get_reservation_by_id': measure(lambda n: db.get_reservation_by_id(ids[n % len(ids)])),
+        'add_reservation': measure(lambda n: db.add_reservation(make_reservation(n)), OPERATIONS // 4),
+        'check_notification_sent': measure(lambda n: db.check_notification_sent(ids[n % len(ids)], 1, '30min')),
+    }
+
+
+def main():
+    before = bench(FreshConnectionDatabase('fresh.db'))
+    after = bench(Database('pooled.db'))
+    print(f"{'операция':<26}{'новое соединение':>18}{'постоянное':>14}{'ускорение':>11}")
+    for name in before:
+        print(f"{name:<26}{before[name]:>14.0f}/с {after[name]:>10.0f}/с {after[name] / before[name]:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
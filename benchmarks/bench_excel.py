@@ -0,0 +1,152 @@
+"""
+Выгрузка Excel: строк в секунду и пиковая память (RSS) для 50 000 броней
+в прежней реализации (обычная книга, стили на каждую ячейку, запрос
+официантов на каждую строку, второй проход для ширины колонок)
+и в потоковой (write_only, общие именованные стили, одна карта официантов).
+Каждая реализация запускается в отдельном процессе, чтобы пик памяти
+одной не влиял на другую.
+
+Запуск: python benchmarks/bench_excel.py [число строк]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROWS = 50000
+DATE = '2026-03-14'
+
+
+def legacy_create_file(reservations, date, db) -> str:
+    """Прежняя ExcelGenerator.create_reservation_file"""
+    import openpyxl
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+    from openpyxl.utils import get_column_letter
+    from excel_helper import HEADERS, ExcelGenerator
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = f"Брони {date}"
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    for col_num, header in enumerate(HEADERS, 1):
+        cell = ws.cell(row=1, column=col_num)
+        cell.value = header
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+
+    border = Border(left=Side(style='thin'), right=Side(style='thin'),
+                    top=Side(style='thin'), bottom=Side(style='thin'))
+
+    for row_num, res in enumerate(reservations, 2):
+        table_number = res.get('table_number', '')
+        deposit = res.get('deposit', 0)
+        deposit_paid = res.get('deposit_paid', 0)
+        waiter_name = ""
+        if db and table_number:
+            waiters = db.get_waiters_for_table_on_date_with_names(table_number, date)
+            waiter_name = ", ".join(waiters) if waiters else ""
+        deposit_status = ExcelGenerator.get_deposit_status_symbol(deposit, deposit_paid)
+        row_data = [
+            res.get('id', ''), res.get('date', ''), table_number if table_number else 'Не назначен',
+            res.get('name', ''), res.get('phone', ''), res.get('occasion', '-'), res.get('time', ''),
+            res.get('guests', ''), deposit if deposit > 0 else '', deposit_status, waiter_name
+        ]
+        for col_num, value in enumerate(row_data, 1):
+            cell = ws.cell(row=row_num, column=col_num)
+            cell.value = value
+            cell.border = border
+            if col_num == 9 and value and int(value) > 0:
+                cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+            if col_num == 10 and value == "✅":
+                cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+            elif col_num == 10 and value == "❌":
+                cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+
+    for col in range(1, len(HEADERS) + 1):
+        max_length = 0
+        column_letter = get_column_letter(col)
+        for row in range(1, len(reservations) + 2):
+            value = ws[f"{column_letter}{row}"].value
+            if len(str(value)) > max_length:
+                max_length = len(str(value))
+        ws.column_dimensions[column_letter].width = min(max_length + 2, 30)
+
+    filepath = os.path.join("excel_files", f"legacy_{date}.xlsx")
+    os.makedirs("excel_files", exist_ok=True)
+    wb.save(filepath)
+    return filepath
+
+
+def make_reservations(count: int) -> list:
+    return [{
+        'id': n + 1, 'date': DATE, 'time': f"{12 + n % 10}:{n % 4 * 15:02d}", 'name': f'Гость {n}',
+        'phone': f'+7912{n:07d}', 'table_number': str(n % 28 + 1), 'guests': n % 8 + 1,
+        'deposit': (n % 3) * 5000, 'deposit_paid': n % 2, 'occasion': 'День рождения' if n % 5 == 0 else '',
+    } for n in range(count)]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux - в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_one(impl: str, count: int):
+    """Один замер в текущем процессе; результат - JSON в stdout"""
+    os.chdir(tempfile.mkdtemp(prefix='bench-excel-'))
+    from database import Database
+    from excel_helper import ExcelGenerator
+
+    db = Database('bench.db')
+    for waiter in range(7):
+        db.set_waiter_tables_for_date(1000 + waiter, f'Официант {waiter}',
+                                      [str(t) for t in range(waiter * 4 + 1, waiter * 4 + 5)], DATE)
+    reservations = make_reservations(count)
+    rss_before = peak_rss_mb()
+
+    started = time.perf_counter()
+    if impl == 'legacy':
+        legacy_create_file(reservations, DATE, db)
+    else:
+        ExcelGenerator.create_reservation_file(reservations, DATE, db)
+    seconds = time.perf_counter() - started
+
+    print(json.dumps({'rows_per_sec': count / seconds, 'seconds': seconds,
+                      'peak_rss_mb': peak_rss_mb(), 'rss_before_mb': rss_before}))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    results = {}
+    for impl in ('legacy', 'streaming'):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--impl', impl, str(count)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results[impl] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"Строк: {count}")
+    print(f"{'реализация':<12}{'строк/с':>10}{'время, с':>10}{'пик RSS, МБ':>14}{'до выгрузки':>14}")
+    for impl, r in results.items():
+        print(f"{impl:<12}{r['rows_per_sec']:>10.0f}{r['seconds']:>10.1f}"
+              f"{r['peak_rss_mb']:>14.0f}{r['rss_before_mb']:>14.0f}")
+    legacy, streaming = results['legacy'], results['streaming']
+    print(f"ускорение: {streaming['rows_per_sec'] / legacy['rows_per_sec']:.1f}x, "
+          f"прирост памяти: {legacy['peak_rss_mb'] - legacy['rss_before_mb']:.0f} МБ -> "
+          f"{streaming['peak_rss_mb'] - streaming['rss_before_mb']:.0f} МБ")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--impl':
+        run_one(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else ROWS)
+    else:
+        main()
@@ -0,0 +1,86 @@
+"""
+Выгрузка Excel за день в зависимости от числа официантов на дату:
+прежний поиск официантов для каждой строки (все записи waiters за дату,
+разбор JSON со столами, запрос в users на каждого подходящего официанта)
+и одна карта {стол: [имена]} на дату (Database.get_table_assignment_map).
+
+Запуск: python benchmarks/bench_excel_waiters.py
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.py при импорте создает restaurant.db в текущей папке
+os.chdir(tempfile.mkdtemp(prefix='bench-excel-waiters-'))
+
+from database import Database
+from excel_helper import ExcelGenerator
+
+ROWS = 2000
+TABLES_PER_WAITER = 5
+WAITER_COUNTS = (1, 10, 50, 200)
+DATE = '2026-03-14'
+
+
+def legacy_waiter_names(db: Database, table_number: str, date: str) -> list:
+    """Прежний Database.get_waiters_for_table_on_date_with_names"""
+    cursor = db.get_connection().cursor()
+    cursor.execute('SELECT user_id, name, tables FROM waiters WHERE date = ?', (date,))
+    names = []
+    for user_id, name, tables in cursor.fetchall():
+        if table_number in json.loads(tables):
+            cursor.execute('SELECT first_name FROM users WHERE user_id = ?', (user_id,))
+            user_row = cursor.fetchone()
+            names.append(user_row[0] if user_row and user_row[0] else name)
+    return names
+
+
+def legacy_export(db: Database, reservations: list) -> str:
+    waiter_map = {}
+    for res in reservations:
+        waiter_map[res['table_number']] = legacy_waiter_names(db, res['table_number'], DATE)
+    return ExcelGenerator.write_workbook(
+        reservations, ExcelGenerator.get_file_path(DATE), f"Брони {DATE}", waiter_maps={DATE: waiter_map}
+    )
+
+
+def make_database(waiters: int) -> Database:
+    db = Database(f'waiters_{waiters}.db')
+    for n in range(waiters):
+        user_id = 1000 + n
+        db.add_user(user_id, f'waiter{n}', f'Официант {n}')
+        tables = [str(n * TABLES_PER_WAITER + t + 1) for t in range(TABLES_PER_WAITER)]
+        db.set_waiter_tables_for_date(user_id, f'Официант {n}', tables, DATE)
+    return db
+
+
+def make_reservations(tables: int) -> list:
+    return [{
+        'id': n + 1, 'date': DATE, 'time': f"{12 + n % 10}:00", 'name': f'Гость {n}',
+        'phone': f'+7912{n:07d}', 'table_number': str(n % tables + 1), 'guests': 2,
+        'deposit': 0, 'deposit_paid': 0, 'occasion': '',
+    } for n in range(ROWS)]
+
+
+def measure(func) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def main():
+    print(f"Строк: {ROWS}, столов на официанта: {TABLES_PER_WAITER}")
+    print(f"{'официантов':>10}{'поиск на строку':>18}{'карта на дату':>16}")
+    for waiters in WAITER_COUNTS:
+        db = make_database(waiters)
+        reservations = make_reservations(waiters * TABLES_PER_WAITER)
+        before = measure(lambda: legacy_export(db, reservations))
+        after = measure(lambda: ExcelGenerator.create_reservation_file(reservations, DATE, db))
+        print(f"{waiters:>10}{before:>16.2f} с{after:>14.2f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Разбор текста брони: сообщений в секунду для parse_reservation_text
+на эталонном корпусе tests/data/parser_corpus.json. Перед замером
+результат сверяется с эталоном; вывод print парсера подавляется,
+чтобы замер не зависел от терминала.
+
+Запуск: python benchmarks/bench_parser.py [число проходов по корпусу]
+"""
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# database.py при импорте создает restaurant.db в текущей папке
+os.chdir(tempfile.mkdtemp(prefix='bench-parser-'))
+# main.py требует токен при импорте; к Telegram бенчмарк не обращается
+os.environ.setdefault('BOT_TOKEN', '123456:BENCH')
+
+from main import parse_reservation_text
+
+CORPUS_PATH = os.path.join(ROOT, 'tests', 'data', 'parser_corpus.json')
+ROUNDS = 200
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else ROUNDS
+    with open(CORPUS_PATH, encoding='utf-8') as corpus_file:
+        corpus = json.load(corpus_file)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        mismatches = [case['text'] for case in corpus
+                      if parse_reservation_text(case['text'], case['year']) != case['expected']]
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for case in corpus:
+                parse_reservation_text(case['text'], case['year'])
+        seconds = time.perf_counter() - started
+
+    if mismatches:
+        print(f"Расхождений с эталоном: {len(mismatches)}, например: {mismatches[0]}")
+        sys.exit(1)
+    messages = rounds * len(corpus)
+    print(f"Корпус: {len(corpus)} сообщений, проходов: {rounds}")
+    print(f"{'сообщений':>10}{'время, с':>10}{'сообщ./с':>12}{'мкс/сообщ.':>12}")
+    print(f"{messages:>10}{seconds:>10.2f}{messages / seconds:>12.0f}{seconds / messages * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
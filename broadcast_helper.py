@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramForbiddenError
+
+
+class Broadcaster:
+    """
+    Рассылка сообщений с ограничением скорости по лимитам Telegram:
+    не больше global_rate сообщений в секунду на бота и не чаще
+    одного сообщения в per_chat_interval секунд в один чат.
+    При TelegramRetryAfter рассылка приостанавливается на указанное время
+    и сообщение отправляется повторно.
+    """
+
+    def __init__(self, bot: Bot, concurrency: int = 8, global_rate: float = 25,
+                 per_chat_interval: float = 1.0, max_retries: int = 3):
+        self.bot = bot
+        self.max_retries = max_retries
+        self.per_chat_interval = per_chat_interval
+        self._global_interval = 1.0 / global_rate
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._rate_lock = asyncio.Lock()
+        self._next_global_slot = 0.0
+        # Флуд-контроль Telegram: до этого момента не отправляется ничего
+        self._paused_until = 0.0
+        # Слоты чатов, в которые недавно отправляли; прошедшие слоты удаляются
+        self._chat_next_slot: Dict[int, float] = {}
+        self._next_prune = 0.0
+
+    def _prune_chat_slots(self, now: float):
+        """
+        Удаление прошедших слотов чатов (не чаще раза в per_chat_interval):
+        прошедший слот равносилен отсутствию записи
+        """
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.per_chat_interval
+        self._chat_next_slot = {
+            chat_id: slot for chat_id, slot in self._chat_next_slot.items() if slot > now
+        }
+
+    async def _wait_for_slot(self, chat_id: int):
+        """Ожидание, пока можно отправить сообщение в чат"""
+        async with self._rate_lock:
+            now = time.monotonic()
+            self._prune_chat_slots(now)
+            slot = max(now, self._next_global_slot, self._chat_next_slot.get(chat_id, 0.0))
+            self._next_global_slot = slot + self._global_interval
+            self._chat_next_slot[chat_id] = slot + self.per_chat_interval
+
+        delay = slot - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Слот мог быть выдан до паузы флуд-контроля, начавшейся во время ожидания
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _pause(self, seconds: float):
+        """Приостановка всех отправок (флуд-контроль Telegram)"""
+        async with self._rate_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._next_global_slot = max(self._next_global_slot, self._paused_until)
+
+    async def send(self, chat_id: int, text: str, stats: dict = None, **kwargs) -> bool:
+        """Отправка одного сообщения с повторами. Возвращает True при успехе"""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._wait_for_slot(chat_id)
+                try:
+                    await self.bot.send_message(chat_id, text, **kwargs)
+                    return True
+                except TelegramRetryAfter as e:
+                    logging.warning(f"Флуд-контроль Telegram: пауза {e.retry_after} с (чат {chat_id})")
+                    await self._pause(e.retry_after)
+                except TelegramForbiddenError as e:
+                    # Пользователь заблокировал бота: повторять бесполезно
+                    logging.warning(f"Пользователь {chat_id} недоступен: {e}")
+                    if stats is not None:
+                        stats['blocked'] += 1
+                    return False
+                except TelegramNetworkError as e:
+                    logging.warning(f"Сетевая ошибка при отправке в чат {chat_id}: {e}")
+                    await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    logging.error(f"Не удалось отправить пользователю {chat_id}: {e}")
+                    return False
+
+                if stats is not None and attempt < self.max_retries:
+                    stats['retries'] += 1
+
+            logging.error(f"Не удалось отправить пользователю {chat_id}: исчерпаны повторы")
+            return False
+
+    async def broadcast(self, chat_ids: Iterable[int], text: str, **kwargs) -> dict:
+        """
+        Рассылка одного текста многим пользователям.
+        Возвращает статистику: total, sent, failed (не доставлено, в том числе
+        blocked - бот заблокирован пользователем), retries, duration.
+        """
+        chat_ids = list(dict.fromkeys(chat_ids))
+        stats = {'total': len(chat_ids), 'sent': 0, 'failed': 0, 'blocked': 0, 'retries': 0, 'duration': 0.0}
+        started = time.monotonic()
+
+        results = await asyncio.gather(
+            *(self.send(chat_id, text, stats=stats, **kwargs) for chat_id in chat_ids)
+        )
+
+        stats['sent'] = sum(1 for ok in results if ok)
+        stats['failed'] = stats['total'] - stats['sent']
+        stats['duration'] = time.monotonic() - started
+        print(
+            f"📨 Рассылка: доставлено {stats['sent']}/{stats['total']}, "
+            f"ошибок {stats['failed']} (заблокировали бота {stats['blocked']}), "
+            f"повторов {stats['retries']}, {stats['duration']:.2f} с"
+        )
+        return stats
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+
+class LeaderLease:
+    """
+    Выбор ведущего процесса через аренду в БД (таблица leases).
+    Несколько процессов бота работают с одной БД, а задачи планировщика
+    выполняет только ведущий. Аренда продлевается каждые renew_interval секунд
+    и переходит к другому процессу, если ее не продлевали ttl секунд.
+    На каждом круге вызываются on_tick-обработчики (для синхронизации общих настроек).
+    """
+
+    def __init__(self, async_db, name: str = 'scheduler', ttl: float = 30, renew_interval: float = 10):
+        self.async_db = async_db
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self._elected: List[Callable[[], Awaitable]] = []
+        self._lost: List[Callable[[], Awaitable]] = []
+        self._ticks: List[Callable[[], Awaitable]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def on_elected(self, callback: Callable[[], Awaitable]):
+        """Процесс стал ведущим"""
+        self._elected.append(callback)
+
+    def on_lost(self, callback: Callable[[], Awaitable]):
+        """Процесс перестал быть ведущим"""
+        self._lost.append(callback)
+
+    def on_tick(self, callback: Callable[[], Awaitable]):
+        """Каждый круг продления аренды (во всех процессах)"""
+        self._ticks.append(callback)
+
+    async def check(self) -> bool:
+        """Один круг: захват / продление аренды и обработчики"""
+        try:
+            acquired = await self.async_db.acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            # Без связи с БД не считаем себя ведущим: аренду может забрать другой процесс
+            print(f"❌ Ошибка продления аренды {self.name}: {e}")
+            acquired = False
+
+        if acquired and not self.is_leader:
+            self.is_leader = True
+            if not await self._run_callbacks(self._elected):
+                # Ведущий без запущенных задач хуже, чем никакой: уступаем аренду
+                await self.step_down()
+        elif not acquired and self.is_leader:
+            self.is_leader = False
+            await self._run_callbacks(self._lost)
+
+        await self._run_callbacks(self._ticks)
+        return self.is_leader
+
+    async def _run_callbacks(self, callbacks: List[Callable[[], Awaitable]]) -> bool:
+        """Вызов обработчиков; ошибка одного не мешает остальным. False - были ошибки"""
+        ok = True
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                print(f"❌ Ошибка обработчика аренды {self.name} ({callback.__name__}): {e}")
+                ok = False
+        return ok
+
+    async def step_down(self):
+        """Отказ от роли ведущего: обработчики on_lost и освобождение аренды"""
+        self.is_leader = False
+        await self._run_callbacks(self._lost)
+        try:
+            await self.async_db.release_lease(self.name, self.holder)
+        except Exception as e:
+            print(f"❌ Ошибка освобождения аренды {self.name}: {e}")
+
+    async def run(self):
+        """Бесконечный цикл продления аренды"""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                # Цикл не должен останавливаться: иначе аренда истечет, а процесс останется ведущим
+                print(f"❌ Ошибка цикла аренды {self.name}: {e}")
+
+    def start(self):
+        """Запуск цикла продления аренды в фоне"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка цикла продления и освобождение аренды (при остановке бота)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.release()
+
+    async def release(self):
+        """Освобождение аренды при остановке, чтобы другой процесс не ждал ttl"""
+        if self.is_leader:
+            self.is_leader = False
+            await self.async_db.release_lease(self.name, self.holder)
@@ -11,4 +11,17 @@ TIMEZONE = "Asia/Yekaterinburg"
 
 # Время отправки утреннего отчета (11:00)
 MORNING_REPORT_HOUR = 11
-MORNING_REPORT_MINUTE = 0
\ No newline at end of file
+MORNING_REPORT_MINUTE = 0
+
+# Рассадка: зона -> {номер стола: вместимость (гостей)}
+# По ней бот предлагает свободные столы, если выбранный занят.
+# Замени на свою рассадку; пустой словарь - без подсказок.
+TABLE_ZONES = {
+    "Основной зал": {
+        **{str(n): 2 for n in range(1, 7)},
+        **{str(n): 4 for n in range(7, 15)},
+        **{str(n): 6 for n in range(15, 19)},
+    },
+    "Веранда": {str(n): 4 for n in range(19, 27)},
+    "VIP": {"27": 8, "28": 10},
+}
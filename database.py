@@ -1,19 +1,84 @@
 import sqlite3
 import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import pytz
 import os
+import re
+import threading
+import time
+
+# Поля брони, которые хранятся отдельными колонками (помимо JSON в data)
+RESERVATION_COLUMNS = {
+    'time': 'TEXT',
+    'table_number': 'TEXT',
+    'phone': 'TEXT',
+    'name': 'TEXT',
+    'deposit': 'INTEGER DEFAULT 0',
+    'deposit_paid': 'INTEGER DEFAULT 0',
+    'occasion': 'TEXT',
+}
+
+# Версия схемы броней (PRAGMA user_version): 1 - колонки заполнены из JSON,
+# 2 - поисковый индекс построен по заполненным колонкам
+RESERVATION_COLUMNS_SCHEMA_VERSION = 2
 
 class Database:
     def __init__(self, db_name="restaurant.db"):
         self.db_name = db_name
+        # Долгоживущие соединения: по одному на поток
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Обработчики изменения ролей пользователей (сброс кэшей)
+        self._role_listeners = []
         self.init_db()
         # При запуске проверяем и удаляем старые брони
         self.cleanup_old_reservations()
     
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        Возвращает постоянное соединение текущего потока.
+        Соединение не закрывается после запроса: `with conn` только
+        фиксирует или откатывает транзакцию.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Соединение используется только своим потоком, но закрывается
+            # в close() из потока остановки бота
+            conn = sqlite3.connect(self.db_name, cached_statements=256, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA cache_size=-16000')  # ~16 МБ кэша страниц
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def add_role_listener(self, callback):
+        """Подписка на изменение ролей: callback(user_id) вызывается после записи в БД"""
+        self._role_listeners.append(callback)
+    
+    def notify_role_changed(self, user_id: int):
+        """Оповещение подписчиков об изменении ролей пользователя"""
+        for callback in self._role_listeners:
+            callback(user_id)
+    
+    def close(self):
+        """Закрытие всех открытых соединений (после остановки потоков, которые ими пользуются)"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+    
     def init_db(self):
         """Создание таблиц при первом запуске"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             
             # Таблица с бронями
@@ -22,16 +87,53 @@ class Database:
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     data TEXT NOT NULL,
                     created_at TEXT NOT NULL,
-                    date TEXT NOT NULL
+                    date TEXT NOT NULL,
+                    time TEXT,
+                    table_number TEXT,
+                    phone TEXT,
+                    name TEXT,
+                    deposit INTEGER DEFAULT 0,
+                    deposit_paid INTEGER DEFAULT 0,
+                    occasion TEXT,
+                    version INTEGER NOT NULL DEFAULT 0
                 )
             ''')
             
+            # Полнотекстовый индекс для поиска (rowid = id брони)
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS reservations_fts USING fts5(
+                    name, occasion, phone,
+                    tokenize = 'unicode61', prefix = '2 3'
+                )
+            ''')
+            
+            # Старые базы: добавляем колонки, заполняем их из JSON и строим поисковый индекс
+            self.migrate_reservation_columns(cursor)
+            
+            # Версия брони для оптимистичной блокировки: растет при каждом изменении
+            cursor.execute('PRAGMA table_info(reservations)')
+            if 'version' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute('ALTER TABLE reservations ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            
             # Индекс для быстрого поиска по дате
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_reservations_date 
+                CREATE INDEX IF NOT EXISTS idx_reservations_date
                 ON reservations(date)
             ''')
             
+            # Индекс для выборок по дате и времени (уведомления, сортировка)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_reservations_date_time
+                ON reservations(date, time)
+            ''')
+            
+            # Индекс для проверки занятости стола на дату
+            cursor.execute('DROP INDEX IF EXISTS idx_reservations_date_table')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_reservations_date_table_number
+                ON reservations(date, table_number)
+            ''')
+            
             # ТАБЛИЦА ДЛЯ ПОЛЬЗОВАТЕЛЕЙ
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -63,6 +165,22 @@ class Database:
                 ON waiters(date)
             ''')
             
+            # Закрепление столов за официантами (строка на стол):
+            # "кто обслуживает стол 21" - один запрос по индексу (date, table_number)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS waiter_table_assignments (
+                    date TEXT NOT NULL,
+                    table_number TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (date, table_number, user_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_waiter_table_assignments_user
+                ON waiter_table_assignments(date, user_id)
+            ''')
+            self.migrate_waiter_assignments(cursor)
+            
             # Таблица для отслеживания отправленных уведомлений
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS notifications (
@@ -74,6 +192,7 @@ class Database:
                     FOREIGN KEY (reservation_id) REFERENCES reservations(id)
                 )
             ''')
+            self.migrate_notifications_unique(cursor)
             
             # Таблица для хранения Excel файлов
             cursor.execute('''
@@ -82,16 +201,224 @@ class Database:
                     filename TEXT NOT NULL,
                     date TEXT NOT NULL,
                     created_at TEXT NOT NULL,
-                    filepath TEXT NOT NULL
+                    filepath TEXT NOT NULL,
+                    version INTEGER DEFAULT 0
+                )
+            ''')
+            
+            cursor.execute('PRAGMA table_info(excel_files)')
+            if 'version' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute('ALTER TABLE excel_files ADD COLUMN version INTEGER DEFAULT 0')
+            
+            # Версии броней по датам: растут при каждом изменении броней на дату.
+            # По ним кэши (Excel и т.п.) понимают, что данные устарели
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS reservation_date_versions (
+                    date TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
                 )
             ''')
             
+            # Состояния FSM (незавершенные диалоги): переживают перезапуск бота
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            
+            # Общие настройки всех процессов бота (текущий год, версия ролей)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            
+            # Аренды: какой процесс бота ведущий (выполняет задачи планировщика)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            
             conn.commit()
     
+    def migrate_notifications_unique(self, cursor):
+        """
+        Уникальный индекс (reservation_id, waiter_id, type) для уведомлений.
+        Перед созданием удаляются дубли, накопленные старыми версиями.
+        """
+        cursor.execute('''
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'index' AND name = 'idx_notifications_unique'
+        ''')
+        if cursor.fetchone():
+            return
+        
+        cursor.execute('''
+            DELETE FROM notifications WHERE id NOT IN (
+                SELECT MIN(id) FROM notifications
+                GROUP BY reservation_id, waiter_id, type
+            )
+        ''')
+        if cursor.rowcount > 0:
+            print(f"🧹 Удалено дублей уведомлений: {cursor.rowcount}")
+        cursor.execute('''
+            CREATE UNIQUE INDEX idx_notifications_unique
+            ON notifications(reservation_id, waiter_id, type)
+        ''')
+    
+    def migrate_waiter_assignments(self, cursor):
+        """Перенос столов официантов из JSON-списков waiters.tables (один раз)"""
+        cursor.execute('SELECT 1 FROM waiter_table_assignments LIMIT 1')
+        if cursor.fetchone():
+            return
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO waiter_table_assignments (date, table_number, user_id)
+            SELECT w.date, CAST(t.value AS TEXT), w.user_id
+            FROM waiters w, json_each(w.tables) t
+        ''')
+        if cursor.rowcount > 0:
+            print(f"🔄 Перенесено закреплений столов за официантами: {cursor.rowcount}")
+    
+    def migrate_reservation_columns(self, cursor):
+        """
+        Добавление колонок брони в старую таблицу, заполнение их из JSON
+        и построение поискового индекса. Выполняется один раз: после
+        заполнения повышается версия схемы (в той же транзакции, что и заполнение)
+        """
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= RESERVATION_COLUMNS_SCHEMA_VERSION:
+            return
+        
+        cursor.execute('PRAGMA table_info(reservations)')
+        existing = {row[1] for row in cursor.fetchall()}
+        
+        for column, column_type in RESERVATION_COLUMNS.items():
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE reservations ADD COLUMN {column} {column_type}')
+                print(f"🔧 Добавлена колонка reservations.{column}")
+        
+        # Заполняем колонки у броней, созданных до миграции;
+        # числовые колонки без значения в JSON - 0, как у новых броней
+        assignments = ', '.join(
+            f"{column} = COALESCE(json_extract(data, '$.{column}'), 0)" if column_type.startswith('INTEGER')
+            else f"{column} = json_extract(data, '$.{column}')"
+            for column, column_type in RESERVATION_COLUMNS.items()
+        )
+        cursor.execute(f'UPDATE reservations SET {assignments} WHERE time IS NULL')
+        if cursor.rowcount > 0:
+            print(f"🔧 Колонки заполнены для {cursor.rowcount} броней")
+        
+        # Индекс строится по заполненным колонкам
+        self.rebuild_search_index(cursor)
+        cursor.execute(f'PRAGMA user_version = {RESERVATION_COLUMNS_SCHEMA_VERSION}')
+    
+    @staticmethod
+    def reservation_column_values(reservation_data: dict) -> tuple:
+        """Значения колонок брони в порядке RESERVATION_COLUMNS"""
+        return (
+            reservation_data.get('time', ''),
+            reservation_data.get('table_number', ''),
+            reservation_data.get('phone', ''),
+            reservation_data.get('name', ''),
+            int(reservation_data.get('deposit', 0) or 0),
+            int(reservation_data.get('deposit_paid', 0) or 0),
+            reservation_data.get('occasion', ''),
+        )
+    
+    @staticmethod
+    def normalize_search_text(text: str) -> str:
+        """Приведение текста к виду для поиска: нижний регистр, ё -> е"""
+        return (text or '').lower().replace('ё', 'е')
+    
+    @staticmethod
+    def phone_search_tokens(phone: str) -> str:
+        """
+        Цифры телефона и все их суффиксы через пробел.
+        Префиксный поиск по суффиксам дает поиск по любой части номера:
+        "9126" находит "+79126191729".
+        """
+        digits = re.sub(r'\D', '', phone or '')
+        return ' '.join(digits[i:] for i in range(len(digits)))
+    
+    def index_reservation(self, cursor, reservation_id: int, reservation_data: dict):
+        """Добавление или обновление брони в поисковом индексе"""
+        cursor.execute('DELETE FROM reservations_fts WHERE rowid = ?', (reservation_id,))
+        cursor.execute('''
+            INSERT INTO reservations_fts (rowid, name, occasion, phone)
+            VALUES (?, ?, ?, ?)
+        ''', (
+            reservation_id,
+            self.normalize_search_text(reservation_data.get('name', '')),
+            self.normalize_search_text(reservation_data.get('occasion', '')),
+            self.phone_search_tokens(reservation_data.get('phone', ''))
+        ))
+    
+    def rebuild_search_index(self, cursor):
+        """Построение поискового индекса заново по таблице броней (при миграции схемы)"""
+        cursor.execute('DELETE FROM reservations_fts')
+        cursor.execute('SELECT id, name, occasion, phone FROM reservations')
+        rows = cursor.fetchall()
+        for row in rows:
+            self.index_reservation(cursor, row[0], {
+                'name': row[1], 'occasion': row[2], 'phone': row[3]
+            })
+        if rows:
+            print(f"🔎 Поисковый индекс перестроен: {len(rows)} броней")
+    
+    def build_search_query(self, search_term: str) -> str:
+        """
+        Запрос FTS5 для строки поиска.
+        Номер телефона (только цифры, пробелы, +, -, скобки) ищется по цифрам,
+        остальное - по префиксам слов в имени и поводе.
+        """
+        if re.fullmatch(r'[\d\s+\-()]+', search_term) and re.search(r'\d', search_term):
+            digits = re.sub(r'\D', '', search_term)
+            # 8XXXXXXXXXX хранится как +7XXXXXXXXXX
+            if len(digits) == 11 and digits[0] == '8':
+                digits = '7' + digits[1:]
+            return f'phone : "{digits}"*'
+        
+        words = re.findall(r'\w+', self.normalize_search_text(search_term))
+        return ' '.join(f'{{name occasion}} : "{word}"*' for word in words)
+    
+    def bump_date_version(self, cursor, date: str):
+        """Увеличение версии броней на дату (в транзакции изменения брони)"""
+        cursor.execute('''
+            INSERT INTO reservation_date_versions (date, version) VALUES (?, 1)
+            ON CONFLICT(date) DO UPDATE SET version = version + 1
+        ''', (date,))
+    
+    def bump_waiter_date_versions(self, cursor, user_id: int):
+        """
+        Увеличение версий всех дат, где за официантом закреплены столы:
+        его имя выводится в Excel за эти даты (в транзакции изменения имени)
+        """
+        cursor.execute('''
+            INSERT INTO reservation_date_versions (date, version)
+            SELECT DISTINCT date, 1 FROM waiter_table_assignments WHERE user_id = ?
+            ON CONFLICT(date) DO UPDATE SET version = version + 1
+        ''', (user_id,))
+    
+    def get_date_version(self, date: str) -> int:
+        """Текущая версия броней на дату (0, если брони на дату не менялись)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM reservation_date_versions WHERE date = ?', (date,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+    
     def cleanup_old_reservations(self):
         """Удаление броней старше 2 месяцев"""
         try:
-            with sqlite3.connect(self.db_name) as conn:
+            with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
                 # Вычисляем дату 2 месяца назад
@@ -114,10 +441,20 @@ class Database:
                             DELETE FROM notifications WHERE reservation_id = ?
                         ''', (res[0],))
                     
+                    # Удаляем их из поискового индекса
+                    cursor.execute('''
+                        DELETE FROM reservations_fts WHERE rowid IN (
+                            SELECT id FROM reservations WHERE date < ?
+                        )
+                    ''', (two_months_ago,))
+                    
                     # Удаляем старые брони
                     cursor.execute('''
                         DELETE FROM reservations WHERE date < ?
                     ''', (two_months_ago,))
+                    cursor.execute('''
+                        DELETE FROM reservation_date_versions WHERE date < ?
+                    ''', (two_months_ago,))
                     
                     conn.commit()
                     print(f"✅ Удалено {len(old_reservations)} старых броней")
@@ -128,7 +465,7 @@ class Database:
     def cleanup_old_excel_files(self):
         """Удаление старых Excel файлов (старше 2 месяцев)"""
         try:
-            with sqlite3.connect(self.db_name) as conn:
+            with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
                 two_months_ago = (datetime.now() - timedelta(days=60)).strftime("%Y-%m-%d")
@@ -159,24 +496,50 @@ class Database:
     
     # ====== МЕТОДЫ ДЛЯ БРОНЕЙ ======
     
+    def insert_reservation(self, cursor, reservation_data: dict) -> int:
+        """Вставка брони с поисковым индексом (в транзакции вызывающего)"""
+        created_at = datetime.now().isoformat()
+        data_json = json.dumps(reservation_data, ensure_ascii=False)
+        date = reservation_data.get('date', '')
+        
+        cursor.execute('''
+            INSERT INTO reservations (
+                data, created_at, date, time, table_number, phone,
+                name, deposit, deposit_paid, occasion
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (data_json, created_at, date) + self.reservation_column_values(reservation_data))
+        reservation_id = cursor.lastrowid
+        self.index_reservation(cursor, reservation_id, reservation_data)
+        return reservation_id
+    
     def add_reservation(self, reservation_data):
         """Добавление брони"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
-            created_at = datetime.now().isoformat()
-            data_json = json.dumps(reservation_data, ensure_ascii=False)
-            date = reservation_data.get('date', '')
-            
-            cursor.execute(
-                'INSERT INTO reservations (data, created_at, date) VALUES (?, ?, ?)',
-                (data_json, created_at, date)
-            )
+            reservation_id = self.insert_reservation(cursor, reservation_data)
+            self.bump_date_version(cursor, reservation_data.get('date', ''))
+            conn.commit()
+            return reservation_id
+    
+    def add_reservations_bulk(self, reservations: list) -> list:
+        """
+        Добавление списка броней одной транзакцией (импорт).
+        Либо добавляются все брони, либо ни одной.
+        Возвращает ID броней в том же порядке.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            reservation_ids = [self.insert_reservation(cursor, res) for res in reservations]
+            for date in {res.get('date', '') for res in reservations}:
+                self.bump_date_version(cursor, date)
             conn.commit()
-            return cursor.lastrowid
+            print(f"📥 Импортировано броней: {len(reservation_ids)}")
+            return reservation_ids
     
     def get_all_reservations(self):
         """Получение всех броней"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT id, data, created_at FROM reservations ORDER BY date DESC, id DESC')
             rows = cursor.fetchall()
@@ -194,7 +557,7 @@ class Database:
         today = datetime.now(tz).strftime("%Y-%m-%d")
         print(f"🔍 Запрос броней на дату: {today}")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT id, data FROM reservations WHERE date = ?', (today,))
             rows = cursor.fetchall()
@@ -210,9 +573,9 @@ class Database:
     
     def get_reservations_by_date(self, date):
         """Получение броней по конкретной дате"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT id, data FROM reservations WHERE date = ? ORDER BY data->>"$.time"', (date,))
+            cursor.execute('SELECT id, data FROM reservations WHERE date = ? ORDER BY time', (date,))
             rows = cursor.fetchall()
             
             date_reservations = []
@@ -223,63 +586,247 @@ class Database:
             
             return date_reservations
     
-    def search_reservations(self, search_term):
-        """Поиск броней"""
-        all_res = self.get_all_reservations()
-        results = []
-        search_term_lower = search_term.lower()
+    def get_reservations_from_date(self, date: str) -> list:
+        """Получение всех броней начиная с указанной даты (по дате и времени)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, data FROM reservations
+                WHERE date >= ?
+                ORDER BY date, time
+            ''', (date,))
+            rows = cursor.fetchall()
+            
+            reservations = []
+            for row in rows:
+                res_data = json.loads(row[1])
+                res_data['id'] = row[0]
+                reservations.append(res_data)
+            
+            return reservations
+    
+    def get_reservations_in_range(self, start_date: str, end_date: str, table_number: str = None,
+                                  after: tuple = None, before: tuple = None, limit: int = None) -> list:
+        """
+        Получение броней за период [start_date, end_date] по индексу дат
+        (по дате, времени и ID).
+        Постраничный просмотр по ключу (keyset): after / before - ключ
+        (date, time, id) последней / первой брони соседней страницы,
+        limit - размер страницы. Брони всегда возвращаются по возрастанию.
+        """
+        conditions = ['date BETWEEN ? AND ?']
+        params = [start_date, end_date]
+        
+        if table_number is not None:
+            conditions.append('table_number = ?')
+            params.append(table_number)
+        # Отдельное условие на дату сужает диапазон поиска по индексу
+        if after is not None:
+            conditions.append('date >= ? AND (date, time, id) > (?, ?, ?)')
+            params.extend((after[0],) + tuple(after))
+        if before is not None:
+            conditions.append('date <= ? AND (date, time, id) < (?, ?, ?)')
+            params.extend((before[0],) + tuple(before))
+        
+        # Страница "назад" выбирается с конца и разворачивается
+        order = 'DESC' if before is not None and after is None else 'ASC'
+        query = f'''
+            SELECT id, data FROM reservations
+            WHERE {' AND '.join(conditions)}
+            ORDER BY date {order}, time {order}, id {order}
+        '''
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            if order == 'DESC':
+                rows.reverse()
+            
+            reservations = []
+            for row in rows:
+                res_data = json.loads(row[1])
+                res_data['id'] = row[0]
+                reservations.append(res_data)
+            
+            return reservations
+    
+    def get_table_reservations_for_date(self, table_number: str, date: str) -> list:
+        """Получение броней на конкретный стол в конкретную дату (по индексу)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, data FROM reservations 
+                WHERE date = ? AND table_number = ?
+            ''', (date, table_number))
+            rows = cursor.fetchall()
+            
+            table_reservations = []
+            for row in rows:
+                res_data = json.loads(row[1])
+                res_data['id'] = row[0]
+                table_reservations.append(res_data)
+            
+            return table_reservations
+    
+    def get_table_times_for_date(self, date: str) -> list:
+        """Столы и время броней на дату (по индексу, без разбора JSON)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, table_number, time FROM reservations 
+                WHERE date = ?
+            ''', (date,))
+            return [
+                {'id': row[0], 'table_number': row[1], 'time': row[2]}
+                for row in cursor.fetchall()
+            ]
+    
+    def search_reservations(self, search_term: str, limit: int = None, offset: int = 0) -> list:
+        """Поиск броней по имени, телефону и поводу (новые даты первыми)"""
+        query = self.build_search_query(search_term)
+        if not query:
+            return []
         
-        for r in all_res:
-            if (search_term_lower in r.get('name', '').lower() or 
-                search_term in r.get('phone', '') or
-                search_term_lower in r.get('occasion', '').lower()):
-                results.append(r)
-        return results
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT r.id, r.data FROM reservations_fts f
+                JOIN reservations r ON r.id = f.rowid
+                WHERE reservations_fts MATCH ?
+                ORDER BY r.date DESC, r.id DESC
+                LIMIT ? OFFSET ?
+            ''', (query, limit if limit is not None else -1, offset))
+            rows = cursor.fetchall()
+            
+            results = []
+            for row in rows:
+                res_data = json.loads(row[1])
+                res_data['id'] = row[0]
+                results.append(res_data)
+            return results
+    
+    def count_search_reservations(self, search_term: str) -> int:
+        """Количество броней, подходящих под поиск"""
+        query = self.build_search_query(search_term)
+        if not query:
+            return 0
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT COUNT(*) FROM reservations_fts WHERE reservations_fts MATCH ?',
+                (query,)
+            )
+            return cursor.fetchone()[0]
     
     def get_reservation_by_id(self, reservation_id):
         """Получение брони по ID"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT data FROM reservations WHERE id = ?', (reservation_id,))
+            cursor.execute('SELECT data, version FROM reservations WHERE id = ?', (reservation_id,))
             row = cursor.fetchone()
             if row:
                 res_data = json.loads(row[0])
                 res_data['id'] = reservation_id
+                res_data['version'] = row[1]
                 return res_data
             return None
     
-    def update_reservation(self, reservation_id, updated_data):
-        """Обновление брони"""
-        current = self.get_reservation_by_id(reservation_id)
-        if not current:
-            return False
-        
-        current.update(updated_data)
+    def update_reservation(self, reservation_id, updated_data, expected: dict = None) -> dict:
+        """
+        Обновление полей брони одним оператором UPDATE (compare-and-swap):
+        меняются только поля из updated_data (json_set), остальные поля,
+        измененные параллельно другим администратором или процессом, не затираются.
+        expected - значения полей, которые видел пользователь ({поле: значение});
+        если какое-то из них с тех пор изменили, обновление не выполняется.
+        Возвращает {'updated', 'conflicts' ({поле: текущее значение}), 'reservation'}.
+        """
+        result = {'updated': False, 'conflicts': {}, 'reservation': None}
+        updated_data = {k: v for k, v in updated_data.items() if k not in ('id', 'version')}
+        expected = expected or {}
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
-            save_data = current.copy()
-            if 'id' in save_data:
-                del save_data['id']
+            # Блокировка записи до чтения: старая дата и проверка полей
+            # относятся к той же версии брони, что и UPDATE
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT data FROM reservations WHERE id = ?', (reservation_id,))
+            row = cursor.fetchone()
+            if not row:
+                conn.rollback()
+                return result
             
-            data_json = json.dumps(save_data, ensure_ascii=False)
-            cursor.execute(
-                'UPDATE reservations SET data = ? WHERE id = ?',
-                (data_json, reservation_id)
+            current = json.loads(row[0])
+            conflicts = {
+                field: current.get(field)
+                for field, value in expected.items()
+                if current.get(field) != value
+            }
+            if conflicts:
+                conn.rollback()
+                result.update(conflicts=conflicts, reservation=self.get_reservation_by_id(reservation_id))
+                return result
+            
+            old_date = current.get('date', '')
+            new_data = {**current, **updated_data}
+            
+            set_args = []
+            for field, value in updated_data.items():
+                set_args += [f'$."{field}"', json.dumps(value, ensure_ascii=False)]
+            where_args = []
+            for field, value in expected.items():
+                where_args += [f'$."{field}"', json.dumps(value, ensure_ascii=False)]
+            
+            json_set = ', '.join(['?, json(?)'] * len(updated_data))
+            checks = ''.join(
+                ' AND json_extract(data, ?) IS json_extract(?, \'$\')' for _ in expected
             )
+            cursor.execute(f'''
+                UPDATE reservations
+                SET data = {f"json_set(data, {json_set})" if updated_data else "data"},
+                    date = ?, time = ?, table_number = ?, phone = ?,
+                    name = ?, deposit = ?, deposit_paid = ?, occasion = ?,
+                    version = version + 1
+                WHERE id = ?{checks}
+            ''', set_args + [new_data.get('date', '')]
+                  + list(self.reservation_column_values(new_data))
+                  + [reservation_id] + where_args)
+            
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return result
+            
+            self.index_reservation(cursor, reservation_id, new_data)
+            self.bump_date_version(cursor, old_date)
+            if new_data.get('date', '') != old_date:
+                self.bump_date_version(cursor, new_data.get('date', ''))
             conn.commit()
-            return cursor.rowcount > 0
+        
+        result.update(updated=True, reservation=self.get_reservation_by_id(reservation_id))
+        return result
     
     def delete_reservation(self, reservation_id):
         """Удаление брони"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             # Удаляем связанные уведомления
             cursor.execute('DELETE FROM notifications WHERE reservation_id = ?', (reservation_id,))
+            # Удаляем из поискового индекса
+            cursor.execute('DELETE FROM reservations_fts WHERE rowid = ?', (reservation_id,))
+            # Запоминаем дату, чтобы обновить ее версию
+            cursor.execute('SELECT date FROM reservations WHERE id = ?', (reservation_id,))
+            row = cursor.fetchone()
             # Удаляем саму бронь
             cursor.execute('DELETE FROM reservations WHERE id = ?', (reservation_id,))
+            deleted = cursor.rowcount > 0
+            if row:
+                self.bump_date_version(cursor, row[0])
             conn.commit()
-            return cursor.rowcount > 0
+            return deleted
     
     # ====== МЕТОДЫ ДЛЯ ОФИЦИАНТОВ (С ДАТАМИ) ======
     
@@ -289,7 +836,7 @@ class Database:
             tz = pytz.timezone("Asia/Yekaterinburg")
             date = datetime.now(tz).strftime("%Y-%m-%d")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             created_at = datetime.now().isoformat()
             tables_json = json.dumps(tables, ensure_ascii=False)
@@ -298,6 +845,16 @@ class Database:
                 INSERT OR REPLACE INTO waiters (user_id, name, tables, date, created_at)
                 VALUES (?, ?, ?, ?, ?)
             ''', (user_id, name, tables_json, date, created_at))
+            # Список столов и закрепления меняются в одной транзакции
+            cursor.execute('''
+                DELETE FROM waiter_table_assignments WHERE date = ? AND user_id = ?
+            ''', (date, user_id))
+            cursor.executemany('''
+                INSERT OR IGNORE INTO waiter_table_assignments (date, table_number, user_id)
+                VALUES (?, ?, ?)
+            ''', [(date, str(table), user_id) for table in tables])
+            # Официанты выводятся в Excel за дату - выгрузку нужно пересобрать
+            self.bump_date_version(cursor, date)
             conn.commit()
             print(f"👤 Официант {user_id} назначен на столы {tables} на дату {date}")
     
@@ -307,7 +864,7 @@ class Database:
             tz = pytz.timezone("Asia/Yekaterinburg")
             date = datetime.now(tz).strftime("%Y-%m-%d")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT tables FROM waiters 
@@ -324,20 +881,13 @@ class Database:
             tz = pytz.timezone("Asia/Yekaterinburg")
             date = datetime.now(tz).strftime("%Y-%m-%d")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT user_id, tables FROM waiters 
-                WHERE date = ?
-            ''', (date,))
-            rows = cursor.fetchall()
-            
-            waiters = []
-            for row in rows:
-                tables = json.loads(row[1])
-                if table_number in tables:
-                    waiters.append(row[0])
-            return waiters
+                SELECT user_id FROM waiter_table_assignments
+                WHERE date = ? AND table_number = ?
+            ''', (date, table_number))
+            return [row[0] for row in cursor.fetchall()]
     
     def get_waiters_for_table_on_date_with_names(self, table_number: str, date: str = None) -> list:
         """
@@ -348,27 +898,40 @@ class Database:
             tz = pytz.timezone("Asia/Yekaterinburg")
             date = datetime.now(tz).strftime("%Y-%m-%d")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT user_id, name, tables FROM waiters 
-                WHERE date = ?
+                SELECT COALESCE(NULLIF(u.first_name, ''), w.name)
+                FROM waiter_table_assignments a
+                JOIN waiters w ON w.user_id = a.user_id AND w.date = a.date
+                LEFT JOIN users u ON u.user_id = a.user_id
+                WHERE a.date = ? AND a.table_number = ?
+                ORDER BY w.id
+            ''', (date, table_number))
+            return [row[0] for row in cursor.fetchall()]
+    
+    def get_table_assignment_map(self, date: str) -> dict:
+        """
+        Закрепление столов за официантами на дату одним запросом:
+        {номер стола: [имена официантов]}.
+        Имя берется из таблицы users, если оно там есть.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT a.table_number, COALESCE(NULLIF(u.first_name, ''), w.name)
+                FROM waiter_table_assignments a
+                JOIN waiters w ON w.user_id = a.user_id AND w.date = a.date
+                LEFT JOIN users u ON u.user_id = a.user_id
+                WHERE a.date = ?
+                ORDER BY w.id
             ''', (date,))
-            rows = cursor.fetchall()
             
-            waiter_names = []
-            for row in rows:
-                tables = json.loads(row[2])
-                if table_number in tables:
-                    # Получаем имя из таблицы users для единообразия
-                    cursor.execute('SELECT first_name FROM users WHERE user_id = ?', (row[0],))
-                    user_row = cursor.fetchone()
-                    if user_row and user_row[0]:
-                        waiter_names.append(user_row[0])
-                    else:
-                        waiter_names.append(row[1])
-            
-            return waiter_names
+            assignment = {}
+            for table_number, name in cursor.fetchall():
+                assignment.setdefault(table_number, []).append(name)
+            
+            return assignment
     
     def get_all_waiters_for_date(self, date: str = None) -> list:
         """Получение всех официантов на конкретную дату"""
@@ -376,7 +939,7 @@ class Database:
             tz = pytz.timezone("Asia/Yekaterinburg")
             date = datetime.now(tz).strftime("%Y-%m-%d")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT user_id, name, tables FROM waiters 
@@ -400,31 +963,73 @@ class Database:
             tz = pytz.timezone("Asia/Yekaterinburg")
             date = datetime.now(tz).strftime("%Y-%m-%d")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 DELETE FROM waiters WHERE user_id = ? AND date = ?
             ''', (user_id, date))
+            removed = cursor.rowcount > 0
+            cursor.execute('''
+                DELETE FROM waiter_table_assignments WHERE date = ? AND user_id = ?
+            ''', (date, user_id))
+            if removed:
+                self.bump_date_version(cursor, date)
             conn.commit()
-            return cursor.rowcount > 0
+            return removed
     
     # ====== МЕТОДЫ ДЛЯ УВЕДОМЛЕНИЙ ======
     
     def save_notification(self, reservation_id: int, waiter_id: int, notif_type: str):
         """Сохранение информации об отправленном уведомлении"""
-        with sqlite3.connect(self.db_name) as conn:
+        self.claim_notification(reservation_id, waiter_id, notif_type)
+    
+    def claim_notification(self, reservation_id: int, waiter_id: int, notif_type: str) -> bool:
+        """
+        Захват уведомления перед отправкой.
+        True - уведомление еще не отправлялось и теперь закреплено за вызывающим;
+        False - его уже отправил (или отправляет) другой запуск задачи.
+        """
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             sent_at = datetime.now().isoformat()
             
             cursor.execute('''
-                INSERT INTO notifications (reservation_id, waiter_id, type, sent_at)
+                INSERT OR IGNORE INTO notifications (reservation_id, waiter_id, type, sent_at)
                 VALUES (?, ?, ?, ?)
             ''', (reservation_id, waiter_id, notif_type, sent_at))
             conn.commit()
+            return cursor.rowcount == 1
+    
+    def release_notification(self, reservation_id: int, waiter_id: int, notif_type: str):
+        """Снятие захвата, если уведомление отправить не удалось"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM notifications
+                WHERE reservation_id = ? AND waiter_id = ? AND type = ?
+            ''', (reservation_id, waiter_id, notif_type))
+            conn.commit()
+    
+    def get_sent_notifications(self, reservation_ids: list) -> set:
+        """Все отправленные уведомления по броням: {(reservation_id, waiter_id, type)}"""
+        reservation_ids = list(reservation_ids)
+        sent = set()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Пачками, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(reservation_ids), 500):
+                chunk = reservation_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT reservation_id, waiter_id, type FROM notifications
+                    WHERE reservation_id IN ({placeholders})
+                ''', chunk)
+                sent.update(cursor.fetchall())
+        return sent
     
     def check_notification_sent(self, reservation_id: int, waiter_id: int, notif_type: str) -> bool:
         """Проверка, отправлялось ли уже такое уведомление"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id FROM notifications 
@@ -441,12 +1046,12 @@ class Database:
         target_date = target_time.strftime("%Y-%m-%d")
         target_time_str = target_time.strftime("%H:%M")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, data FROM reservations 
-                WHERE date = ? AND data LIKE ?
-            ''', (target_date, f'%"time": "{target_time_str}"%'))
+                WHERE date = ? AND time = ?
+            ''', (target_date, target_time_str))
             
             rows = cursor.fetchall()
             upcoming = []
@@ -466,12 +1071,12 @@ class Database:
         past_date = past_time.strftime("%Y-%m-%d")
         past_time_str = past_time.strftime("%H:%M")
         
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, data FROM reservations 
-                WHERE date = ? AND data LIKE ?
-            ''', (past_date, f'%"time": "{past_time_str}"%'))
+                WHERE date = ? AND time = ?
+            ''', (past_date, past_time_str))
             
             rows = cursor.fetchall()
             past = []
@@ -486,12 +1091,12 @@ class Database:
     
     def add_user(self, user_id: int, username: str, first_name: str, is_admin: int = 0):
         """Добавление или обновление пользователя"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             created_at = datetime.now().isoformat()
             
             # Проверяем, существует ли пользователь
-            cursor.execute('SELECT is_waiter FROM users WHERE user_id = ?', (user_id,))
+            cursor.execute('SELECT first_name FROM users WHERE user_id = ?', (user_id,))
             existing = cursor.fetchone()
             
             if existing:
@@ -501,6 +1106,8 @@ class Database:
                     SET username = ?, first_name = ?, is_admin = ?, created_at = ?
                     WHERE user_id = ?
                 ''', (username, first_name, is_admin, created_at, user_id))
+                if existing[0] != first_name:
+                    self.bump_waiter_date_versions(cursor, user_id)
             else:
                 # Добавляем нового пользователя
                 cursor.execute('''
@@ -508,11 +1115,13 @@ class Database:
                     VALUES (?, ?, ?, ?, 0, ?)
                 ''', (user_id, username, first_name, is_admin, created_at))
             
+            self.bump_setting_counter(cursor, 'roles_version')
             conn.commit()
+        self.notify_role_changed(user_id)
     
     def get_user(self, user_id: int) -> dict:
         """Получение данных пользователя"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
             row = cursor.fetchone()
@@ -530,34 +1139,64 @@ class Database:
     
     def set_admin(self, user_id: int, is_admin: bool):
         """Установка прав администратора"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE users SET is_admin = ? WHERE user_id = ?
             ''', (1 if is_admin else 0, user_id))
+            updated = cursor.rowcount > 0
+            self.bump_setting_counter(cursor, 'roles_version')
             conn.commit()
-            return cursor.rowcount > 0
+        self.notify_role_changed(user_id)
+        return updated
     
     def set_waiter(self, user_id: int, is_waiter: bool):
         """Установка прав официанта"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE users SET is_waiter = ? WHERE user_id = ?
             ''', (1 if is_waiter else 0, user_id))
+            updated = cursor.rowcount > 0
+            self.bump_setting_counter(cursor, 'roles_version')
+            conn.commit()
+        self.notify_role_changed(user_id)
+        return updated
+    
+    def update_user_name(self, user_id: int, first_name: str):
+        """Изменение имени пользователя"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE users SET first_name = ? WHERE user_id = ?
+            ''', (first_name, user_id))
+            updated = cursor.rowcount > 0
+            # Выгрузки Excel с прежним именем официанта нужно пересобрать
+            if updated:
+                self.bump_waiter_date_versions(cursor, user_id)
             conn.commit()
-            return cursor.rowcount > 0
+            return updated
     
     def get_all_users(self) -> list:
         """Получение всех пользователей"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT user_id FROM users')
             return [row[0] for row in cursor.fetchall()]
     
+    def get_staff_user_ids(self, main_admin_id: int) -> list:
+        """ID всех администраторов и официантов одним запросом"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id FROM users
+                WHERE is_admin = 1 OR is_waiter = 1 OR user_id = ?
+            ''', (main_admin_id,))
+            return [row[0] for row in cursor.fetchall()]
+    
     def get_all_admins(self, main_admin_id: int) -> list:
         """Получение всех администраторов"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT user_id, first_name FROM users WHERE is_admin = 1')
             admins = []
@@ -571,7 +1210,7 @@ class Database:
     
     def get_all_waiters(self) -> list:
         """Получение всех официантов из таблицы users"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT user_id, first_name FROM users WHERE is_waiter = 1')
             rows = cursor.fetchall()
@@ -582,7 +1221,7 @@ class Database:
         Получение всех пользователей с ролью официанта (даже если у них нет столов на сегодня)
         Этот метод нужен для отображения в списке официантов
         """
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT user_id, first_name FROM users 
@@ -599,23 +1238,148 @@ class Database:
                 })
             return users
     
+    # ====== ОБЩИЕ НАСТРОЙКИ И ВЕДУЩИЙ ПРОЦЕСС ======
+    
+    def get_settings(self) -> dict:
+        """Все общие настройки (ключ -> значение строкой)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT key, value FROM settings')
+            return dict(cursor.fetchall())
+    
+    def set_setting(self, key: str, value):
+        """Запись общей настройки"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO settings (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (key, str(value)))
+            conn.commit()
+    
+    def bump_setting(self, key: str):
+        """Увеличение счетчика в настройках отдельной транзакцией"""
+        with self.get_connection() as conn:
+            self.bump_setting_counter(conn.cursor(), key)
+            conn.commit()
+    
+    def bump_setting_counter(self, cursor, key: str):
+        """Увеличение счетчика в настройках (в транзакции изменения)"""
+        cursor.execute('''
+            INSERT INTO settings (key, value) VALUES (?, '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        ''', (key,))
+    
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """
+        Захват или продление аренды на ttl секунд.
+        True - аренда у holder; False - ее держит другой процесс и она не истекла.
+        """
+        now = datetime.now().timestamp()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at <= ?
+            ''', (name, holder, now + ttl, now))
+            conn.commit()
+            return cursor.rowcount == 1
+    
+    def release_lease(self, name: str, holder: str):
+        """Освобождение аренды (при остановке процесса)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+            conn.commit()
+    
+    # ====== МЕТОДЫ ДЛЯ СОСТОЯНИЙ FSM ======
+    
+    def get_fsm_record(self, key: str):
+        """(state, data в JSON) по ключу FSM (None, если записи нет или она истекла)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT state, data FROM fsm_storage WHERE key = ? AND expires_at > ?
+            ''', (key, datetime.now().timestamp()))
+            row = cursor.fetchone()
+            return (row[0], row[1]) if row else None
+    
+    def save_fsm_values(self, records: list):
+        """
+        Запись изменений FSM одной транзакцией: records - список
+        (key, колонка 'state' или 'data', значение, expires_at) в порядке изменений.
+        Каждое изменение - один UPSERT своей колонки: другая колонка
+        не затирается, а у истекшей записи сбрасывается.
+        Записи без состояния и без данных удаляются.
+        """
+        now = datetime.now().timestamp()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for key, column, value, expires_at in records:
+                other = 'data' if column == 'state' else 'state'
+                other_empty = "'{}'" if other == 'data' else 'NULL'
+                cursor.execute(f'''
+                    INSERT INTO fsm_storage (key, {column}, {other}, expires_at) VALUES (?, ?, {other_empty}, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        {column} = excluded.{column},
+                        {other} = CASE WHEN fsm_storage.expires_at > ? THEN fsm_storage.{other} ELSE {other_empty} END,
+                        expires_at = excluded.expires_at
+                ''', (key, value, expires_at, now))
+            cursor.executemany('''
+                DELETE FROM fsm_storage WHERE key = ? AND state IS NULL AND data = '{}'
+            ''', [(key,) for key in dict.fromkeys(record[0] for record in records)])
+            conn.commit()
+    
+    def cleanup_expired_fsm_records(self) -> int:
+        """Удаление истекших состояний FSM"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM fsm_storage WHERE expires_at <= ?', (datetime.now().timestamp(),))
+            conn.commit()
+            if cursor.rowcount > 0:
+                print(f"🧹 Удалено истекших состояний FSM: {cursor.rowcount}")
+            return cursor.rowcount
+    
     # ====== МЕТОДЫ ДЛЯ EXCEL ФАЙЛОВ ======
     
-    def save_excel_file(self, filename: str, date: str, filepath: str):
-        """Сохранение информации об Excel файле"""
-        with sqlite3.connect(self.db_name) as conn:
+    def save_excel_file(self, filename: str, date: str, filepath: str, version: int = 0):
+        """
+        Сохранение информации об Excel файле.
+        На каждую дату хранится один файл: прежние записи (и их файлы,
+        если путь другой) удаляются.
+        """
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             created_at = datetime.now().isoformat()
             
+            cursor.execute('SELECT filepath FROM excel_files WHERE date = ?', (date,))
+            for row in cursor.fetchall():
+                if row[0] != filepath and os.path.exists(row[0]):
+                    os.remove(row[0])
+            cursor.execute('DELETE FROM excel_files WHERE date = ?', (date,))
+            
             cursor.execute('''
-                INSERT INTO excel_files (filename, date, created_at, filepath)
-                VALUES (?, ?, ?, ?)
-            ''', (filename, date, created_at, filepath))
+                INSERT INTO excel_files (filename, date, created_at, filepath, version)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (filename, date, created_at, filepath, version))
             conn.commit()
     
+    def get_excel_file(self, date: str):
+        """Последний Excel файл за дату: (filepath, version) или None"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT filepath, version FROM excel_files
+                WHERE date = ?
+                ORDER BY created_at DESC
+                LIMIT 1
+            ''', (date,))
+            return cursor.fetchone()
+    
     def get_excel_files_by_date(self, date: str) -> list:
         """Получение всех Excel файлов за дату"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT filename, filepath, created_at FROM excel_files 
@@ -625,5 +1389,98 @@ class Database:
             
             return cursor.fetchall()
 
+
+class AsyncDatabase:
+    """
+    Асинхронная обертка над Database: у каждого метода Database есть
+    awaitable-версия с тем же именем и аргументами.
+    Запись выполняется в одном выделенном потоке (очередь ThreadPoolExecutor),
+    чтение - в небольшом пуле потоков. Event loop aiogram при этом не блокируется.
+    """
+    
+    # Методы, которые пишут в БД и должны выполняться строго по очереди
+    WRITE_METHODS = {
+        'cleanup_old_reservations',
+        'cleanup_old_excel_files',
+        'add_reservation',
+        'add_reservations_bulk',
+        'update_reservation',
+        'delete_reservation',
+        'set_waiter_tables_for_date',
+        'remove_waiter_for_date',
+        'save_notification',
+        'claim_notification',
+        'release_notification',
+        'add_user',
+        'set_admin',
+        'set_waiter',
+        'update_user_name',
+        'save_excel_file',
+        'save_fsm_values',
+        'cleanup_expired_fsm_records',
+        'set_setting',
+        'bump_setting',
+        'acquire_lease',
+        'release_lease',
+    }
+    
+    def __init__(self, database: Database, readers: int = 4):
+        self.db = database
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        # Метрики времени выполнения методов (QueryMetrics), задаются ботом
+        self.metrics = None
+    
+    def _timed(self, observer: str, name: str, func, /, *args, **kwargs):
+        """
+        Выполнение в потоке БД с учетом времени в метриках.
+        observer - метод QueryMetrics: 'observe' для методов Database,
+        'observe_task' для прочей работы в пуле (Excel, картинки, планировщик)
+        """
+        metrics = self.metrics
+        if metrics is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            getattr(metrics, observer)(name, time.perf_counter() - started, failed)
+    
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+        
+        executor = self._writer if name in self.WRITE_METHODS else self._readers
+        
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(self._timed, 'observe', name, method, *args, **kwargs))
+        
+        # Запоминаем обертку, чтобы не создавать ее при каждом вызове
+        setattr(self, name, wrapper)
+        return wrapper
+    
+    async def close(self):
+        """Остановка бота: дожидаемся запросов в очереди и закрываем соединения"""
+        loop = asyncio.get_running_loop()
+        for executor in (self._writer, self._readers):
+            await loop.run_in_executor(None, functools.partial(executor.shutdown, wait=True))
+        self.db.close()
+    
+    async def run(self, func, *args, **kwargs):
+        """
+        Выполнение произвольной блокирующей функции (например, выгрузки Excel) в пуле чтения.
+        Время учитывается отдельно от запросов к БД (QueryMetrics.observe_task)
+        """
+        loop = asyncio.get_running_loop()
+        name = getattr(func, '__name__', 'run')
+        return await loop.run_in_executor(self._readers, functools.partial(self._timed, 'observe_task', name, func, *args, **kwargs))
+
 # Создаем глобальный экземпляр базы данных
-db = Database()
\ No newline at end of file
+db = Database()
+async_db = AsyncDatabase(db)
\ No newline at end of file
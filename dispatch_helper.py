@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class ChatOrderMiddleware(BaseMiddleware):
+    """
+    Очередь обработки апдейтов: апдейты разных чатов обрабатываются
+    параллельно (не больше max_workers одновременно), апдейты одного чата -
+    строго по очереди в порядке поступления (важно для шагов FSM).
+    Считает глубину очереди и время ожидания.
+    Регистрируется до FSMContextMiddleware диспетчера: место в очереди чата
+    занимается до первого await, и состояние FSM читается уже в свою очередь.
+    """
+
+    def __init__(self, max_workers: int = 32, slow_wait: float = 5.0):
+        self.max_workers = max_workers
+        self.slow_wait = slow_wait
+        # Семафор создается в цикле событий бота (при первом апдейте)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # chat_id -> [lock, апдейтов чата в очереди и в обработке]
+        self._chats: Dict[int, list] = {}
+
+        # Гистограмма времени ожидания (metrics_helper.Histogram), задается снаружи
+        self.wait_histogram = None
+
+        self.waiting = 0
+        self.active = 0
+        self.max_waiting = 0
+        self.max_active = 0
+        self.processed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @staticmethod
+    def get_chat_key(data: Dict[str, Any]) -> Optional[int]:
+        """Чат апдейта (или пользователь, если чата нет)"""
+        chat = data.get('event_chat')
+        if chat is not None:
+            return chat.id
+        user = data.get('event_from_user')
+        return user.id if user is not None else None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        key = self.get_chat_key(data)
+        entry = None
+        if key is not None:
+            entry = self._chats.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+
+        queued = time.monotonic()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        in_queue = True
+        try:
+            # Сначала ждем своей очереди в чате, потом свободного обработчика:
+            # апдейт, ожидающий предыдущий в своем чате, не занимает обработчик
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self._semaphore:
+                    self._record_wait(time.monotonic() - queued)
+                    self.waiting -= 1
+                    in_queue = False
+                    self.active += 1
+                    self.max_active = max(self.max_active, self.active)
+                    try:
+                        # Если middleware стоит после FSMContextMiddleware, состояние
+                        # прочитано до очереди чата: предыдущий апдейт мог его изменить
+                        if 'state' in data:
+                            data['raw_state'] = await data['state'].get_state()
+                        return await handler(event, data)
+                    finally:
+                        self.active -= 1
+                        self.processed += 1
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if in_queue:
+                self.waiting -= 1
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._chats.pop(key, None)
+
+    def _record_wait(self, waited: float):
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        if self.wait_histogram is not None:
+            self.wait_histogram.observe(waited)
+        if waited >= self.slow_wait:
+            print(f"⚠️ Апдейт ждал обработки {waited:.1f} с (в очереди {self.waiting}, в работе {self.active})")
+
+    def stats(self) -> dict:
+        """Метрики очереди"""
+        return {
+            'workers': self.max_workers,
+            'active': self.active,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'max_active': self.max_active,
+            'chats': len(self._chats),
+            'processed': self.processed,
+            'avg_wait': self.wait_total / self.processed if self.processed else 0.0,
+            'max_wait': self.wait_max,
+        }
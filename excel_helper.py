@@ -1,27 +1,59 @@
 import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
 from openpyxl.utils import get_column_letter
-import datetime
+import asyncio
+import calendar
 import os
-from typing import List, Dict
+import time
+import uuid
+from copy import copy
+from typing import List, Dict, Optional, Set
+
+# Заголовки столбцов
+HEADERS = [
+    "ID", "Дата", "Стол", "Имя гостя", "Телефон",
+    "Повод", "Время", "Гостей", "Депозит (₽)", "Статус депозита", "Официант"
+]
+
+# Именованные стили книги
+STYLE_HEADER = "res_header"
+STYLE_CELL = "res_cell"
+STYLE_GREEN = "res_green"
+STYLE_RED = "res_red"
+
+# Выгрузки за период (удаляются после отправки, забытые - ежедневной очисткой)
+RANGE_FILES_DIR = os.path.join("excel_files", "ranges")
 
 class ExcelGenerator:
     """Класс для создания Excel таблиц с бронями"""
     
     @staticmethod
-    def get_waiter_name_for_table(table_number: str, date: str, db) -> str:
+    def load_waiter_maps(reservations: List[Dict], db) -> Dict[str, Dict[str, List[str]]]:
         """
-        Получает имя официанта для конкретного стола на указанную дату
+        Закрепление столов за официантами для всех дат выгрузки:
+        {дата: {стол: [имена]}} - один запрос на дату, а не на строку
         """
-        try:
-            waiters = db.get_waiters_for_table_on_date_with_names(table_number, date)
-            if waiters:
-                # Если несколько официантов на один стол, объединяем имена
-                return ", ".join(waiters)
-            return ""
-        except Exception as e:
-            print(f"Ошибка при получении имени официанта: {e}")
-            return ""
+        waiter_maps = {}
+        for date in {res.get('date', '') for res in reservations}:
+            try:
+                waiter_maps[date] = db.get_table_assignment_map(date)
+            except Exception as e:
+                print(f"Ошибка при получении имен официантов: {e}")
+                waiter_maps[date] = {}
+        return waiter_maps
+    
+    @staticmethod
+    def get_waiter_name_for_table(table_number: str, waiter_map: Dict[str, List[str]]) -> str:
+        """
+        Имя официанта для стола по карте закрепления столов
+        """
+        waiters = waiter_map.get(table_number)
+        if waiters:
+            # Если несколько официантов на один стол, объединяем имена
+            return ", ".join(waiters)
+        return ""
     
     @staticmethod
     def get_deposit_status_symbol(deposit: int, deposit_paid: int) -> str:
@@ -33,55 +65,98 @@ class ExcelGenerator:
         return ""
     
     @staticmethod
-    def create_reservation_file(reservations: List[Dict], date: str, db=None) -> str:
+    def get_file_path(date: str) -> str:
+        """Путь к файлу выгрузки за дату (один файл на день)"""
+        return os.path.join("excel_files", f"reservations_{date}.xlsx")
+    
+    @staticmethod
+    def get_range_file_name(start_date: str, end_date: str) -> str:
+        """Имя файла выгрузки за период (как его видит пользователь)"""
+        return f"reservations_{start_date}_{end_date}.xlsx"
+    
+    @staticmethod
+    def get_range_file_path(start_date: str, end_date: str) -> str:
         """
-        Создает Excel файл с бронями на указанную дату
-        reservations: список словарей с данными броней
-        date: дата в формате YYYY-MM-DD
-        db: объект базы данных для получения имен официантов
-        Возвращает путь к созданному файлу
+        Путь к файлу выгрузки за период. Файл нужен только на время отправки:
+        у каждой выгрузки свое имя, чтобы удаление после отправки не мешало
+        параллельной выгрузке того же периода
         """
-        # Создаем новую книгу Excel
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"Брони {date}"
-        
-        # Заголовки столбцов (ДОБАВЛЕН СТОЛБЕЦ "Статус депозита")
-        headers = [
-            "ID", "Дата", "Стол", "Имя гостя", "Телефон", 
-            "Повод", "Время", "Гостей", "Депозит (₽)", "Статус депозита", "Официант"
-        ]
-        
-        # Форматирование заголовков
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+        return os.path.join(
+            RANGE_FILES_DIR, f"reservations_{start_date}_{end_date}_{uuid.uuid4().hex[:12]}.xlsx"
+        )
+    
+    @staticmethod
+    def cleanup_range_files(max_age: float = 24 * 3600) -> int:
+        """
+        Удаление выгрузок за период, оставшихся после сбоя отправки
+        или перезапуска бота. Возвращает число удаленных файлов
+        """
+        if not os.path.isdir(RANGE_FILES_DIR):
+            return 0
+        deadline = time.time() - max_age
+        removed = 0
+        for entry in os.scandir(RANGE_FILES_DIR):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        if removed:
+            print(f"🗑 Удалено выгрузок за период: {removed}")
+        return removed
+    
+    @staticmethod
+    def month_range(year: int, month: int) -> tuple:
+        """Первый и последний день месяца в формате YYYY-MM-DD"""
+        last_day = calendar.monthrange(year, month)[1]
+        return f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-{last_day:02d}"
+    
+    @staticmethod
+    def _add_styles(wb):
+        """Именованные стили книги: создаются один раз и общие для всех ячеек"""
+        side = Side(style='thin')
+        border = Border(left=side, right=side, top=side, bottom=side)
         
-        # Применяем форматирование к заголовкам
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
+        header = NamedStyle(name=STYLE_HEADER)
+        header.font = Font(bold=True, color="FFFFFF")
+        header.fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+        header.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+        wb.add_named_style(header)
         
-        # Заполняем данными
-        border = Border(
-            left=Side(style='thin'), 
-            right=Side(style='thin'),
-            top=Side(style='thin'), 
-            bottom=Side(style='thin')
-        )
+        fills = {
+            STYLE_CELL: None,
+            STYLE_GREEN: "C6EFCE",
+            STYLE_RED: "FFC7CE",
+        }
+        for name, color in fills.items():
+            style = NamedStyle(name=name)
+            style.font = copy(DEFAULT_FONT)
+            style.border = border
+            if color:
+                style.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+            wb.add_named_style(style)
+    
+    @staticmethod
+    def _prepare_rows(reservations: List[Dict], waiter_maps: Dict[str, Dict[str, List[str]]]) -> tuple:
+        """
+        Значения строк и ширины колонок за один проход по броням.
+        Возвращает (строки, ширины).
+        """
+        widths = [len(header) for header in HEADERS]
+        rows = []
         
-        for row_num, res in enumerate(reservations, 2):
+        for res in reservations:
             table_number = res.get('table_number', '')
             deposit = res.get('deposit', 0)
             deposit_paid = res.get('deposit_paid', 0)
             
             # Получаем имя официанта для этого стола
             waiter_name = ""
-            if db and table_number:
-                waiter_name = ExcelGenerator.get_waiter_name_for_table(table_number, date, db)
+            if table_number:
+                waiter_name = ExcelGenerator.get_waiter_name_for_table(
+                    table_number, waiter_maps.get(res.get('date', ''), {})
+                )
             
             # Получаем символ статуса депозита
             deposit_status = ExcelGenerator.get_deposit_status_symbol(deposit, deposit_paid)
@@ -100,45 +175,193 @@ class ExcelGenerator:
                 waiter_name                               # Официант
             ]
             
-            for col_num, value in enumerate(row_data, 1):
-                cell = ws.cell(row=row_num, column=col_num)
-                cell.value = value
-                cell.border = border
-                
-                # Форматирование депозита
-                if col_num == 9 and value and int(value) > 0:
-                    cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                elif col_num == 9 and value and int(value) == 0:
-                    cell.fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
-                
-                # Форматирование статуса депозита
-                if col_num == 10 and value == "✅":
-                    cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                elif col_num == 10 and value == "❌":
-                    cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+            for i, value in enumerate(row_data):
+                length = len(str(value))
+                if length > widths[i]:
+                    widths[i] = length
+            rows.append(row_data)
         
-        # Автоматическая ширина колонок
-        for col in range(1, len(headers) + 1):
-            max_length = 0
-            column_letter = get_column_letter(col)
-            for row in range(1, len(reservations) + 2):
-                cell = ws[f"{column_letter}{row}"]
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 30)  # Не шире 30 символов
-            ws.column_dimensions[column_letter].width = adjusted_width
+        return rows, widths
+    
+    @staticmethod
+    def _cell_style(col_num: int, value) -> str:
+        """Стиль ячейки данных"""
+        # Депозит
+        if col_num == 9 and value and int(value) > 0:
+            return STYLE_GREEN
+        # Статус депозита
+        if col_num == 10 and value == "✅":
+            return STYLE_GREEN
+        if col_num == 10 and value == "❌":
+            return STYLE_RED
+        return STYLE_CELL
+    
+    @staticmethod
+    def write_workbook(reservations: List[Dict], filepath: str, title: str, db=None,
+                       waiter_maps: Dict[str, Dict[str, List[str]]] = None) -> str:
+        """
+        Потоковая запись броней в книгу (openpyxl write_only).
+        Строки не держатся в памяти как объекты ячеек, стили - общие
+        именованные, ширины колонок считаются при подготовке строк.
+        Файл перезаписывается атомарно (через временный файл).
+        waiter_maps: {дата: {стол: [имена]}}; если не передано - загружается из db
+        """
+        if waiter_maps is None:
+            waiter_maps = ExcelGenerator.load_waiter_maps(reservations, db) if db else {}
+        rows, widths = ExcelGenerator._prepare_rows(reservations, waiter_maps)
+        
+        wb = openpyxl.Workbook(write_only=True)
+        ExcelGenerator._add_styles(wb)
+        ws = wb.create_sheet(title=title[:31])
+        
+        # Ширины задаются до первой строки: в write_only они пишутся в начало листа
+        for col, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(col)].width = min(width + 2, 30)  # Не шире 30 символов
+        
+        # Стиль ячейки разрешается по имени один раз, дальше ячейки
+        # получают готовый (неизменяемый при записи) набор стилей
+        style_arrays = {}
+        for name in (STYLE_HEADER, STYLE_CELL, STYLE_GREEN, STYLE_RED):
+            template = WriteOnlyCell(ws)
+            template.style = name
+            style_arrays[name] = template._style
+        
+        header_row = []
+        for header in HEADERS:
+            cell = WriteOnlyCell(ws, value=header)
+            cell._style = style_arrays[STYLE_HEADER]
+            header_row.append(cell)
+        ws.append(header_row)
         
-        # Сохраняем файл
-        timestamp = datetime.datetime.now().strftime('%H%M%S')
-        filename = f"reservations_{date}_{timestamp}.xlsx"
-        filepath = os.path.join("excel_files", filename)
+        for row_data in rows:
+            row = []
+            for col_num, value in enumerate(row_data, 1):
+                cell = WriteOnlyCell(ws, value=value)
+                cell._style = style_arrays[ExcelGenerator._cell_style(col_num, value)]
+                row.append(cell)
+            ws.append(row)
         
         # Создаем папку, если её нет
-        os.makedirs("excel_files", exist_ok=True)
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        
+        # Пишем во временный файл и подменяем им старый, чтобы
+        # никто не получил наполовину записанную таблицу
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        wb.save(tmp_path)
+        os.replace(tmp_path, filepath)
+        print(f"✅ Excel файл сохранен: {filepath} ({len(rows)} строк)")
+        return filepath
+    
+    @staticmethod
+    def create_reservation_file(reservations: List[Dict], date: str, db=None,
+                                waiter_map: Dict[str, List[str]] = None) -> str:
+        """
+        Создает Excel файл с бронями на указанную дату
+        reservations: список словарей с данными броней
+        date: дата в формате YYYY-MM-DD
+        db: объект базы данных для получения имен официантов
+        waiter_map: готовая карта {стол: [имена]} (Database.get_table_assignment_map)
+        Возвращает путь к созданному файлу
+        """
+        waiter_maps = {date: waiter_map} if waiter_map is not None else None
+        return ExcelGenerator.write_workbook(
+            reservations, ExcelGenerator.get_file_path(date), f"Брони {date}", db, waiter_maps
+        )
+    
+    @staticmethod
+    def create_range_file(reservations: List[Dict], start_date: str, end_date: str, db=None,
+                          waiter_maps: Dict[str, Dict[str, List[str]]] = None) -> str:
+        """
+        Создает Excel файл с бронями за период (неделя, месяц).
+        Брони должны быть отсортированы по дате и времени.
+        waiter_maps: готовые карты {дата: {стол: [имена]}}
+        Возвращает путь к созданному файлу
+        """
+        return ExcelGenerator.write_workbook(
+            reservations,
+            ExcelGenerator.get_range_file_path(start_date, end_date),
+            f"Брони {start_date} - {end_date}",
+            db,
+            waiter_maps
+        )
+
+
+class ExcelExportPipeline:
+    """
+    Выгрузка броней в Excel по дням.
+    После изменения броней файл пересобирается с задержкой: серия изменений
+    подряд дает одну пересборку. Готовый файл отдается повторно, пока
+    версия броней на дату (Database.get_date_version) не изменилась.
+    """
+    
+    def __init__(self, async_db, delay: float = 5.0):
+        self.async_db = async_db
+        self.delay = delay
+        # Таймеры, которые еще ждут задержку (их можно сдвинуть)
+        self._timers: Dict[str, asyncio.Task] = {}
+        # Сработавшие таймеры, которые пересобирают файл (ссылки, чтобы задачи не собрал GC)
+        self._rebuilds: Set[asyncio.Task] = set()
+        # date -> [lock, сборок в очереди и в работе]; удаляется, когда сборок нет
+        self._locks: Dict[str, list] = {}
+    
+    def schedule(self, date: str):
+        """
+        Отложенная пересборка файла за дату (повторный вызов сдвигает таймер).
+        Уже идущую пересборку не прерывает: после нее файл соберется по новому таймеру
+        """
+        timer = self._timers.pop(date, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[date] = asyncio.create_task(self._delayed_rebuild(date))
+    
+    async def _delayed_rebuild(self, date: str):
+        task = asyncio.current_task()
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            return
+        # Задержка прошла: с этого момента schedule() таймер не отменяет
+        if self._timers.get(date) is task:
+            del self._timers[date]
+        self._rebuilds.add(task)
+        try:
+            await self.get_file(date)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения Excel: {e}")
+        finally:
+            self._rebuilds.discard(task)
+    
+    async def get_file(self, date: str) -> Optional[str]:
+        """
+        Путь к актуальному файлу за дату. Если брони менялись после
+        последней сборки - файл пересобирается. None, если броней нет.
+        """
+        entry = self._locks.setdefault(date, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._build_file(date)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[date]
+    
+    async def _build_file(self, date: str) -> Optional[str]:
+        """Сборка файла за дату (под блокировкой даты)"""
+        # Версию берем до чтения броней: если бронь изменится во время
+        # сборки, файл получит старую версию и соберется еще раз
+        version = await self.async_db.get_date_version(date)
+        cached = await self.async_db.get_excel_file(date)
+        if cached and cached[1] == version and os.path.exists(cached[0]):
+            return cached[0]
         
-        wb.save(filepath)
-        print(f"✅ Excel файл сохранен: {filepath}")
+        reservations = await self.async_db.get_reservations_by_date(date)
+        if not reservations:
+            return None
+        
+        waiter_map = await self.async_db.get_table_assignment_map(date)
+        filepath = await self.async_db.run(
+            ExcelGenerator.create_reservation_file, reservations, date, None, waiter_map
+        )
+        await self.async_db.save_excel_file(os.path.basename(filepath), date, filepath, version)
         return filepath
\ No newline at end of file
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в SQLite (таблица fsm_storage): состояния и данные
+    незавершенных диалогов переживают перезапуск бота.
+    Чтение и запись идут напрямую в БД, без кэша в процессе: несколько
+    процессов бота на одной БД видят изменения друг друга сразу.
+    Запись, которую не меняли ttl секунд, считается пустой.
+    Изменения пишутся групповым коммитом: пока пачка записывается в БД,
+    изменения других чатов копятся и уходят следующей пачкой одной
+    транзакцией. set_state и set_data возвращаются после коммита своего изменения.
+    """
+
+    def __init__(self, async_db, ttl: float = 24 * 3600):
+        self.async_db = async_db
+        self.ttl = ttl
+        # (key, колонка, значение, expires_at, future) - ждут записи
+        self._pending: list = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def make_key(key: StorageKey) -> str:
+        """Строковый ключ записи"""
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _save(self, key: StorageKey, column: str, value):
+        """Изменение уходит с ближайшей пачкой; ждем ее коммита"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((self.make_key(key), column, value, time.time() + self.ttl, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        await future
+
+    async def _flush(self):
+        """Запись пачек, пока копятся изменения"""
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await self.async_db.save_fsm_values([record[:4] for record in batch])
+                except Exception as e:
+                    print(f"❌ Ошибка сохранения состояний FSM: {e}")
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+        finally:
+            self._flush_task = None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._save(key, 'state', state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self.async_db.get_fsm_record(self.make_key(key))
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        serialized = json.dumps(data, ensure_ascii=False)
+        await self._save(key, 'data', serialized)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self.async_db.get_fsm_record(self.make_key(key))
+        return json.loads(record[1]) if record else {}
+
+    async def close(self) -> None:
+        pass
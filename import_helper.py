@@ -0,0 +1,241 @@
+import csv
+import io
+import re
+from datetime import date as date_type, datetime, time as time_type
+from typing import Callable, Dict, List, Optional, Tuple
+
+import openpyxl
+
+from availability import TableSchedule
+
+# Не больше стольких броней за один импорт
+IMPORT_MAX_ROWS = 500
+
+# Заголовки колонок файла -> поле брони (сравнение без учета регистра)
+IMPORT_COLUMNS = {
+    'name': ('имя', 'имя гостя', 'гость', 'фио', 'name'),
+    'phone': ('телефон', 'тел', 'тел.', 'номер телефона', 'phone'),
+    'date': ('дата', 'date'),
+    'time': ('время', 'time'),
+    'table_number': ('стол', 'номер стола', 'table'),
+    'guests': ('гостей', 'гости', 'кол-во гостей', 'человек', 'guests'),
+    'deposit': ('депозит', 'депозит (₽)', 'deposit'),
+    'occasion': ('повод', 'occasion'),
+}
+
+# Маркеры списка в начале строки: "1) ", "2. ", "- ", "• "
+LIST_MARKER_PATTERN = re.compile(r'^\s*(?:\d{1,3}[.)]|[-•*—])\s+')
+DIGITS_PATTERN = re.compile(r'\D')
+DATE_ISO_PATTERN = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})')
+DATE_DMY_PATTERN = re.compile(r'^(\d{1,2})[./\-](\d{1,2})(?:[./\-](\d{2,4}))?$')
+TIME_PATTERN = re.compile(r'^(\d{1,2})[:.ч](\d{2})')
+DEPOSIT_PATTERN = re.compile(r'^(\d+)\s*(к|тыс)?', re.IGNORECASE)
+
+
+def split_text_lines(text: str) -> List[str]:
+    """Строки списка броней без пустых строк и маркеров списка"""
+    lines = []
+    for line in text.splitlines():
+        line = LIST_MARKER_PATTERN.sub('', line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def read_table_file(content: bytes, filename: str) -> List[list]:
+    """
+    Строки таблицы из .xlsx или .csv (значения ячеек).
+    ValueError, если формат файла не поддерживается.
+    """
+    extension = filename.lower().rsplit('.', 1)[-1] if '.' in filename else ''
+
+    if extension == 'xlsx':
+        wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        try:
+            return [list(row) for row in wb.active.iter_rows(values_only=True)]
+        finally:
+            wb.close()
+
+    if extension == 'csv':
+        try:
+            text = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = content.decode('cp1251')
+        try:
+            delimiter = csv.Sniffer().sniff(text[:4096], delimiters=',;\t').delimiter
+        except csv.Error:
+            delimiter = ';'
+        return [row for row in csv.reader(io.StringIO(text), delimiter=delimiter)]
+
+    raise ValueError("Поддерживаются только файлы .xlsx и .csv")
+
+
+def map_header(row: list) -> Optional[Dict[str, int]]:
+    """Поле брони -> номер колонки, если строка похожа на заголовок"""
+    aliases = {alias: field for field, names in IMPORT_COLUMNS.items() for alias in names}
+    mapping = {}
+    for index, cell in enumerate(row):
+        field = aliases.get(str(cell or '').strip().lower())
+        if field and field not in mapping:
+            mapping[field] = index
+    # Заголовок - если узнали хотя бы две колонки
+    return mapping if len(mapping) >= 2 else None
+
+
+def normalize_phone(value) -> str:
+    """Телефон в формате +7XXXXXXXXXX ('' если не распознан)"""
+    if isinstance(value, float):
+        value = int(value)
+    digits = DIGITS_PATTERN.sub('', str(value or ''))
+    if len(digits) == 10:
+        return f"+7{digits}"
+    if len(digits) == 11 and digits[0] in '78':
+        return f"+7{digits[1:]}"
+    return ''
+
+
+def normalize_date(value, year: int) -> str:
+    """Дата в формате YYYY-MM-DD ('' если не распознана)"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, date_type):
+        return value.strftime("%Y-%m-%d")
+
+    text = str(value or '').strip()
+    match = DATE_ISO_PATTERN.match(text)
+    if match:
+        year_num, month, day = (int(g) for g in match.groups())
+    else:
+        match = DATE_DMY_PATTERN.match(text)
+        if not match:
+            return ''
+        day, month = int(match.group(1)), int(match.group(2))
+        year_str = match.group(3)
+        if year_str:
+            year_num = 2000 + int(year_str) if len(year_str) == 2 else int(year_str)
+        else:
+            year_num = year
+
+    try:
+        return date_type(year_num, month, day).strftime("%Y-%m-%d")
+    except ValueError:
+        return ''
+
+
+def normalize_time(value) -> str:
+    """Время в формате ЧЧ:ММ ('' если не распознано)"""
+    if isinstance(value, (datetime, time_type)):
+        return f"{value.hour:02d}:{value.minute:02d}"
+
+    match = TIME_PATTERN.match(str(value or '').strip())
+    if not match:
+        return ''
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if 0 <= hour <= 23 and 0 <= minute <= 59:
+        return f"{hour:02d}:{minute:02d}"
+    return ''
+
+
+def normalize_int(value, default: int = 0) -> int:
+    """Целое число из ячейки (default если не распознано)"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = DIGITS_PATTERN.sub('', str(value or ''))
+    return int(digits) if digits else default
+
+
+def normalize_deposit(value) -> int:
+    """Депозит в рублях: 5000, '5 000', '5к', '5 тыс'"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value or '').replace(' ', '').replace('\xa0', '')
+    match = DEPOSIT_PATTERN.match(text)
+    if not match:
+        return 0
+    amount = int(match.group(1))
+    return amount * 1000 if match.group(2) else amount
+
+
+def row_to_reservation(row: list, mapping: Dict[str, int], year: int) -> dict:
+    """Бронь из строки таблицы по колонкам заголовка (поля как у parse_reservation_text)"""
+    def cell(field):
+        index = mapping.get(field)
+        if index is None or index >= len(row):
+            return None
+        return row[index]
+
+    table_text = cell('table_number')
+    if isinstance(table_text, float):
+        table_text = int(table_text)
+    table_text = str(table_text if table_text is not None else '').strip()
+
+    guests = normalize_int(cell('guests'), default=1)
+
+    return {
+        'name': str(cell('name') or '').strip(),
+        'phone': normalize_phone(cell('phone')),
+        'date': normalize_date(cell('date'), year),
+        'time': normalize_time(cell('time')),
+        'guests': guests if guests > 0 else 1,
+        'deposit': normalize_deposit(cell('deposit')),
+        'deposit_paid': 0,
+        'occasion': str(cell('occasion') or '').strip(),
+        'table_number': table_text.rstrip('!'),
+        'table_strict': table_text.endswith('!'),
+        'raw_text': ' | '.join(str(v) for v in row if v not in (None, ''))
+    }
+
+
+def rows_to_reservations(rows: List[list], parse_text: Callable[[str, int], dict], year: int) -> List[Tuple[int, dict]]:
+    """
+    Брони из строк таблицы: по заголовку, если он есть,
+    иначе каждая строка разбирается как текст брони.
+    Возвращает [(номер строки, бронь)].
+    """
+    # Номера строк - как в файле (пустые строки пропускаются)
+    rows = [(num, row) for num, row in enumerate(rows, 1) if any(v not in (None, '') for v in row)]
+    if not rows:
+        return []
+
+    mapping = map_header(rows[0][1])
+    if mapping:
+        return [(num, row_to_reservation(row, mapping, year)) for num, row in rows[1:]]
+
+    return [
+        (num, parse_text(' '.join(str(v) for v in row if v not in (None, '')), year))
+        for num, row in rows
+    ]
+
+
+def plan_import(items: List[Tuple[int, dict]], existing: List[dict], min_hours: float,
+                validate: Callable[[dict], List[str]]) -> dict:
+    """
+    Проверка броней импорта: обязательные поля и пересечения по столам.
+    Пересечения ищутся по расписанию в памяти (брони из БД на даты импорта
+    плюс уже принятые брони этого же импорта).
+    Возвращает {'accepted': [брони], 'rejected': [(номер строки, текст, причина)]}.
+    """
+    schedules: Dict[str, TableSchedule] = {}
+    for res in existing:
+        schedules.setdefault(res.get('date', ''), TableSchedule(min_hours)).add(res)
+
+    accepted = []
+    rejected = []
+    for num, res in items:
+        errors = validate(res)
+        if errors:
+            rejected.append((num, res['raw_text'], '; '.join(errors)))
+            continue
+
+        schedule = schedules.setdefault(res['date'], TableSchedule(min_hours))
+        conflicts = schedule.find_conflicts(res['table_number'], res['time'])
+        if conflicts:
+            conflict = conflicts[0]
+            reason = f"стол {res['table_number']} занят ({conflict['time']} {conflict['name']})"
+            rejected.append((num, res['raw_text'], reason))
+            continue
+
+        schedule.add(res)
+        accepted.append(res)
+
+    return {'accepted': accepted, 'rejected': rejected}
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+# Лимит длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Запас под заголовок страницы ("📋 ... стр. 10/12")
+HEADER_RESERVE = 200
+
+
+def pack_pages(blocks: List[str], max_rows: int, limit: int = MESSAGE_LIMIT - HEADER_RESERVE) -> List[Tuple[int, int]]:
+    """
+    Раскладка блоков текста по страницам: не больше max_rows блоков
+    и не больше limit символов на страницу (блоки разделяются пустой строкой).
+    Возвращает [(начало, конец)] - срезы списка блоков.
+    """
+    pages = []
+    start = 0
+    length = 0
+    for i, block in enumerate(blocks):
+        size = min(len(block), limit) + (2 if i > start else 0)
+        if i > start and (i - start >= max_rows or length + size > limit):
+            pages.append((start, i))
+            start = i
+            size = min(len(block), limit)
+            length = 0
+        length += size
+    if start < len(blocks):
+        pages.append((start, len(blocks)))
+    return pages
+
+
+def build_list_pages(title: str, items: List[dict], format_item, format_label, max_rows: int) -> List[dict]:
+    """
+    Страницы списка: [{'text', 'buttons': [(id, подпись)]}].
+    Каждая страница - одно сообщение с кнопками выбора броней страницы.
+    """
+    blocks = [format_item(item)[:MESSAGE_LIMIT - HEADER_RESERVE] for item in items]
+    ranges = pack_pages(blocks, max_rows)
+
+    pages = []
+    for number, (start, end) in enumerate(ranges, 1):
+        header = title if len(ranges) == 1 else f"{title} - стр. {number}/{len(ranges)}"
+        pages.append({
+            'text': header + "\n\n" + "\n\n".join(blocks[start:end]),
+            'buttons': [(item['id'], format_label(item)) for item in items[start:end]],
+        })
+    return pages
+
+
+def build_single_page(title: str, items: List[dict], format_item, format_label) -> dict:
+    """
+    Одна страница из готового набора броней (страница выбрана запросом к БД).
+    Если блоки не помещаются в одно сообщение, каждый укорачивается поровну.
+    """
+    limit = MESSAGE_LIMIT - HEADER_RESERVE
+    blocks = [format_item(item) for item in items]
+    if sum(len(block) + 2 for block in blocks) > limit:
+        share = limit // max(len(blocks), 1) - 2
+        blocks = [block[:share] for block in blocks]
+    return {
+        'text': title + "\n\n" + "\n\n".join(blocks),
+        'buttons': [(item['id'], format_label(item)) for item in items],
+    }
+
+
+class ListPageCache:
+    """
+    Отрисованные страницы списков броней. Запись живет, пока не изменилась
+    версия (для списков на дату - версия броней на эту дату).
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        # ключ списка -> (версия, страницы)
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Any, version: Any = None) -> Optional[List[dict]]:
+        """Страницы из кэша (None, если записи нет или версия другая)"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Any, version: Any, pages: List[dict]) -> List[dict]:
+        """Сохранение страниц списка"""
+        self._entries[key] = (version, pages)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return pages
@@ -4,7 +4,7 @@ import re
 import os
 import sys
 import traceback
-import sqlite3
+import uuid
 from datetime import datetime, timedelta
 from typing import Tuple, List, Optional
 
@@ -12,18 +12,31 @@ import pytz
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
-    Message, CallbackQuery, FSInputFile, InlineKeyboardMarkup,
+    Message, CallbackQuery, FSInputFile, BufferedInputFile, InlineKeyboardMarkup,
     InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton,
     ReplyKeyboardRemove
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from aiohttp import web
-
-from database import db
-from excel_helper import ExcelGenerator
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from database import db, async_db
+from excel_helper import ExcelGenerator, ExcelExportPipeline
+from occupancy_helper import OccupancyCache
+from list_helper import ListPageCache, build_list_pages, build_single_page
+from availability import TableSchedule, TableRegistry, suggest_free_tables
+from import_helper import IMPORT_MAX_ROWS, split_text_lines, read_table_file, rows_to_reservations, plan_import
+from broadcast_helper import Broadcaster
+from roles_helper import RoleCache, RoleMiddleware
+from dispatch_helper import ChatOrderMiddleware
+from fsm_storage import SQLiteStorage
+from cluster_helper import LeaderLease
+from metrics_helper import MetricsRegistry, HandlerMetricsMiddleware, RequestMetricsMiddleware, QueryMetrics, JobMetrics
+from config import TABLE_ZONES
 
 # Настройка логирования
 logging.basicConfig(
@@ -36,27 +49,127 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("❌ Ошибка: BOT_TOKEN не установлен в переменных окружения!")
 
+# Получение апдейтов: polling (по умолчанию) или webhook на веб-сервер бота
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEB_SERVER_PORT = 10000
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"❌ Ошибка: неизвестный BOT_MODE={BOT_MODE} (polling или webhook)")
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("❌ Ошибка: для BOT_MODE=webhook нужен WEBHOOK_URL!")
+
 MAIN_ADMIN_ID = 429549022  # Замени на свой ID
 TIMEZONE = "Asia/Yekaterinburg"
 CURRENT_YEAR = 2026
 MORNING_REPORT_HOUR = 11
 MORNING_REPORT_MINUTE = 0
 MIN_HOURS_BETWEEN_RESERVATIONS = 3
+NOTIFICATION_MISFIRE_GRACE_SECONDS = 600  # Сколько можно опоздать с уведомлением после простоя
+
+# Списки броней: не больше стольких броней в одном сообщении
+LIST_PAGE_SIZE = 10
+
+# Просмотр броней на неделю вперед: дней в периоде и броней на странице
+WEEK_DAYS = 7
+WEEK_PAGE_SIZE = 20
+WEEKDAY_NAMES = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+# Редактирование брони: поле в кнопке -> ключ в данных брони и название поля
+EDIT_FIELD_KEYS = {'table': 'table_number'}
+EDIT_FIELD_NAMES = {
+    'name': 'имя',
+    'phone': 'телефон',
+    'date': 'дата',
+    'time': 'время',
+    'table_number': 'стол',
+    'guests': 'гости',
+    'deposit': 'депозит',
+    'occasion': 'повод',
+}
+
+# Сколько апдейтов обрабатывается одновременно (из разных чатов)
+DISPATCH_WORKERS = 32
 
 # Создаем объекты бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Состояния диалогов и их данные (в т.ч. отложенные брони) хранятся в БД
+dp = Dispatcher(storage=SQLiteStorage(async_db))
+
+# Апдейты разных чатов - параллельно, одного чата - по порядку.
+# Очередь чата занимается до FSMContextMiddleware диспетчера: до нее апдейт
+# не ждет ничего, поэтому порядок сохраняется, а состояние FSM читается в свою очередь
+dispatch_queue = ChatOrderMiddleware(DISPATCH_WORKERS)
+dp.update.outer_middleware.unregister(dp.fsm)
+dp.update.outer_middleware(dispatch_queue)
+dp.update.outer_middleware(dp.fsm)
+
+# Метрики процесса для /metrics (формат Prometheus): обработчики, БД,
+# запросы к Telegram, задачи планировщика и точность уведомлений
+metrics = MetricsRegistry()
+handler_metrics = HandlerMetricsMiddleware(metrics)
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+bot.session.middleware(RequestMetricsMiddleware(metrics))
+async_db.metrics = QueryMetrics(metrics)
+job_metrics = JobMetrics(metrics)
+notification_delay = metrics.histogram(
+    'bot_notification_delay_seconds',
+    'Опоздание отправки уведомления относительно запланированного времени',
+    ['type'],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800)
+)
+dispatch_queue.wait_histogram = metrics.histogram(
+    'bot_update_wait_seconds', 'Ожидание апдейта в очереди обработки (своей очереди чата и свободного обработчика)'
+)
+metrics.gauge('bot_updates_waiting', 'Апдейты в очереди обработки', lambda: dispatch_queue.waiting)
+metrics.gauge('bot_updates_active', 'Апдейты в обработке', lambda: dispatch_queue.active)
+metrics.gauge('bot_scheduler_leader', 'Процесс выполняет задачи планировщика (1 - да)', lambda: int(leader_lease.is_leader))
+
+# Рассылки с учетом лимитов Telegram
+broadcaster = Broadcaster(bot)
+
+# Выгрузка броней в Excel: файл за день пересобирается после изменений
+excel_pipeline = ExcelExportPipeline(async_db)
+
+# Списки броней постранично (страницы на дату пересобираются после изменения броней)
+list_cache = ListPageCache()
+
+# Сетка загрузки зала по датам (пересчитывается после изменения броней на дату)
+occupancy_cache = OccupancyCache(async_db, MIN_HOURS_BETWEEN_RESERVATIONS)
+
+# Рассадка для подсказок свободных столов при конфликте брони
+table_registry = TableRegistry(TABLE_ZONES)
+TABLE_SUGGESTIONS_LIMIT = 6
+
+# Планировщик для утренних отчетов и уведомлений.
+# Уведомления по броням хранятся в БД, чтобы пережить перезапуск бота.
+scheduler = AsyncIOScheduler(
+    timezone=pytz.timezone(TIMEZONE),
+    jobstores={
+        'default': MemoryJobStore(),
+        'notifications': SQLAlchemyJobStore(
+            url=f"sqlite:///{db.db_name}",
+            tablename='scheduled_notifications'
+        )
+    }
+)
 
-# Планировщик для утренних отчетов и уведомлений
-scheduler = AsyncIOScheduler(timezone=pytz.timezone(TIMEZONE))
+# Несколько процессов бота могут работать с одной БД (webhook за балансировщиком).
+# Задачи планировщика выполняет только ведущий процесс - тот, кто держит аренду в БД
+leader_lease = LeaderLease(async_db)
 
 # ========== БАЗА ДАННЫХ В ПАМЯТИ ==========
-users_db = {}
-current_year = CURRENT_YEAR
-pending_reservations = {}
-pending_deletions = {}
-pending_edits = {}
-pending_payments = {}  # Для подтверждения оплаты депозита
+# Кэш ролей: сбрасывается при изменении ролей в БД
+role_cache = RoleCache(async_db.get_user, MAIN_ADMIN_ID)
+# Подписчики вызываются в потоке записи БД: сброс передается в цикл событий
+db.add_role_listener(role_cache.invalidate_threadsafe)
+dp.update.outer_middleware(RoleMiddleware(role_cache))
+
+current_year = CURRENT_YEAR  # Общий для всех процессов: хранится в settings
+roles_version = None  # Версия ролей в БД, по которой сбрасывается кэш ролей
+jobs_version = None  # Версия задач уведомлений в БД, по которой ведущий перечитывает задачи
 
 # ========== СОСТОЯНИЯ ==========
 class ReservationStates(StatesGroup):
@@ -71,6 +184,7 @@ class ReservationStates(StatesGroup):
     waiting_for_waiter_tables = State()
     waiting_for_year = State()
     waiting_for_waiter_name = State()  # Для редактирования имени официанта
+    waiting_for_import = State()  # Импорт списка броней
 
 # ========== ФУНКЦИИ ДЛЯ ПАРСИНГА СПИСКА СТОЛОВ ==========
 
@@ -127,112 +241,71 @@ def get_today_str() -> str:
 
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ С ПОЛЬЗОВАТЕЛЯМИ (С БД) ==========
 
-def add_user(user_id: int, username: str, first_name: str, is_admin: int = 0):
+async def add_user(user_id: int, username: str, first_name: str, is_admin: int = 0):
     """Добавление пользователя в БД"""
-    db.add_user(user_id, username, first_name, is_admin)
+    await async_db.add_user(user_id, username, first_name, is_admin)
 
-def is_admin(user_id: int) -> bool:
+async def is_admin(user_id: int) -> bool:
     """Проверка на администратора"""
-    # Сначала проверяем главного админа
-    if user_id == MAIN_ADMIN_ID:
-        return True
-    
-    # Проверяем в памяти
-    if user_id in users_db and users_db[user_id].get('is_admin', 0) == 1:
-        return True
-    
-    # Проверяем в БД
-    user = db.get_user(user_id)
-    if user and user.get('is_admin', 0) == 1:
-        # Синхронизируем с памятью
-        if user_id not in users_db:
-            users_db[user_id] = {
-                'username': user.get('username', ''),
-                'first_name': user.get('first_name', ''),
-                'is_admin': 1,
-                'is_waiter': user.get('is_waiter', 0),
-                'created_at': user.get('created_at', datetime.now().isoformat())
-            }
-        return True
-    
-    return False
+    role = await role_cache.get(user_id)
+    return role['is_admin']
 
 def is_main_admin(user_id: int) -> bool:
     """Проверка на главного администратора"""
     return user_id == MAIN_ADMIN_ID
 
-def is_waiter(user_id: int) -> bool:
+async def is_waiter(user_id: int) -> bool:
     """Проверка, является ли пользователь официантом"""
-    # Проверяем в памяти
-    if user_id in users_db and users_db[user_id].get('is_waiter', 0) == 1:
-        return True
-    
-    # Проверяем в БД
-    user = db.get_user(user_id)
-    if user and user.get('is_waiter', 0) == 1:
-        # Синхронизируем с памятью
-        if user_id not in users_db:
-            users_db[user_id] = {
-                'username': user.get('username', ''),
-                'first_name': user.get('first_name', ''),
-                'is_admin': user.get('is_admin', 0),
-                'is_waiter': 1,
-                'created_at': user.get('created_at', datetime.now().isoformat())
-            }
-        return True
-    
-    return False
-
-def add_admin(user_id: int) -> bool:
+    role = await role_cache.get(user_id)
+    return role['is_waiter']
+
+async def add_admin(user_id: int) -> bool:
     """Добавление администратора"""
-    return db.set_admin(user_id, True)
+    return await async_db.set_admin(user_id, True)
 
-def remove_admin(user_id: int) -> bool:
+async def remove_admin(user_id: int) -> bool:
     """Удаление администратора"""
     if user_id == MAIN_ADMIN_ID:
         return False
-    return db.set_admin(user_id, False)
+    return await async_db.set_admin(user_id, False)
 
-def add_waiter_role(user_id: int) -> bool:
+async def add_waiter_role(user_id: int) -> bool:
     """Добавление роли официанта"""
-    return db.set_waiter(user_id, True)
+    return await async_db.set_waiter(user_id, True)
 
-def remove_waiter_role(user_id: int) -> bool:
+async def remove_waiter_role(user_id: int) -> bool:
     """Удаление роли официанта"""
-    return db.set_waiter(user_id, False)
+    return await async_db.set_waiter(user_id, False)
 
-def get_all_users() -> List[int]:
+async def get_all_users() -> List[int]:
     """Получение всех пользователей"""
-    return db.get_all_users()
+    return await async_db.get_all_users()
 
-def get_all_admins() -> List[dict]:
+async def get_all_admins() -> List[dict]:
     """Получение списка всех администраторов"""
-    return db.get_all_admins(MAIN_ADMIN_ID)
+    return await async_db.get_all_admins(MAIN_ADMIN_ID)
 
-async def notify_all_users(text: str, exclude_ids: list = None) -> None:
-    """Отправка уведомлений всем"""
+async def notify_all_users(text: str, exclude_ids: list = None) -> dict:
+    """Отправка уведомлений всем администраторам и официантам"""
     if exclude_ids is None:
         exclude_ids = []
     
-    for user_id in get_all_users():
-        if user_id in exclude_ids:
-            continue
-        if is_admin(user_id) or is_waiter(user_id):
-            try:
-                await bot.send_message(user_id, text, parse_mode="Markdown")
-            except Exception as e:
-                logging.error(f"Не удалось отправить пользователю {user_id}: {e}")
+    recipients = [
+        user_id for user_id in await async_db.get_staff_user_ids(MAIN_ADMIN_ID)
+        if user_id not in exclude_ids
+    ]
+    return await broadcaster.broadcast(recipients, text, parse_mode="Markdown")
 
 # ========== КЛАВИАТУРЫ ==========
 
-def get_main_keyboard(user_id: int = None):
+async def get_main_keyboard(user_id: int = None):
     """Создает клавиатуру с основными кнопками"""
     buttons = []
     
     if user_id:
         # Проверяем права через БД
-        is_admin_user = is_admin(user_id)
-        is_waiter_user = is_waiter(user_id)
+        is_admin_user = await is_admin(user_id)
+        is_waiter_user = await is_waiter(user_id)
         is_main_admin_user = is_main_admin(user_id)
         
         print(f"🔍 Клавиатура для user_id={user_id}: admin={is_admin_user}, waiter={is_waiter_user}, main={is_main_admin_user}")
@@ -246,10 +319,15 @@ def get_main_keyboard(user_id: int = None):
                 buttons.append([KeyboardButton(text="📋 Все брони")])
             else:
                 buttons.append([KeyboardButton(text="📋 Сегодня")])
+            buttons.append([KeyboardButton(text="📅 Неделя")])
             buttons.append([KeyboardButton(text="➕ Новая бронь")])
+            buttons.append([KeyboardButton(text="📥 Импорт")])
             buttons.append([KeyboardButton(text="🔍 Поиск")])
             buttons.append([KeyboardButton(text="📊 Excel")])
         
+        if is_admin_user or is_waiter_user:
+            buttons.append([KeyboardButton(text="🗺 Загрузка зала")])
+        
         if is_main_admin_user:
             buttons.append([KeyboardButton(text="⚙️ Управление")])
     
@@ -314,6 +392,75 @@ def get_reservation_action_keyboard(reservation_id: int, deposit: int = 0, depos
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
     return keyboard
 
+def get_week_page_keyboard(page: list, has_prev: bool, has_next: bool):
+    """Кнопки листания недели: ключ первой / последней брони страницы"""
+    buttons = []
+    if has_prev:
+        first = page[0]
+        buttons.append(InlineKeyboardButton(
+            text="◀️ Назад", callback_data=f"week_prev_{first['date']}_{first['time']}_{first['id']}"
+        ))
+    if has_next:
+        last = page[-1]
+        buttons.append(InlineKeyboardButton(
+            text="Вперед ▶️", callback_data=f"week_next_{last['date']}_{last['time']}_{last['id']}"
+        ))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+def get_occupancy_keyboard(date: str):
+    """Клавиатура сетки загрузки: соседние дни и картинка"""
+    day = datetime.strptime(date, "%Y-%m-%d")
+    prev_date = (day - timedelta(days=1)).strftime("%Y-%m-%d")
+    next_date = (day + timedelta(days=1)).strftime("%Y-%m-%d")
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="◀️", callback_data=f"grid_text_{prev_date}"),
+            InlineKeyboardButton(text="🖼 Картинка", callback_data=f"grid_png_{date}"),
+            InlineKeyboardButton(text="▶️", callback_data=f"grid_text_{next_date}")
+        ]
+    ])
+    return keyboard
+
+def get_table_suggestions_keyboard(suggestions: list):
+    """Кнопки свободных столов при конфликте брони (по 2 в ряд)"""
+    if not suggestions:
+        return None
+    buttons = [
+        InlineKeyboardButton(
+            text=f"🪑 {table['table']} ({table['capacity']} чел., {table['zone']})",
+            callback_data=f"suggest_table_{table['table']}"
+        )
+        for table in suggestions
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+def get_list_page_keyboard(view: str, arg: str, page: dict, page_index: int, has_next: bool):
+    """Кнопки выбора броней страницы и листания списка"""
+    buttons = [
+        [InlineKeyboardButton(text=label, callback_data=f"open_{reservation_id}")]
+        for reservation_id, label in page['buttons']
+    ]
+    
+    nav = []
+    if page_index > 0:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"lst_{view}_{arg}_{page_index - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"lst_{view}_{arg}_{page_index + 1}"))
+    if nav:
+        buttons.append(nav)
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def get_excel_range_keyboard():
+    """Клавиатура выгрузки Excel за период"""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📅 7 дней", callback_data="excel_week"),
+            InlineKeyboardButton(text="🗓 Месяц", callback_data="excel_month")
+        ]
+    ])
+    return keyboard
+
 def get_edit_fields_keyboard(reservation_id: int):
     """Клавиатура для выбора поля редактирования"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -348,6 +495,96 @@ def parse_table_number(table_text: str) -> Tuple[str, bool]:
 
 # ========== ФУНКЦИЯ ДЛЯ ПАРСИНГА ТЕКСТА ==========
 
+# Шаблоны разбора брони компилируются один раз при импорте.
+# Порядок шаблонов в списках - приоритет: берется первый сработавший.
+PHONE_PATTERNS = [re.compile(p) for p in (
+    r'\+7[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{2})[\s\-\(\)]*(\d{2})',
+    r'8[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{2})[\s\-\(\)]*(\d{2})',
+    r'(\d{10})',
+    r'([78]\d{10})',
+    r'(\d{3}[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2})',
+)]
+
+DATE_PATTERNS = [re.compile(p) for p in (
+    r'(\d{1,2})[.\-](\d{1,2})[.\-](\d{2,4})',
+    r'(\d{1,2})[.\-](\d{1,2})(?!\d)',
+    r'(\d{1,2})/(\d{1,2})',
+    r'(\d{1,2})\s+(\d{1,2})(?!\d)',
+)]
+
+TIME_PATTERNS = [re.compile(p) for p in (
+    r'(\d{1,2}):(\d{2})',
+    r'(\d{1,2})\.(\d{2})',
+    r'(\d{1,2})\s+(\d{2})(?!\d)',
+    r'(\d{1,2})ч(\d{2})',
+)]
+
+TABLE_PATTERN = re.compile(r'\b(\d+!?)\b')
+
+GUESTS_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'(\d+)\s*(?:чел|человек|персон|гостей|гостя|человека)',
+    r'на\s*(\d+)\s*(?:чел|человек)',
+)]
+
+DEPOSIT_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'(?:депозит|деп|задаток|предоплата)\s*(\d+)\s*(?:к|к\.|тыс)?',
+    r'(?:депозит|деп|задаток|предоплата)\s*(\d+)\s*(?:руб|р|₽|рублей)?',
+    r'(\d+)\s*к(?!\w)',
+    r'(\d+)\s*(?:тыс|тысяч)',
+    r'(\d{5,})',
+    r'(\d{4,})\s*(?:руб|р|₽|рублей)',
+)]
+
+DIGIT_PATTERN = re.compile(r'\d')
+NON_DIGIT_PATTERN = re.compile(r'\D')
+NUMBER_PATTERN = re.compile(r'\b(\d+)\b')
+WORD_PATTERN = re.compile(r'[а-яА-ЯёЁa-zA-Z-]+')
+FIRST_WORD_PATTERN = re.compile(r'[а-яА-ЯёЁa-zA-Z-]{2,}')
+NAME_CLEANUP_PATTERN = re.compile(r'[^\w\s-]')
+SPACES_PATTERN = re.compile(r'\s+')
+
+# Повод: ключевое слово -> (название, шаблон для вырезания из текста)
+OCCASION_KEYWORDS = {
+    keyword: (display, re.compile(keyword, re.IGNORECASE))
+    for keyword, display in (
+        ('др', 'День рождения'),
+        ('день рождения', 'День рождения'),
+        ('деньрождения', 'День рождения'),
+        ('годовщина', 'Годовщина'),
+        ('свадьба', 'Свадьба'),
+        ('встреча', 'Встреча'),
+        ('бизнес', 'Бизнес-встреча'),
+        ('обед', 'Обед'),
+        ('ужин', 'Ужин'),
+        ('романтик', 'Романтический ужин'),
+        ('деловой', 'Деловая встреча'),
+        ('семейный', 'Семейный ужин'),
+        ('корпоратив', 'Корпоратив'),
+        ('юбилей', 'Юбилей'),
+    )
+}
+
+# Слова, которые не могут быть именем гостя
+NAME_EXCLUDE_WORDS = frozenset({
+    'др', 'день', 'рождения', 'рожд', 'годовщина', 'свадьба', 'встреча',
+    'бизнес', 'обед', 'ужин', 'романтик', 'романтический', 'деловой', 
+    'семейный', 'корпоратив', 'юбилей',
+    'депозит', 'деп', 'задаток', 'предоплата', 'руб', 'рублей', 'р', '₽',
+    'чел', 'человек', 'персон', 'гостей', 'гостя', 'человека',
+    'на', 'с', 'со', 'и', 'в', 'во', 'для', 'за', 'по', 'под', 'около',
+    'примерно', 'ок', 'при', 'без', 'до', 'после',
+    'стол', 'столик', 'номер', 'телефон', 'тел', 'время', 'дата',
+    'сегодня', 'завтра', 'вечером', 'днём', 'утром',
+    'овек', 'овека', 'guest', 'client', 'gost',
+})
+
+# Части слов повода/депозита: такие слова тоже не считаются именем
+NAME_EXCLUDE_PARTS_PATTERN = re.compile('|'.join((
+    'др', 'рожд', 'деньр', 'годовщ', 'свадьб', 'встреч', 
+    'бизн', 'обед', 'ужин', 'роман', 'делов', 'семей',
+    'корпор', 'юбил', 'депоз', 'задат', 'овек'
+)))
+
 def parse_reservation_text(text: str, year: int = None) -> dict:
     """Анализатор текста для извлечения данных брони"""
     global current_year
@@ -369,23 +606,17 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
     }
     
     original_text = text
+    # Все числовые поля (телефон, дата, время, стол, гости, депозит) требуют цифр
+    has_digits = DIGIT_PATTERN.search(text) is not None
     
     # ========== 1. Ищем ТЕЛЕФОН ==========
-    phone_patterns = [
-        r'\+7[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{2})[\s\-\(\)]*(\d{2})',
-        r'8[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{3})[\s\-\(\)]*(\d{2})[\s\-\(\)]*(\d{2})',
-        r'(\d{10})',
-        r'([78]\d{10})',
-        r'(\d{3}[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2})',
-    ]
-    
     found_phone = None
     phone_match = None
     
-    for pattern in phone_patterns:
-        phone_match = re.search(pattern, original_text)
+    for pattern in PHONE_PATTERNS if has_digits else ():
+        phone_match = pattern.search(original_text)
         if phone_match:
-            raw_phone = re.sub(r'\D', '', phone_match.group(0))
+            raw_phone = NON_DIGIT_PATTERN.sub('', phone_match.group(0))
             if len(raw_phone) == 10:
                 found_phone = f"+7{raw_phone}"
                 break
@@ -398,18 +629,11 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
         original_text = original_text.replace(phone_match.group(0), '')
     
     # ========== 2. Ищем ДАТУ ==========
-    date_patterns = [
-        r'(\d{1,2})[.\-](\d{1,2})[.\-](\d{2,4})',
-        r'(\d{1,2})[.\-](\d{1,2})(?!\d)',
-        r'(\d{1,2})/(\d{1,2})',
-        r'(\d{1,2})\s+(\d{1,2})(?!\d)',
-    ]
-    
     found_date = None
     date_text = None
     
-    for pattern in date_patterns:
-        date_match = re.search(pattern, original_text)
+    for pattern in DATE_PATTERNS if has_digits else ():
+        date_match = pattern.search(original_text)
         if date_match:
             groups = date_match.groups()
             if len(groups) >= 2:
@@ -436,18 +660,11 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
             original_text = original_text.replace(date_text, '')
     
     # ========== 3. Ищем ВРЕМЯ ==========
-    time_patterns = [
-        r'(\d{1,2}):(\d{2})',
-        r'(\d{1,2})\.(\d{2})',
-        r'(\d{1,2})\s+(\d{2})(?!\d)',
-        r'(\d{1,2})ч(\d{2})',
-    ]
-    
     found_time = None
     time_text = None
     
-    for pattern in time_patterns:
-        time_match = re.search(pattern, original_text)
+    for pattern in TIME_PATTERNS if has_digits else ():
+        time_match = pattern.search(original_text)
         if time_match:
             hour = int(time_match.group(1))
             minute = int(time_match.group(2))
@@ -463,8 +680,7 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
             original_text = original_text.replace(time_text, '')
     
     # ========== 4. Ищем НОМЕР СТОЛА ==========
-    table_pattern = r'\b(\d+!?)\b'
-    table_match = re.search(table_pattern, original_text)
+    table_match = TABLE_PATTERN.search(original_text) if has_digits else None
     if table_match:
         table_text = table_match.group(1)
         table_num, is_strict = parse_table_number(table_text)
@@ -473,13 +689,8 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
         original_text = original_text.replace(table_match.group(0), '')
     
     # ========== 5. Ищем КОЛИЧЕСТВО ЧЕЛОВЕК ==========
-    guests_patterns = [
-        r'(\d+)\s*(?:чел|человек|персон|гостей|гостя|человека)',
-        r'на\s*(\d+)\s*(?:чел|человек)',
-    ]
-    
-    for pattern in guests_patterns:
-        guests_match = re.search(pattern, original_text, re.IGNORECASE)
+    for pattern in GUESTS_PATTERNS if has_digits else ():
+        guests_match = pattern.search(original_text)
         if guests_match:
             guests = int(guests_match.group(1))
             if 1 <= guests <= 20:
@@ -488,17 +699,8 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
                 break
     
     # ========== 6. Ищем ДЕПОЗИТ ==========
-    deposit_patterns = [
-        r'(?:депозит|деп|задаток|предоплата)\s*(\d+)\s*(?:к|к\.|тыс)?',
-        r'(?:депозит|деп|задаток|предоплата)\s*(\d+)\s*(?:руб|р|₽|рублей)?',
-        r'(\d+)\s*к(?!\w)',
-        r'(\d+)\s*(?:тыс|тысяч)',
-        r'(\d{5,})',
-        r'(\d{4,})\s*(?:руб|р|₽|рублей)',
-    ]
-    
-    for pattern in deposit_patterns:
-        deposit_match = re.search(pattern, original_text, re.IGNORECASE)
+    for pattern in DEPOSIT_PATTERNS if has_digits else ():
+        deposit_match = pattern.search(original_text)
         if deposit_match:
             deposit_num = int(deposit_match.group(1))
             
@@ -517,9 +719,8 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
                 break
     
     # ========== 7. Если не нашли гостей, ищем любые подходящие цифры ==========
-    if result['guests'] == 1:
-        number_matches = re.findall(r'\b(\d+)\b', original_text)
-        for num_str in number_matches:
+    if result['guests'] == 1 and has_digits:
+        for num_str in NUMBER_PATTERN.findall(original_text):
             num = int(num_str)
             if 1 <= num <= 20 and num != result['deposit']:
                 result['guests'] = num
@@ -527,44 +728,14 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
                 break
     
     # ========== 8. Ищем ПОВОД ==========
-    occasion_keywords = {
-        'др': 'День рождения',
-        'день рождения': 'День рождения',
-        'деньрождения': 'День рождения',
-        'годовщина': 'Годовщина',
-        'свадьба': 'Свадьба',
-        'встреча': 'Встреча',
-        'бизнес': 'Бизнес-встреча',
-        'обед': 'Обед',
-        'ужин': 'Ужин',
-        'романтик': 'Романтический ужин',
-        'деловой': 'Деловая встреча',
-        'семейный': 'Семейный ужин',
-        'корпоратив': 'Корпоратив',
-        'юбилей': 'Юбилей',
-    }
-    
     text_lower = original_text.lower()
-    for keyword, display in occasion_keywords.items():
+    for keyword, (display, keyword_pattern) in OCCASION_KEYWORDS.items():
         if keyword in text_lower:
             result['occasion'] = display
-            original_text = re.sub(keyword, '', original_text, flags=re.IGNORECASE)
+            original_text = keyword_pattern.sub('', original_text)
             break
     
     # ========== 9. ИЩЕМ ИМЯ ==========
-    exclude_words = {
-        'др', 'день', 'рождения', 'рожд', 'годовщина', 'свадьба', 'встреча',
-        'бизнес', 'обед', 'ужин', 'романтик', 'романтический', 'деловой', 
-        'семейный', 'корпоратив', 'юбилей',
-        'депозит', 'деп', 'задаток', 'предоплата', 'руб', 'рублей', 'р', '₽',
-        'чел', 'человек', 'персон', 'гостей', 'гостя', 'человека',
-        'на', 'с', 'со', 'и', 'в', 'во', 'для', 'за', 'по', 'под', 'около',
-        'примерно', 'ок', 'при', 'без', 'до', 'после',
-        'стол', 'столик', 'номер', 'телефон', 'тел', 'время', 'дата',
-        'сегодня', 'завтра', 'вечером', 'днём', 'утром',
-        'овек', 'овека', 'guest', 'client', 'gost',
-    }
-    
     name_text = original_text.strip()
     
     if not name_text:
@@ -573,28 +744,22 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
         print(f"🕐 Распознанное время: {result['time']}")
         return result
     
-    words = re.findall(r'[а-яА-ЯёЁa-zA-Z-]+', name_text)
     good_words = []
     
-    for word in words:
+    for word in WORD_PATTERN.findall(name_text):
         word_lower = word.lower()
         
         if len(word) < 2:
             continue
-        if word_lower in exclude_words:
-            continue
-        if any(c.isdigit() for c in word):
+        if word_lower in NAME_EXCLUDE_WORDS:
             continue
-        
-        occasion_indicators = ['др', 'рожд', 'деньр', 'годовщ', 'свадьб', 'встреч', 
-                               'бизн', 'обед', 'ужин', 'роман', 'делов', 'семей',
-                               'корпор', 'юбил', 'депоз', 'задат', 'овек']
-        if any(ind in word_lower for ind in occasion_indicators):
+        # Цифр в слове быть не может: WORD_PATTERN берет только буквы и дефис
+        if NAME_EXCLUDE_PARTS_PATTERN.search(word_lower):
             continue
         
         if word[0].isupper():
             good_words.append(word)
-        elif len(word) > 3 and word_lower not in ['гость', 'клиент']:
+        elif len(word) > 3 and word_lower not in ('гость', 'клиент'):
             good_words.append(word)
     
     if good_words:
@@ -604,15 +769,15 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
         else:
             result['name'] = ' '.join(good_words[:2])
     else:
-        first_word_match = re.search(r'[а-яА-ЯёЁa-zA-Z-]{2,}', name_text)
+        first_word_match = FIRST_WORD_PATTERN.search(name_text)
         if first_word_match:
             first_word = first_word_match.group()
-            result['name'] = first_word if first_word.lower() not in exclude_words else 'Гость'
+            result['name'] = first_word if first_word.lower() not in NAME_EXCLUDE_WORDS else 'Гость'
         else:
             result['name'] = 'Гость'
     
-    result['name'] = re.sub(r'[^\w\s-]', '', result['name'])
-    result['name'] = re.sub(r'\s+', ' ', result['name']).strip()
+    result['name'] = NAME_CLEANUP_PATTERN.sub('', result['name'])
+    result['name'] = SPACES_PATTERN.sub(' ', result['name']).strip()
     
     print(f"📅 Распознанная дата: {result['date']}")
     print(f"🕐 Распознанное время: {result['time']}")
@@ -622,42 +787,17 @@ def parse_reservation_text(text: str, year: int = None) -> dict:
 
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ СО СТОЛАМИ ==========
 
-def check_table_availability(table_number: str, date: str, time: str, exclude_reservation_id: int = None) -> dict:
+async def check_table_availability(table_number: str, date: str, time: str, exclude_reservation_id: int = None) -> dict:
     """Проверяет, свободен ли стол в указанное время"""
-    try:
-        new_time = datetime.strptime(time, "%H:%M")
-    except ValueError:
+    if TableSchedule.time_to_minutes(time) is None:
         return {'available': False, 'conflicts': [], 'table': table_number, 'date': date, 'time': time}
     
-    conflicts = []
-    all_reservations = db.get_all_reservations()
+    # Загружаем только брони этого стола на эту дату
+    schedule = TableSchedule(MIN_HOURS_BETWEEN_RESERVATIONS)
+    for res in await async_db.get_table_reservations_for_date(table_number, date):
+        schedule.add(res)
     
-    for res in all_reservations:
-        if exclude_reservation_id and res.get('id') == exclude_reservation_id:
-            continue
-        
-        if res.get('date') != date:
-            continue
-        
-        res_table = res.get('table_number')
-        if not res_table or res_table == 'Не назначен':
-            continue
-        
-        if res_table == table_number:
-            try:
-                res_time = datetime.strptime(res.get('time'), "%H:%M")
-                time_diff = abs((new_time - res_time).total_seconds() / 3600)
-                
-                if time_diff < MIN_HOURS_BETWEEN_RESERVATIONS:
-                    conflicts.append({
-                        'id': res.get('id'),
-                        'time': res.get('time'),
-                        'name': res.get('name'),
-                        'guests': res.get('guests'),
-                        'diff_hours': time_diff
-                    })
-            except (ValueError, TypeError):
-                continue
+    conflicts = schedule.find_conflicts(table_number, time, exclude_reservation_id)
     
     return {
         'available': len(conflicts) == 0,
@@ -667,6 +807,38 @@ def check_table_availability(table_number: str, date: str, time: str, exclude_re
         'time': time
     }
 
+async def suggest_tables(parsed: dict) -> list:
+    """
+    Свободные столы для брони (ближайшие по вместимости и расположению).
+    Брони на дату загружаются одним запросом, без разбора JSON.
+    """
+    if not table_registry.tables or TableSchedule.time_to_minutes(parsed['time']) is None:
+        return []
+    
+    schedule = TableSchedule(MIN_HOURS_BETWEEN_RESERVATIONS)
+    for res in await async_db.get_table_times_for_date(parsed['date']):
+        schedule.add(res)
+    
+    return suggest_free_tables(
+        table_registry, schedule, parsed['time'], parsed.get('guests') or 1,
+        near_table=parsed['table_number'], limit=TABLE_SUGGESTIONS_LIMIT
+    )
+
+def get_reservation_errors(parsed: dict) -> List[str]:
+    """Ошибки распознавания обязательных полей брони"""
+    errors = []
+    if not parsed['name'] or parsed['name'] == 'Не указано':
+        errors.append("❌ Не удалось определить имя гостя")
+    if not parsed['phone']:
+        errors.append("❌ Не удалось определить телефон")
+    if not parsed['date']:
+        errors.append("❌ Не удалось определить дату (формат ДД.ММ)")
+    if not parsed['time']:
+        errors.append("❌ Не удалось определить время (формат ЧЧ:ММ)")
+    if not parsed['table_number']:
+        errors.append("❌ Не удалось определить номер стола")
+    return errors
+
 def format_reservation_for_display(res: dict) -> str:
     """Форматирует бронь для отображения"""
     deposit_text = f"💰 Депозит: {res.get('deposit', 0)}₽" if res.get('deposit', 0) > 0 else ""
@@ -701,35 +873,21 @@ async def cmd_start(message: Message):
     user = message.from_user
     is_admin_user = 1 if user.id == MAIN_ADMIN_ID else 0
     
-    # Сохраняем в БД
-    db.add_user(user.id, user.username, user.first_name, is_admin_user)
-    
-    # Загружаем из БД в память
-    user_from_db = db.get_user(user.id)
-    if user_from_db:
-        users_db[user.id] = {
-            'username': user_from_db.get('username', user.username),
-            'first_name': user_from_db.get('first_name', user.first_name),
-            'is_admin': user_from_db.get('is_admin', is_admin_user),
-            'is_waiter': user_from_db.get('is_waiter', 0),
-            'created_at': user_from_db.get('created_at', datetime.now().isoformat())
-        }
-    else:
-        # Если почему-то нет в БД, создаем запись
-        add_user(user.id, user.username, user.first_name, is_admin_user)
+    # Сохраняем в БД (кэш ролей пользователя при этом сбрасывается)
+    await add_user(user.id, user.username, user.first_name, is_admin_user)
     
     # Проверяем, является ли пользователь официантом
-    waiter_tables = db.get_waiter_tables_for_date(user.id)
+    waiter_tables = await async_db.get_waiter_tables_for_date(user.id)
     
     welcome_text = f"👋 Добро пожаловать, {user.first_name}!\n"
     welcome_text += f"📅 Текущий год: **{current_year}**\n\n"
     
     if is_main_admin(user.id):
         welcome_text += "⭐ **Вы главный администратор**\n"
-    elif is_admin(user.id):
+    elif await is_admin(user.id):
         welcome_text += "👑 **Вы администратор**\n"
     
-    if is_waiter(user.id):
+    if await is_waiter(user.id):
         tables_str = ', '.join(waiter_tables) if waiter_tables else 'не назначены'
         welcome_text += f"🍽 **Вы официант** (столы на сегодня: {tables_str})\n"
         if not waiter_tables:
@@ -741,74 +899,292 @@ async def cmd_start(message: Message):
     await message.answer(
         welcome_text,
         parse_mode="Markdown",
-        reply_markup=get_main_keyboard(user.id)
+        reply_markup=await get_main_keyboard(user.id)
     )
 
 @dp.message(F.text == "📋 Сегодня")
-async def button_today(message: Message):
+async def button_today(message: Message, role: dict):
     """Кнопка показа броней на сегодня"""
-    if not is_admin(message.from_user.id):
+    if not role['is_admin']:
         await message.answer("❌ У вас нет прав.")
         return
     
-    reservations = db.get_today_reservations()
+    today = get_today_str()
+    pages = await get_list_pages('day', today, message.from_user.id)
     
-    if not reservations:
+    if not pages:
         await message.answer("📭 На сегодня броней нет.")
         return
     
-    reservations.sort(key=lambda x: x.get('time', '00:00'))
-    
-    for r in reservations:
-        text = format_reservation_for_display(r)
-        await message.answer(
-            text,
-            parse_mode="Markdown",
-            reply_markup=get_reservation_action_keyboard(
-                r['id'], 
-                r.get('deposit', 0), 
-                r.get('deposit_paid', 0)
-            )
-        )
+    await send_list_page(message, 'day', today, pages)
 
 @dp.message(F.text == "📋 Все брони")
-async def button_all_reservations(message: Message):
+async def button_all_reservations(message: Message, role: dict):
     """Для админов - показать все брони на сегодня"""
-    if not is_admin(message.from_user.id):
+    if not role['is_admin']:
         await message.answer("❌ У вас нет прав.")
         return
     
-    reservations = db.get_today_reservations()
+    today = get_today_str()
+    pages = await get_list_pages('day', today, message.from_user.id)
     
-    if not reservations:
+    if not pages:
         await message.answer("📭 На сегодня броней нет.")
         return
     
-    reservations.sort(key=lambda x: x.get('time', '00:00'))
+    await send_list_page(message, 'day', today, pages)
+
+def format_list_label(res: dict) -> str:
+    """Подпись кнопки выбора брони в списке"""
+    return f"🕐 {res.get('time', '?')} | 🪑 {res.get('table_number', '?')} | {res.get('name', '?')}"[:60]
+
+async def get_list_pages(view: str, arg: str, user_id: int) -> Optional[list]:
+    """
+    Страницы списка броней (из кэша, пока брони на дату не менялись).
+    view: 'day' - все брони на дату arg, 'my' - брони на столы официанта.
+    """
+    key = (view, arg) if view == 'day' else (view, arg, user_id)
+    version = await async_db.get_date_version(arg)
+    pages = list_cache.get(key, version)
+    if pages is not None:
+        return pages
+    
+    reservations = await async_db.get_reservations_by_date(arg)
+    if view == 'day':
+        title = f"📋 Брони на {arg}: {len(reservations)}"
+    else:
+        my_tables = await async_db.get_waiter_tables_for_date(user_id, arg)
+        reservations = [res for res in reservations if res.get('table_number') in my_tables]
+        title = f"📋 Брони на ваши столы на {arg}: {len(reservations)}"
+    
+    pages = build_list_pages(title, reservations, format_reservation_for_display, format_list_label, LIST_PAGE_SIZE)
+    return list_cache.put(key, version, pages)
+
+async def send_list_page(message: Message, view: str, arg: str, pages: list, page_index: int = 0, edit: bool = False):
+    """Одна страница списка одним сообщением (или замена текущей страницы)"""
+    page = pages[page_index]
+    reply_markup = get_list_page_keyboard(view, arg, page, page_index, page_index < len(pages) - 1)
+    if edit:
+        await message.edit_text(page['text'], reply_markup=reply_markup)
+    else:
+        await message.answer(page['text'], reply_markup=reply_markup)
+
+async def send_search_page(message: Message, query: str, token: str, page_index: int = 0, edit: bool = False) -> bool:
+    """
+    Страница результатов поиска: запрос выполняется заново и в память
+    загружается только эта страница (LIMIT/OFFSET в БД).
+    Возвращает False, если ничего не найдено.
+    """
+    total = await async_db.count_search_reservations(query)
+    if not total:
+        return False
     
-    for r in reservations:
-        text = format_reservation_for_display(r)
-        await message.answer(
-            text,
+    page_count = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    page_index = min(page_index, page_count - 1)
+    results = await async_db.search_reservations(
+        query, limit=LIST_PAGE_SIZE, offset=page_index * LIST_PAGE_SIZE
+    )
+    title = f"🔍 Найдено: {total}"
+    if page_count > 1:
+        title += f" - стр. {page_index + 1}/{page_count}"
+    
+    page = build_single_page(title, results, format_reservation_for_display, format_list_label)
+    reply_markup = get_list_page_keyboard('search', token, page, page_index, page_index < page_count - 1)
+    if edit:
+        await message.edit_text(page['text'], reply_markup=reply_markup)
+    else:
+        await message.answer(page['text'], reply_markup=reply_markup)
+    return True
+
+async def get_week_page(after: tuple = None, before: tuple = None) -> tuple:
+    """
+    Страница броней на WEEK_DAYS дней начиная с сегодня.
+    В память загружается не больше одной страницы (+1 бронь, чтобы узнать,
+    есть ли следующая). Возвращает (брони, есть ли назад, есть ли вперед).
+    """
+    today = get_today_str()
+    end_date = (datetime.strptime(today, "%Y-%m-%d") + timedelta(days=WEEK_DAYS - 1)).strftime("%Y-%m-%d")
+    
+    page = await async_db.get_reservations_in_range(
+        today, end_date, after=after, before=before, limit=WEEK_PAGE_SIZE + 1
+    )
+    
+    if before is not None:
+        has_prev = len(page) > WEEK_PAGE_SIZE
+        return page[-WEEK_PAGE_SIZE:], has_prev, True
+    
+    has_next = len(page) > WEEK_PAGE_SIZE
+    return page[:WEEK_PAGE_SIZE], after is not None, has_next
+
+def format_week_page(page: list) -> str:
+    """Брони страницы, сгруппированные по дням"""
+    lines = [f"📅 Брони на {WEEK_DAYS} дней"]
+    current_date = None
+    for res in page:
+        if res['date'] != current_date:
+            current_date = res['date']
+            day = datetime.strptime(current_date, "%Y-%m-%d")
+            lines.append(f"\n{WEEKDAY_NAMES[day.weekday()]}, {day.strftime('%d.%m')}")
+        
+        line = f"🕐 {res.get('time', '')} | 🪑 {res.get('table_number', '?')} | {res.get('name', '')} | 👥 {res.get('guests', 1)}"
+        if res.get('deposit', 0) > 0:
+            line += " | 💰" + ("✅" if res.get('deposit_paid') == 1 else "❌")
+        lines.append(f"{line}  #{res['id']}")
+    return "\n".join(lines)
+
+@dp.message(F.text == "📅 Неделя")
+async def button_week(message: Message, role: dict):
+    """Брони на неделю вперед (постранично)"""
+    if not role['is_admin']:
+        await message.answer("❌ У вас нет прав.")
+        return
+    
+    page, has_prev, has_next = await get_week_page()
+    if not page:
+        await message.answer(f"📭 На ближайшие {WEEK_DAYS} дней броней нет.")
+        return
+    
+    await message.answer(
+        format_week_page(page),
+        reply_markup=get_week_page_keyboard(page, has_prev, has_next)
+    )
+
+@dp.message(F.text == "🗺 Загрузка зала")
+async def button_occupancy(message: Message, role: dict):
+    """Сетка загрузки столов на сегодня"""
+    if not role['is_admin'] and not role['is_waiter']:
+        await message.answer("❌ У вас нет прав.")
+        return
+    
+    today = get_today_str()
+    await message.answer(
+        await occupancy_cache.get_text(today),
+        parse_mode="Markdown",
+        reply_markup=get_occupancy_keyboard(today)
+    )
+
+@dp.callback_query(lambda c: c.data.startswith('grid_'))
+async def process_occupancy(callback: CallbackQuery, role: dict):
+    """Сетка загрузки: другой день или картинка"""
+    if not role['is_admin'] and not role['is_waiter']:
+        await callback.answer("❌ У вас нет прав.", show_alert=True)
+        return
+    
+    # grid_text_<date> / grid_png_<date>
+    _, action, date = callback.data.split('_', 2)
+    
+    if action == 'png':
+        png = await occupancy_cache.get_png(date)
+        await callback.message.answer_photo(
+            BufferedInputFile(png, filename=f"occupancy_{date}.png"),
+            caption=f"🗺 Загрузка зала на {date}"
+        )
+    else:
+        await callback.message.edit_text(
+            await occupancy_cache.get_text(date),
             parse_mode="Markdown",
-            reply_markup=get_reservation_action_keyboard(
-                r['id'], 
-                r.get('deposit', 0), 
-                r.get('deposit_paid', 0)
-            )
+            reply_markup=get_occupancy_keyboard(date)
         )
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('week_'))
+async def process_week_page(callback: CallbackQuery, role: dict):
+    """Листание броней на неделю"""
+    if not role['is_admin']:
+        await callback.answer("❌ У вас нет прав.", show_alert=True)
+        return
+    
+    # week_next_<date>_<time>_<id> / week_prev_<date>_<time>_<id>
+    _, direction, key = callback.data.split('_', 2)
+    date, time_str, reservation_id = key.split('_')
+    key = (date, time_str, int(reservation_id))
+    
+    if direction == 'next':
+        page, has_prev, has_next = await get_week_page(after=key)
+    else:
+        page, has_prev, has_next = await get_week_page(before=key)
+    
+    if not page:
+        await callback.answer("📭 Больше броней нет")
+        return
+    
+    await callback.message.edit_text(
+        format_week_page(page),
+        reply_markup=get_week_page_keyboard(page, has_prev, has_next)
+    )
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('lst_'))
+async def process_list_page(callback: CallbackQuery, state: FSMContext, role: dict):
+    """Листание списка броней"""
+    # lst_<view>_<arg>_<page>
+    _, view, arg, page_index = callback.data.split('_')
+    page_index = int(page_index)
+    
+    allowed = role['is_waiter'] if view == 'my' else role['is_admin']
+    if not allowed:
+        await callback.answer("❌ У вас нет прав.", show_alert=True)
+        return
+    
+    if view == 'search':
+        # Запрос хранится в данных FSM пользователя (общих для всех процессов),
+        # arg - метка поиска: кнопки прежних поисков ее не совпадут
+        search = (await state.get_data()).get('search') or {}
+        if search.get('token') != arg or not await send_search_page(
+            callback.message, search['query'], arg, page_index, edit=True
+        ):
+            await callback.answer("⚠️ Список устарел, выполните поиск заново", show_alert=True)
+            return
+        await callback.answer()
+        return
+    
+    pages = await get_list_pages(view, arg, callback.from_user.id)
+    if not pages:
+        await callback.answer("⚠️ Список устарел, откройте его заново", show_alert=True)
+        return
+    
+    page_index = min(page_index, len(pages) - 1)
+    await send_list_page(callback.message, view, arg, pages, page_index, edit=True)
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('open_'))
+async def process_open_reservation(callback: CallbackQuery, role: dict):
+    """Карточка брони из списка (с действиями - для администраторов)"""
+    if not role['is_admin'] and not role['is_waiter']:
+        await callback.answer("❌ У вас нет прав.", show_alert=True)
+        return
+    
+    reservation_id = int(callback.data.replace('open_', ''))
+    reservation = await async_db.get_reservation_by_id(reservation_id)
+    if not reservation:
+        await callback.answer("❌ Бронь не найдена", show_alert=True)
+        return
+    
+    reply_markup = None
+    if role['is_admin']:
+        reply_markup = get_reservation_action_keyboard(
+            reservation_id,
+            reservation.get('deposit', 0),
+            reservation.get('deposit_paid', 0)
+        )
+    await callback.message.answer(
+        format_reservation_for_display(reservation),
+        parse_mode="Markdown",
+        reply_markup=reply_markup
+    )
+    await callback.answer()
 
 @dp.message(F.text == "📋 Мои брони")
-async def button_my_reservations(message: Message):
+async def button_my_reservations(message: Message, role: dict):
     """Просмотр броней на свои столы"""
     user_id = message.from_user.id
     
-    if not is_waiter(user_id):
+    if not role['is_waiter']:
         await message.answer("❌ Эта функция только для официантов.")
         return
     
     today = get_today_str()
-    my_tables = db.get_waiter_tables_for_date(user_id, today)
+    my_tables = await async_db.get_waiter_tables_for_date(user_id, today)
     
     if not my_tables:
         await message.answer(
@@ -817,27 +1193,18 @@ async def button_my_reservations(message: Message):
         )
         return
     
-    all_reservations = db.get_today_reservations()
-    
-    my_reservations = []
-    for res in all_reservations:
-        if res.get('table_number') in my_tables:
-            my_reservations.append(res)
+    pages = await get_list_pages('my', today, user_id)
     
-    if not my_reservations:
+    if not pages:
         await message.answer("📭 На сегодня нет броней на ваши столы.")
         return
     
-    my_reservations.sort(key=lambda x: x.get('time', '00:00'))
-    
-    for r in my_reservations:
-        text = format_reservation_for_display(r)
-        await message.answer(text, parse_mode="Markdown")
+    await send_list_page(message, 'my', today, pages)
 
 @dp.message(F.text == "➕ Новая бронь")
-async def button_new_reservation(message: Message):
+async def button_new_reservation(message: Message, role: dict):
     """Кнопка создания новой брони"""
-    if not is_admin(message.from_user.id):
+    if not role['is_admin']:
         await message.answer("❌ У вас нет прав.")
         return
     
@@ -858,10 +1225,30 @@ async def button_new_reservation(message: Message):
         reply_markup=get_cancel_keyboard()
     )
 
+@dp.message(F.text == "📥 Импорт")
+async def button_import(message: Message, state: FSMContext, role: dict):
+    """Кнопка импорта списка броней"""
+    if not role['is_admin']:
+        await message.answer("❌ У вас нет прав.")
+        return
+    
+    await message.answer(
+        "📥 **Импорт броней**\n\n"
+        "Отправьте одним сообщением список броней - по одной на строку, "
+        "в том же формате, что и при создании брони.\n\n"
+        "Или загрузите файл **.xlsx** / **.csv**: с заголовками колонок "
+        "(Имя, Телефон, Дата, Время, Стол, Гостей, Депозит, Повод) "
+        "или по одной брони в строке.\n\n"
+        f"Не больше {IMPORT_MAX_ROWS} броней за раз.",
+        parse_mode="Markdown",
+        reply_markup=get_cancel_keyboard()
+    )
+    await state.set_state(ReservationStates.waiting_for_import)
+
 @dp.message(F.text == "🔍 Поиск")
-async def button_search(message: Message, state: FSMContext):
+async def button_search(message: Message, state: FSMContext, role: dict):
     """Кнопка поиска"""
-    if not is_admin(message.from_user.id):
+    if not role['is_admin']:
         await message.answer("❌ У вас нет прав.")
         return
     
@@ -872,40 +1259,79 @@ async def button_search(message: Message, state: FSMContext):
     await state.set_state(ReservationStates.waiting_for_search_delete)
 
 @dp.message(F.text == "📊 Excel")
-async def button_excel(message: Message):
+async def button_excel(message: Message, role: dict):
     """Кнопка выгрузки Excel"""
-    if not is_admin(message.from_user.id):
+    if not role['is_admin']:
         await message.answer("❌ У вас нет прав.")
         return
     
-    reservations = db.get_today_reservations()
+    today = get_today_str()
+    filepath = await excel_pipeline.get_file(today)
     
-    if not reservations:
-        await message.answer("📭 На сегодня броней нет.")
+    if not filepath:
+        await message.answer(
+            "📭 На сегодня броней нет.\n\nВыгрузка за период:",
+            reply_markup=get_excel_range_keyboard()
+        )
         return
     
-    today = get_today_str()
-    filepath = ExcelGenerator.create_reservation_file(reservations, today, db)
-    db.save_excel_file(f"reservations_{today}.xlsx", today, filepath)
-    
     document = FSInputFile(filepath)
     await message.answer_document(
         document,
-        caption=f"📊 Брони на {today}",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        caption=f"📊 Брони на {today}\n\nВыгрузка за период - кнопками ниже",
+        reply_markup=get_excel_range_keyboard()
     )
 
+@dp.callback_query(lambda c: c.data in ("excel_week", "excel_month"))
+async def process_excel_range(callback: CallbackQuery, role: dict):
+    """Выгрузка Excel за 7 дней или за текущий месяц"""
+    if not role['is_admin']:
+        await callback.answer("❌ У вас нет прав.", show_alert=True)
+        return
+    
+    today = get_today_str()
+    if callback.data == "excel_week":
+        start_date = today
+        end_date = (datetime.strptime(today, "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d")
+    else:
+        today_dt = datetime.strptime(today, "%Y-%m-%d")
+        start_date, end_date = ExcelGenerator.month_range(today_dt.year, today_dt.month)
+    
+    await callback.answer("⏳ Формирую файл...")
+    
+    reservations = await async_db.get_reservations_in_range(start_date, end_date)
+    if not reservations:
+        await callback.message.answer(f"📭 С {start_date} по {end_date} броней нет.")
+        return
+    
+    # Официанты загружаются через async_db (с учетом в метриках запросов),
+    # в пуле остается только сборка книги
+    waiter_maps = {}
+    for date in {res['date'] for res in reservations}:
+        waiter_maps[date] = await async_db.get_table_assignment_map(date)
+    filepath = await async_db.run(
+        ExcelGenerator.create_range_file, reservations, start_date, end_date, None, waiter_maps
+    )
+    try:
+        await callback.message.answer_document(
+            FSInputFile(filepath, filename=ExcelGenerator.get_range_file_name(start_date, end_date)),
+            caption=f"📊 Брони с {start_date} по {end_date} ({len(reservations)} шт.)"
+        )
+    finally:
+        # Файл за период не кэшируется: после отправки он не нужен
+        os.remove(filepath)
+
 @dp.message(F.text == "📊 Мои столы")
-async def button_my_tables(message: Message, state: FSMContext):
+async def button_my_tables(message: Message, state: FSMContext, role: dict):
     """Кнопка просмотра и редактирования своих столов на сегодня"""
     user_id = message.from_user.id
     
-    if not is_waiter(user_id):
+    if not role['is_waiter']:
         await message.answer("❌ Эта функция только для официантов.")
         return
     
     today = get_today_str()
-    current_tables = db.get_waiter_tables_for_date(user_id, today)
+    current_tables = await async_db.get_waiter_tables_for_date(user_id, today)
     tables_str = ', '.join(current_tables) if current_tables else 'нет столов'
     
     await message.answer(
@@ -979,7 +1405,7 @@ async def button_remove_admin(message: Message, state: FSMContext):
         await message.answer("❌ Только главный администратор может удалять админов.")
         return
     
-    admins = get_all_admins()
+    admins = await get_all_admins()
     if len(admins) <= 1:
         await message.answer("❌ Нет других администраторов для удаления.")
         return
@@ -1003,7 +1429,7 @@ async def button_remove_waiter(message: Message, state: FSMContext):
         return
     
     today = get_today_str()
-    waiters = db.get_all_waiters_for_date(today)
+    waiters = await async_db.get_all_waiters_for_date(today)
     
     text = "**📋 Список официантов на сегодня:**\n\n"
     for w in waiters:
@@ -1025,7 +1451,7 @@ async def button_list_admins(message: Message):
         await message.answer("❌ Только главный администратор может просматривать список.")
         return
     
-    admins = get_all_admins()
+    admins = await get_all_admins()
     
     text = "**📋 Список администраторов:**\n\n"
     for admin in admins:
@@ -1046,10 +1472,10 @@ async def button_list_waiters(message: Message, state: FSMContext):
     today = get_today_str()
     
     # Официанты с назначенными столами на сегодня
-    waiters_with_tables = db.get_all_waiters_for_date(today)
+    waiters_with_tables = await async_db.get_all_waiters_for_date(today)
     
     # Все официанты с ролью
-    all_waiters = db.get_all_users_with_waiter_role()
+    all_waiters = await async_db.get_all_users_with_waiter_role()
     
     if not all_waiters:
         await message.answer("📭 Нет пользователей с ролью официанта.")
@@ -1109,22 +1535,19 @@ async def button_back_to_main(message: Message):
     """Возврат в главное меню"""
     await message.answer(
         "Главное меню:",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        reply_markup=await get_main_keyboard(message.from_user.id)
     )
 
 @dp.message(F.text == "❌ Отменить")
 async def button_cancel(message: Message, state: FSMContext):
     """Кнопка отмены действия"""
+    # Вместе с состоянием удаляются и отложенные действия (бронь, удаление, оплата)
     await state.clear()
     user_id = message.from_user.id
-    pending_reservations.pop(user_id, None)
-    pending_deletions.pop(user_id, None)
-    pending_edits.pop(user_id, None)
-    pending_payments.pop(user_id, None)
     
     await message.answer(
         "❌ Действие отменено.",
-        reply_markup=get_main_keyboard(user_id)
+        reply_markup=await get_main_keyboard(user_id)
     )
 
 # ========== ОБРАБОТЧИКИ СОСТОЯНИЙ ==========
@@ -1147,36 +1570,18 @@ async def process_new_admin_id(message: Message, state: FSMContext):
         else:
             new_user_id = int(text)
         
-        # Проверяем сначала в БД, потом в users_db
-        user_in_db = db.get_user(new_user_id)
-        user_in_memory = new_user_id in users_db
+        user_in_db = await async_db.get_user(new_user_id)
         
-        if not user_in_db and not user_in_memory:
+        if not user_in_db:
             await message.answer(
                 f"❌ Пользователь с ID {new_user_id} еще не запускал бота.\n"
                 f"Сначала он должен написать /start боту."
             )
             return
         
-        # Если пользователь есть в БД, но нет в памяти - добавляем в память
-        if user_in_db and not user_in_memory:
-            users_db[new_user_id] = {
-                'username': user_in_db.get('username', ''),
-                'first_name': user_in_db.get('first_name', f'User {new_user_id}'),
-                'is_admin': user_in_db.get('is_admin', 0),
-                'is_waiter': user_in_db.get('is_waiter', 0),
-                'created_at': user_in_db.get('created_at', datetime.now().isoformat())
-            }
-            print(f"✅ Пользователь {new_user_id} восстановлен из БД в память")
-        
         if adding_role == 'admin':
-            if add_admin(new_user_id):
-                # Получаем информацию о пользователе
-                user_info = users_db.get(new_user_id, {})
-                if not user_info and user_in_db:
-                    user_info = user_in_db
-                
-                name = user_info.get('first_name', 'Неизвестно')
+            if await add_admin(new_user_id):
+                name = user_in_db.get('first_name') or 'Неизвестно'
                 
                 await message.answer(
                     f"✅ Администратор добавлен!\n"
@@ -1197,8 +1602,8 @@ async def process_new_admin_id(message: Message, state: FSMContext):
                 await message.answer("❌ Не удалось добавить администратора.")
         
         elif adding_role == 'waiter':
-            if add_waiter_role(new_user_id):
-                user_info = db.get_user(new_user_id)
+            if await add_waiter_role(new_user_id):
+                user_info = await async_db.get_user(new_user_id)
                 name = user_info.get('first_name', 'Неизвестно') if user_info else 'Неизвестно'
                 
                 try:
@@ -1251,12 +1656,12 @@ async def process_remove_user_id(message: Message, state: FSMContext):
             await message.answer("❌ Нельзя удалить главного администратора.")
             return
         
-        if user_id not in users_db and not db.get_user(user_id):
+        if not await async_db.get_user(user_id):
             await message.answer(f"❌ Пользователь с ID {user_id} не найден.")
             return
         
         if removing_role == 'admin':
-            if remove_admin(user_id):
+            if await remove_admin(user_id):
                 await message.answer(
                     f"✅ Администратор удален!",
                     reply_markup=get_admin_management_keyboard()
@@ -1274,8 +1679,8 @@ async def process_remove_user_id(message: Message, state: FSMContext):
         
         elif removing_role == 'waiter':
             today = get_today_str()
-            if db.remove_waiter_for_date(user_id, today):
-                remove_waiter_role(user_id)
+            if await async_db.remove_waiter_for_date(user_id, today):
+                await remove_waiter_role(user_id)
                 await message.answer(
                     f"✅ Официант удален с сегодняшнего дня!",
                     reply_markup=get_admin_management_keyboard()
@@ -1314,7 +1719,7 @@ async def process_waiter_tables(message: Message, state: FSMContext):
             )
             return
         
-        db.set_waiter_tables_for_date(
+        await async_db.set_waiter_tables_for_date(
             user_id,
             message.from_user.first_name or f"Официант {user_id}",
             table_list,
@@ -1325,7 +1730,7 @@ async def process_waiter_tables(message: Message, state: FSMContext):
             f"✅ Столы на {today} сохранены!\n"
             f"Вы будете получать уведомления для столов: {', '.join(table_list)}\n\n"
             f"Завтра нужно будет настроить заново.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
         
     except Exception as e:
@@ -1336,32 +1741,19 @@ async def process_waiter_tables(message: Message, state: FSMContext):
 @dp.message(ReservationStates.waiting_for_search_delete)
 async def process_search(message: Message, state: FSMContext):
     """Обработка поиска"""
-    results = db.search_reservations(message.text)
+    # Запрос и метка поиска сохраняются в FSM: страницы читаются из БД заново
+    # при листании, в любом процессе и после перезапуска бота
+    token = uuid.uuid4().hex[:12]
+    await state.set_state(None)
+    await state.update_data(search={'token': token, 'query': message.text})
     
-    if not results:
+    if not await send_search_page(message, message.text, token):
         await message.answer("❌ Ничего не найдено.")
-    else:
-        results.sort(key=lambda x: x.get('date', ''), reverse=True)
-        
-        for r in results[:10]:
-            await message.answer(
-                format_reservation_for_display(r),
-                parse_mode="Markdown",
-                reply_markup=get_reservation_action_keyboard(
-                    r['id'], 
-                    r.get('deposit', 0), 
-                    r.get('deposit_paid', 0)
-                )
-            )
-        
-        if len(results) > 10:
-            await message.answer(f"... и еще {len(results) - 10} результатов")
     
     await message.answer(
         "Выберите действие:",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        reply_markup=await get_main_keyboard(message.from_user.id)
     )
-    await state.clear()
 
 @dp.message(ReservationStates.waiting_for_year)
 async def process_year(message: Message, state: FSMContext):
@@ -1370,6 +1762,7 @@ async def process_year(message: Message, state: FSMContext):
     try:
         year = int(message.text.strip())
         if 2020 <= year <= 2030:
+            await async_db.set_setting('current_year', year)
             current_year = year
             await message.answer(f"✅ Год установлен: {year}")
         else:
@@ -1380,7 +1773,7 @@ async def process_year(message: Message, state: FSMContext):
         await state.clear()
         await message.answer(
             "Главное меню:",
-            reply_markup=get_main_keyboard(message.from_user.id)
+            reply_markup=await get_main_keyboard(message.from_user.id)
         )
 
 @dp.callback_query(lambda c: c.data.startswith('edit_waiter_name_'))
@@ -1389,7 +1782,7 @@ async def process_edit_waiter_name(callback: CallbackQuery, state: FSMContext):
     waiter_id = int(callback.data.replace('edit_waiter_name_', ''))
     
     # Получаем текущее имя
-    user = db.get_user(waiter_id)
+    user = await async_db.get_user(waiter_id)
     current_name = user.get('first_name', 'Неизвестно') if user else 'Неизвестно'
     
     await state.update_data(edit_waiter_id=waiter_id)
@@ -1422,16 +1815,7 @@ async def process_waiter_new_name(message: Message, state: FSMContext):
         return
     
     # Обновляем имя в БД
-    with sqlite3.connect(db.db_name) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users SET first_name = ? WHERE user_id = ?
-        ''', (new_name, waiter_id))
-        conn.commit()
-    
-    # Также обновляем в памяти, если есть
-    if waiter_id in users_db:
-        users_db[waiter_id]['first_name'] = new_name
+    await async_db.update_user_name(waiter_id, new_name)
     
     await message.answer(f"✅ Имя официанта (ID: {waiter_id}) изменено на: {new_name}")
     
@@ -1440,8 +1824,8 @@ async def process_waiter_new_name(message: Message, state: FSMContext):
     
     # Показываем обновленный список
     today = get_today_str()
-    waiters_with_tables = db.get_all_waiters_for_date(today)
-    all_waiters = db.get_all_users_with_waiter_role()
+    waiters_with_tables = await async_db.get_all_waiters_for_date(today)
+    all_waiters = await async_db.get_all_users_with_waiter_role()
     
     if not all_waiters:
         await message.answer("📭 Нет пользователей с ролью официанта.", reply_markup=get_admin_management_keyboard())
@@ -1477,18 +1861,26 @@ async def back_to_admin_menu(callback: CallbackQuery):
 
 # ========== ОБРАБОТЧИКИ ДЕЙСТВИЙ С БРОНЯМИ ==========
 
+async def pop_pending(state: FSMContext, key: str):
+    """Достает отложенное действие из данных FSM и удаляет его оттуда"""
+    data = await state.get_data()
+    value = data.pop(key, None)
+    if value is not None:
+        await state.set_data(data)
+    return value
+
 @dp.callback_query(lambda c: c.data.startswith('delete_'))
-async def process_delete_callback(callback: CallbackQuery):
+async def process_delete_callback(callback: CallbackQuery, state: FSMContext):
     """Обработка нажатия на кнопку удаления"""
     reservation_id = int(callback.data.split('_')[1])
-    reservation = db.get_reservation_by_id(reservation_id)
+    reservation = await async_db.get_reservation_by_id(reservation_id)
     
     if not reservation:
         await callback.answer("❌ Бронь не найдена")
         await callback.message.delete()
         return
     
-    pending_deletions[callback.from_user.id] = reservation_id
+    await state.update_data(pending_deletion=reservation_id)
     
     await callback.message.edit_text(
         f"🗑 **Подтверждение удаления**\n\n"
@@ -1505,18 +1897,19 @@ async def process_delete_callback(callback: CallbackQuery):
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data == "confirm_delete")
-async def process_confirm_delete(callback: CallbackQuery):
+async def process_confirm_delete(callback: CallbackQuery, state: FSMContext):
     """Подтверждение удаления брони"""
     user_id = callback.from_user.id
     
-    if user_id not in pending_deletions:
+    reservation_id = await pop_pending(state, 'pending_deletion')
+    if reservation_id is None:
         await callback.message.edit_text("❌ Ошибка: бронь не найдена")
         return
     
-    reservation_id = pending_deletions[user_id]
-    reservation = db.get_reservation_by_id(reservation_id)
+    reservation = await async_db.get_reservation_by_id(reservation_id)
     
-    if db.delete_reservation(reservation_id):
+    if await async_db.delete_reservation(reservation_id):
+        await run_notification_change(cancel_reservation_notifications, reservation_id)
         await callback.message.edit_text(
             f"✅ Бронь #{reservation_id} удалена.",
             parse_mode="Markdown"
@@ -1524,6 +1917,7 @@ async def process_confirm_delete(callback: CallbackQuery):
         
         today = get_today_str()
         if reservation and reservation.get('date') == today:
+            excel_pipeline.schedule(today)
             await notify_all_users(
                 f"🗑 Бронь #{reservation_id} отменена:\n"
                 f"{reservation.get('time')} | {reservation.get('name')} | Стол {reservation.get('table_number', '?')}",
@@ -1532,16 +1926,14 @@ async def process_confirm_delete(callback: CallbackQuery):
     else:
         await callback.message.edit_text("❌ Ошибка при удалении брони")
     
-    pending_deletions.pop(user_id, None)
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data == "cancel_delete")
-async def process_cancel_delete(callback: CallbackQuery):
+async def process_cancel_delete(callback: CallbackQuery, state: FSMContext):
     """Отмена удаления"""
-    user_id = callback.from_user.id
-    if user_id in pending_deletions:
-        reservation_id = pending_deletions[user_id]
-        reservation = db.get_reservation_by_id(reservation_id)
+    reservation_id = await pop_pending(state, 'pending_deletion')
+    if reservation_id is not None:
+        reservation = await async_db.get_reservation_by_id(reservation_id)
         
         if reservation:
             await callback.message.edit_text(
@@ -1553,23 +1945,22 @@ async def process_cancel_delete(callback: CallbackQuery):
                     reservation.get('deposit_paid', 0)
                 )
             )
-        pending_deletions.pop(user_id, None)
     
     await callback.answer("❌ Удаление отменено")
 
 @dp.callback_query(lambda c: c.data.startswith('pay_deposit_'))
-async def process_pay_deposit(callback: CallbackQuery):
+async def process_pay_deposit(callback: CallbackQuery, state: FSMContext):
     """Обработка нажатия на кнопку оплаты депозита"""
     reservation_id = int(callback.data.replace('pay_deposit_', ''))
-    reservation = db.get_reservation_by_id(reservation_id)
+    reservation = await async_db.get_reservation_by_id(reservation_id)
     
     if not reservation:
         await callback.answer("❌ Бронь не найдена")
         await callback.message.delete()
         return
     
-    # Сохраняем ID для подтверждения
-    pending_payments[callback.from_user.id] = reservation_id
+    # Сохраняем ID и сумму, которую видит администратор, для подтверждения
+    await state.update_data(pending_payment=reservation_id, pending_payment_deposit=reservation.get('deposit', 0))
     
     await callback.message.edit_text(
         f"💰 **Подтверждение оплаты депозита**\n\n"
@@ -1586,26 +1977,31 @@ async def process_pay_deposit(callback: CallbackQuery):
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data == "confirm_payment")
-async def process_confirm_payment(callback: CallbackQuery):
+async def process_confirm_payment(callback: CallbackQuery, state: FSMContext):
     """Подтверждение оплаты депозита"""
     user_id = callback.from_user.id
     
-    if user_id not in pending_payments:
+    reservation_id = await pop_pending(state, 'pending_payment')
+    deposit = await pop_pending(state, 'pending_payment_deposit')
+    if reservation_id is None:
         await callback.message.edit_text("❌ Ошибка: бронь не найдена")
         return
     
-    reservation_id = pending_payments[user_id]
-    reservation = db.get_reservation_by_id(reservation_id)
+    reservation = await async_db.get_reservation_by_id(reservation_id)
     
     if not reservation:
         await callback.message.edit_text("❌ Бронь не найдена")
-        pending_payments.pop(user_id, None)
         return
     
-    # Обновляем статус депозита
-    update_data = {'deposit_paid': 1}
-    if db.update_reservation(reservation_id, update_data):
-        updated_reservation = db.get_reservation_by_id(reservation_id)
+    # Обновляем статус депозита, если сумму не изменили после открытия брони
+    result = await async_db.update_reservation(
+        reservation_id,
+        {'deposit_paid': 1},
+        expected={'deposit': reservation.get('deposit', 0) if deposit is None else deposit}
+    )
+    if result['updated']:
+        updated_reservation = result['reservation']
+        await run_notification_change(schedule_reservation_notifications, updated_reservation)
         
         await callback.message.edit_text(
             f"✅ **Депозит отмечен как оплачен!**\n\n"
@@ -1616,24 +2012,36 @@ async def process_confirm_payment(callback: CallbackQuery):
         # Уведомление об оплате депозита
         today = get_today_str()
         if updated_reservation and updated_reservation.get('date') == today:
+            excel_pipeline.schedule(today)
             await notify_all_users(
                 f"💰 Депозит оплачен для брони #{reservation_id}\n"
                 f"{updated_reservation.get('time')} | {updated_reservation.get('name')} | Стол {updated_reservation.get('table_number', '?')}",
                 exclude_ids=[user_id]
             )
+    elif result['conflicts']:
+        await callback.message.edit_text(
+            f"⚠️ Сумму депозита брони #{reservation_id} изменили. "
+            f"Проверьте актуальные данные:\n\n"
+            f"{format_reservation_for_display(result['reservation'])}",
+            parse_mode="Markdown",
+            reply_markup=get_reservation_action_keyboard(
+                reservation_id,
+                result['reservation'].get('deposit', 0),
+                result['reservation'].get('deposit_paid', 0)
+            )
+        )
     else:
         await callback.message.edit_text("❌ Ошибка при обновлении статуса депозита")
     
-    pending_payments.pop(user_id, None)
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data == "cancel_payment")
-async def process_cancel_payment(callback: CallbackQuery):
+async def process_cancel_payment(callback: CallbackQuery, state: FSMContext):
     """Отмена оплаты депозита"""
-    user_id = callback.from_user.id
-    if user_id in pending_payments:
-        reservation_id = pending_payments[user_id]
-        reservation = db.get_reservation_by_id(reservation_id)
+    reservation_id = await pop_pending(state, 'pending_payment')
+    await pop_pending(state, 'pending_payment_deposit')
+    if reservation_id is not None:
+        reservation = await async_db.get_reservation_by_id(reservation_id)
         
         if reservation:
             await callback.message.edit_text(
@@ -1645,7 +2053,6 @@ async def process_cancel_payment(callback: CallbackQuery):
                     reservation.get('deposit_paid', 0)
                 )
             )
-        pending_payments.pop(user_id, None)
     
     await callback.answer("❌ Операция отменена")
 
@@ -1653,7 +2060,7 @@ async def process_cancel_payment(callback: CallbackQuery):
 async def process_edit_callback(callback: CallbackQuery):
     """Обработка нажатия на кнопку редактирования"""
     reservation_id = int(callback.data.split('_')[1])
-    reservation = db.get_reservation_by_id(reservation_id)
+    reservation = await async_db.get_reservation_by_id(reservation_id)
     
     if not reservation:
         await callback.answer("❌ Бронь не найдена")
@@ -1676,7 +2083,7 @@ async def process_edit_field(callback: CallbackQuery, state: FSMContext):
     field = parts[1]
     reservation_id = int(parts[2])
     
-    reservation = db.get_reservation_by_id(reservation_id)
+    reservation = await async_db.get_reservation_by_id(reservation_id)
     if not reservation:
         await callback.answer("❌ Бронь не найдена")
         return
@@ -1704,9 +2111,12 @@ async def process_edit_field(callback: CallbackQuery, state: FSMContext):
         'occasion': reservation.get('occasion', '')
     }
     
+    # Значение поля на момент начала редактирования: изменение сохранится,
+    # только если поле за это время никто не поменял
     await state.update_data(
         edit_reservation_id=reservation_id,
-        edit_field=field
+        edit_field=field,
+        edit_original=reservation.get(EDIT_FIELD_KEYS.get(field, field))
     )
     
     hints = {
@@ -1746,7 +2156,7 @@ async def process_edit_value(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    reservation = db.get_reservation_by_id(reservation_id)
+    reservation = await async_db.get_reservation_by_id(reservation_id)
     if not reservation:
         await message.answer("❌ Бронь не найдена")
         await state.clear()
@@ -1755,6 +2165,8 @@ async def process_edit_value(message: Message, state: FSMContext):
     new_value = message.text.strip()
     valid = True
     error_msg = ""
+    table_strict = False
+    reset_deposit_paid = False
     
     if field == 'date':
         try:
@@ -1780,7 +2192,7 @@ async def process_edit_value(message: Message, state: FSMContext):
         else:
             table_num, is_strict = parse_table_number(new_value)
             new_value = table_num
-            availability = check_table_availability(
+            availability = await check_table_availability(
                 table_num,
                 reservation.get('date'),
                 reservation.get('time'),
@@ -1795,7 +2207,7 @@ async def process_edit_value(message: Message, state: FSMContext):
                     f"Введите другой номер стола"
                 )
             else:
-                await state.update_data(table_strict=is_strict)
+                table_strict = is_strict
     
     elif field == 'guests':
         try:
@@ -1830,7 +2242,7 @@ async def process_edit_value(message: Message, state: FSMContext):
             else:
                 new_value = deposit
                 # Сбрасываем статус оплаты при изменении суммы депозита
-                await state.update_data(reset_deposit_paid=True)
+                reset_deposit_paid = True
         except ValueError:
             valid = False
             error_msg = "❌ Введите число или сокращение (например 5к, 10к, 20000)"
@@ -1843,14 +2255,20 @@ async def process_edit_value(message: Message, state: FSMContext):
         await message.answer(error_msg)
         return
     
-    update_data = {field: new_value}
+    key = EDIT_FIELD_KEYS.get(field, field)
+    update_data = {key: new_value}
+    expected = {key: data.get('edit_original')}
     if field == 'table':
-        update_data['table_strict'] = data.get('table_strict', False)
-    elif field == 'deposit' and data.get('reset_deposit_paid'):
+        update_data['table_strict'] = table_strict
+        # Свободность стола проверена для этих даты и времени
+        expected.update(date=reservation.get('date'), time=reservation.get('time'))
+    elif field == 'deposit' and reset_deposit_paid:
         update_data['deposit_paid'] = 0  # Сбрасываем статус оплаты при изменении суммы
     
-    if db.update_reservation(reservation_id, update_data):
-        updated_reservation = db.get_reservation_by_id(reservation_id)
+    result = await async_db.update_reservation(reservation_id, update_data, expected=expected)
+    if result['updated']:
+        updated_reservation = result['reservation']
+        await run_notification_change(schedule_reservation_notifications, updated_reservation)
         
         await message.answer(
             f"✅ Бронь #{reservation_id} обновлена!\n\n"
@@ -1860,18 +2278,34 @@ async def process_edit_value(message: Message, state: FSMContext):
         
         today = get_today_str()
         if updated_reservation and updated_reservation.get('date') == today:
+            excel_pipeline.schedule(today)
             await notify_all_users(
                 f"✏️ Изменена бронь #{reservation_id}\n"
                 f"{format_reservation_for_display(updated_reservation)}",
                 exclude_ids=[message.from_user.id]
             )
+    elif result['conflicts']:
+        # Поле изменили после начала редактирования (другой администратор или процесс)
+        current = result['reservation']
+        changed = ', '.join(EDIT_FIELD_NAMES.get(name, name) for name in result['conflicts'])
+        await message.answer(
+            f"⚠️ Бронь #{reservation_id} изменили, пока вы ее редактировали ({changed}). "
+            f"Изменение не сохранено - вот актуальные данные:\n\n"
+            f"{format_reservation_for_display(current)}",
+            parse_mode="Markdown",
+            reply_markup=get_reservation_action_keyboard(
+                reservation_id,
+                current.get('deposit', 0),
+                current.get('deposit_paid', 0)
+            )
+        )
     else:
         await message.answer("❌ Ошибка при обновлении брони")
     
     await state.clear()
     await message.answer(
         "Выберите действие:",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        reply_markup=await get_main_keyboard(message.from_user.id)
     )
 
 @dp.callback_query(lambda c: c.data == "back_to_reservation")
@@ -1880,7 +2314,7 @@ async def back_to_reservation(callback: CallbackQuery):
     id_match = re.search(r'#(\d+)', callback.message.text)
     if id_match:
         reservation_id = int(id_match.group(1))
-        reservation = db.get_reservation_by_id(reservation_id)
+        reservation = await async_db.get_reservation_by_id(reservation_id)
         if reservation:
             await callback.message.edit_text(
                 format_reservation_for_display(reservation),
@@ -1899,38 +2333,39 @@ async def back_to_search(callback: CallbackQuery):
     await callback.message.edit_text("🔍 Введите имя или номер телефона для поиска:")
     await callback.answer()
 
-# ========== ОСНОВНОЙ ОБРАБОТЧИК ТЕКСТА ==========
-
-@dp.message(ReservationStates.waiting_for_table_change)
-async def process_table_change(message: Message, state: FSMContext):
-    """Обработка изменения стола при конфликте"""
-    user_id = message.from_user.id
-    
-    if user_id not in pending_reservations:
-        await state.clear()
-        return
-    
-    new_table = message.text.strip()
-    
-    if not new_table.isdigit():
-        await message.answer("❌ Номер стола должен быть числом. Попробуйте снова:")
+# Команда регистрируется до общего обработчика текста, иначе он ее перехватит
+@dp.message(Command("queue"))
+async def cmd_queue(message: Message, role: dict):
+    """Метрики очереди обработки апдейтов"""
+    if not role['is_admin']:
         return
     
-    pending = pending_reservations[user_id]
-    parsed = pending['parsed']
-    
+    stats = dispatch_queue.stats()
+    await message.answer(
+        f"📊 Очередь апдейтов\n\n"
+        f"Обработчиков: {stats['active']}/{stats['workers']} (максимум {stats['max_active']})\n"
+        f"В очереди: {stats['waiting']} (максимум {stats['max_waiting']})\n"
+        f"Чатов в работе: {stats['chats']}\n"
+        f"Обработано: {stats['processed']}\n"
+        f"Ожидание: среднее {stats['avg_wait'] * 1000:.0f} мс, максимум {stats['max_wait'] * 1000:.0f} мс"
+    )
+
+# ========== ОСНОВНОЙ ОБРАБОТЧИК ТЕКСТА ==========
+
+async def apply_table_change(message: Message, state: FSMContext, user_id: int, parsed: dict, new_table: str):
+    """Создание отложенной брони на другом столе (после конфликта)"""
     parsed['table_number'] = new_table
     parsed['table_strict'] = False
     
-    availability = check_table_availability(
+    availability = await check_table_availability(
         parsed['table_number'],
         parsed['date'],
         parsed['time']
     )
     
     if availability['available']:
-        reservation_id = db.add_reservation(parsed)
-        pending_reservations.pop(user_id, None)
+        reservation_id = await async_db.add_reservation(parsed)
+        await run_notification_change(schedule_reservation_notifications, {**parsed, 'id': reservation_id})
         
         table_text = f"{parsed['table_number']}"
         if parsed['table_strict']:
@@ -1957,50 +2392,177 @@ async def process_table_change(message: Message, state: FSMContext):
         if parsed['date'] == today:
             await notify_all_users(reservation_text, exclude_ids=[user_id])
             
-            # Сохраняем в Excel
-            try:
-                today_reservations = db.get_today_reservations()
-                filepath = ExcelGenerator.create_reservation_file(today_reservations, today, db)
-                db.save_excel_file(f"reservations_{today}.xlsx", today, filepath)
-            except Exception as e:
-                print(f"❌ Ошибка сохранения Excel: {e}")
+            # Обновляем Excel
+            excel_pipeline.schedule(today)
         
         await state.clear()
         await message.answer(
             "✅ Бронь создана!",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
     else:
+        await state.update_data(pending_reservation=parsed)
         conflict = availability['conflicts'][0]
+        suggestions = await suggest_tables(parsed)
         await message.answer(
             f"⚠️ Стол **{new_table}** тоже занят!\n"
             f"🕐 {conflict['time']} | 👤 {conflict['name']}\n"
             f"👥 {conflict['guests']} чел.\n\n"
-            f"Введите другой номер стола:",
-            parse_mode="Markdown"
+            + ("Свободные столы на это время - нажмите, чтобы выбрать.\n" if suggestions else "")
+            + "Введите другой номер стола:",
+            parse_mode="Markdown",
+            reply_markup=get_table_suggestions_keyboard(suggestions)
         )
 
+@dp.message(ReservationStates.waiting_for_table_change)
+async def process_table_change(message: Message, state: FSMContext):
+    """Обработка изменения стола при конфликте"""
+    user_id = message.from_user.id
+    
+    parsed = (await state.get_data()).get('pending_reservation')
+    if not parsed:
+        await state.clear()
+        return
+    
+    new_table = message.text.strip()
+    
+    if not new_table.isdigit():
+        await message.answer("❌ Номер стола должен быть числом. Попробуйте снова:")
+        return
+    
+    await apply_table_change(message, state, user_id, parsed, new_table)
+
+@dp.callback_query(lambda c: c.data.startswith("suggest_table_"))
+async def process_suggested_table(callback: CallbackQuery, state: FSMContext, role: dict):
+    """Выбор свободного стола из подсказки при конфликте"""
+    user_id = callback.from_user.id
+    
+    if not role['is_admin']:
+        await callback.answer("❌ У вас нет прав", show_alert=True)
+        return
+    
+    parsed = (await state.get_data()).get('pending_reservation')
+    if not parsed:
+        await callback.answer("⚠️ Бронь уже создана или отменена", show_alert=True)
+        return
+    
+    new_table = callback.data.replace("suggest_table_", "")
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer()
+    await apply_table_change(callback.message, state, user_id, parsed, new_table)
+
+# ========== ИМПОРТ БРОНЕЙ ==========
+
+async def run_import(message: Message, state: FSMContext, items: list):
+    """
+    Импорт броней: проверка полей и пересечений в памяти, добавление
+    одной транзакцией, одна сводная рассылка персоналу вместо рассылки на каждую бронь
+    items: [(номер строки, распознанная бронь)]
+    """
+    user_id = message.from_user.id
+    
+    if not items:
+        await message.answer("📭 Не найдено ни одной брони для импорта.")
+        return
+    if len(items) > IMPORT_MAX_ROWS:
+        await message.answer(f"❌ Слишком много броней: {len(items)} (максимум {IMPORT_MAX_ROWS}).")
+        return
+    
+    # Брони из БД только на даты импорта
+    existing = []
+    for date in sorted({res['date'] for _, res in items if res['date']}):
+        existing.extend(await async_db.get_reservations_by_date(date))
+    
+    plan = plan_import(items, existing, MIN_HOURS_BETWEEN_RESERVATIONS, get_reservation_errors)
+    accepted = plan['accepted']
+    rejected = plan['rejected']
+    
+    reservation_ids = await async_db.add_reservations_bulk(accepted) if accepted else []
+    added = [{**res, 'id': reservation_id} for res, reservation_id in zip(accepted, reservation_ids)]
+    for res in added:
+        await async_db.run(schedule_reservation_notifications, res)
+    if added:
+        await async_db.bump_setting('jobs_version')
+    
+    report = (
+        f"📥 Импорт завершен\n\n"
+        f"✅ Добавлено: {len(added)}\n"
+        f"⚠️ Пропущено: {len(rejected)}\n"
+    )
+    if rejected:
+        report += "\nПропущенные строки:\n"
+        for num, raw_text, reason in rejected[:20]:
+            report += f"• Строка {num}: {reason.replace('❌ ', '')}\n  {raw_text[:60]}\n"
+        if len(rejected) > 20:
+            report += f"...и еще {len(rejected) - 20}\n"
+    
+    # Сбрасываем только шаг импорта: данные других действий (отложенные брони,
+    # удаление, оплата) остаются
+    await state.set_state(None)
+    await message.answer(report, reply_markup=await get_main_keyboard(user_id))
+    
+    today = get_today_str()
+    today_added = sorted((res for res in added if res['date'] == today), key=lambda r: r['time'])
+    if today_added:
+        summary = f"📥 Импортированы брони на сегодня: {len(today_added)}\n\n"
+        for res in today_added[:30]:
+            summary += f"#{res['id']} {res['time']} | {res['name']} | Стол {res['table_number']} | {res['guests']} чел.\n"
+        if len(today_added) > 30:
+            summary += f"...и еще {len(today_added) - 30}\n"
+        await notify_all_users(summary, exclude_ids=[user_id])
+        
+        # Обновляем Excel
+        excel_pipeline.schedule(today)
+
+@dp.message(ReservationStates.waiting_for_import, F.text)
+async def process_import_text(message: Message, state: FSMContext, role: dict):
+    """Импорт списка броней из сообщения (бронь на строку)"""
+    if not role['is_admin']:
+        await state.clear()
+        return
+    
+    items = [
+        (num, parse_reservation_text(line, current_year))
+        for num, line in enumerate(split_text_lines(message.text), 1)
+    ]
+    await run_import(message, state, items)
+
+@dp.message(ReservationStates.waiting_for_import, F.document)
+async def process_import_document(message: Message, state: FSMContext, role: dict):
+    """Импорт броней из файла .xlsx / .csv"""
+    if not role['is_admin']:
+        return
+    
+    document = message.document
+    if document.file_size and document.file_size > 5 * 1024 * 1024:
+        await message.answer("❌ Файл слишком большой (максимум 5 МБ).")
+        return
+    
+    try:
+        content = await bot.download(document)
+        rows = await async_db.run(read_table_file, content.getvalue(), document.file_name or '')
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    except Exception as e:
+        logging.error(f"Ошибка чтения файла импорта: {e}")
+        await message.answer("❌ Не удалось прочитать файл.")
+        return
+    
+    items = rows_to_reservations(rows, parse_reservation_text, current_year)
+    await run_import(message, state, items)
+
 @dp.message(F.text)
-async def process_any_text(message: Message, state: FSMContext):
+async def process_any_text(message: Message, state: FSMContext, role: dict):
     """Обработка любого текста - пытаемся создать бронь"""
     user_id = message.from_user.id
     
-    if not is_admin(user_id):
+    if not role['is_admin']:
         return
     
     parsed = parse_reservation_text(message.text, current_year)
     
-    errors = []
-    if not parsed['name'] or parsed['name'] == 'Не указано':
-        errors.append("❌ Не удалось определить имя гостя")
-    if not parsed['phone']:
-        errors.append("❌ Не удалось определить телефон")
-    if not parsed['date']:
-        errors.append("❌ Не удалось определить дату (формат ДД.ММ)")
-    if not parsed['time']:
-        errors.append("❌ Не удалось определить время (формат ЧЧ:ММ)")
-    if not parsed['table_number']:
-        errors.append("❌ Не удалось определить номер стола")
+    errors = get_reservation_errors(parsed)
     
     if errors:
         await message.answer(
@@ -2009,19 +2571,15 @@ async def process_any_text(message: Message, state: FSMContext):
         )
         return
     
-    availability = check_table_availability(
+    availability = await check_table_availability(
         parsed['table_number'],
         parsed['date'],
         parsed['time']
     )
     
     if not availability['available']:
-        pending_reservations[user_id] = {
-            'parsed': parsed,
-            'original_text': message.text
-        }
-        
         conflict = availability['conflicts'][0]
+        suggestions = await suggest_tables(parsed)
         
         await message.answer(
             f"⚠️ **Стол {parsed['table_number']} занят!**\n\n"
@@ -2029,14 +2587,18 @@ async def process_any_text(message: Message, state: FSMContext):
             f"🕐 {conflict['time']} | 👤 {conflict['name']}\n"
             f"👥 {conflict['guests']} чел.\n"
             f"⏱️ Интервал: {conflict['diff_hours']:.1f} ч (минимум {MIN_HOURS_BETWEEN_RESERVATIONS} ч)\n\n"
-            f"Введите **другой номер стола** для этой брони:",
-            parse_mode="Markdown"
+            + ("Свободные столы на это время - нажмите, чтобы выбрать.\n" if suggestions else "")
+            + "Введите **другой номер стола** для этой брони:",
+            parse_mode="Markdown",
+            reply_markup=get_table_suggestions_keyboard(suggestions)
         )
         
         await state.set_state(ReservationStates.waiting_for_table_change)
+        await state.update_data(pending_reservation=parsed)
         return
     
-    reservation_id = db.add_reservation(parsed)
+    reservation_id = await async_db.add_reservation(parsed)
+    await run_notification_change(schedule_reservation_notifications, {**parsed, 'id': reservation_id})
     
     table_text = f"{parsed['table_number']}"
     if parsed['table_strict']:
@@ -2063,21 +2625,15 @@ async def process_any_text(message: Message, state: FSMContext):
     if parsed['date'] == today:
         await notify_all_users(reservation_text, exclude_ids=[user_id])
         
-        # Сохраняем в Excel
-        try:
-            today_reservations = db.get_today_reservations()
-            filepath = ExcelGenerator.create_reservation_file(today_reservations, today, db)
-            db.save_excel_file(f"reservations_{today}.xlsx", today, filepath)
-            print(f"📊 Excel файл сохранен: {filepath}")
-        except Exception as e:
-            print(f"❌ Ошибка сохранения Excel: {e}")
+        # Обновляем Excel
+        excel_pipeline.schedule(today)
 
 # ========== КОМАНДЫ ==========
 
 @dp.message(Command("setyear"))
-async def cmd_set_year(message: Message):
+async def cmd_set_year(message: Message, role: dict):
     """Установка года"""
-    if not is_admin(message.from_user.id):
+    if not role['is_admin']:
         await message.answer("❌ У вас нет прав.")
         return
     
@@ -2090,6 +2646,7 @@ async def cmd_set_year(message: Message):
         year = int(parts[1])
         if 2020 <= year <= 2030:
             global current_year
+            await async_db.set_setting('current_year', year)
             current_year = year
             await message.answer(f"✅ Год установлен: {year}")
         else:
@@ -2102,22 +2659,21 @@ async def cmd_myrole(message: Message):
     """Проверка своей роли"""
     user_id = message.from_user.id
     
-    # Проверяем в памяти
-    in_memory = user_id in users_db
-    memory_data = users_db.get(user_id, {})
+    # Проверяем в кэше ролей
+    cached_role = role_cache.peek(user_id)
     
     # Проверяем в БД
-    in_db = db.get_user(user_id)
+    in_db = await async_db.get_user(user_id)
     
     text = f"**🔍 Отладка ролей**\n\n"
     text += f"User ID: {user_id}\n"
     text += f"Main admin: {is_main_admin(user_id)}\n\n"
     
-    text += f"**В памяти:**\n"
-    text += f"Есть в памяти: {in_memory}\n"
-    if in_memory:
-        text += f"is_admin: {memory_data.get('is_admin', 0)}\n"
-        text += f"is_waiter: {memory_data.get('is_waiter', 0)}\n"
+    text += f"**В кэше ролей:**\n"
+    text += f"Есть в кэше: {cached_role is not None}\n"
+    if cached_role:
+        text += f"is_admin: {cached_role['is_admin']}\n"
+        text += f"is_waiter: {cached_role['is_waiter']}\n"
     
     text += f"\n**В БД:**\n"
     text += f"Есть в БД: {in_db is not None}\n"
@@ -2126,18 +2682,18 @@ async def cmd_myrole(message: Message):
         text += f"is_waiter: {in_db.get('is_waiter', 0)}\n"
     
     text += f"\n**Функции:**\n"
-    text += f"is_admin(): {is_admin(user_id)}\n"
-    text += f"is_waiter(): {is_waiter(user_id)}\n"
+    text += f"is_admin(): {await is_admin(user_id)}\n"
+    text += f"is_waiter(): {await is_waiter(user_id)}\n"
     
     await message.answer(text, parse_mode="Markdown")
 
 @dp.message(Command("debug"))
-async def cmd_debug(message: Message):
+async def cmd_debug(message: Message, role: dict):
     """Отладка - показать все брони"""
-    if not is_admin(message.from_user.id):
+    if not role['is_admin']:
         return
     
-    all_res = db.get_all_reservations()
+    all_res = await async_db.get_all_reservations()
     today = get_today_str()
     
     text = f"**🔧 Отладка**\n"
@@ -2156,121 +2712,169 @@ async def cmd_debug(message: Message):
 
 # ========== УВЕДОМЛЕНИЯ ДЛЯ ОФИЦИАНТОВ ==========
 
-async def send_30min_notifications():
-    """Отправка уведомлений за 30 минут до брони"""
-    upcoming = db.get_upcoming_reservations(30)
-    today = get_today_str()
-    
-    for res in upcoming:
-        table = res.get('table_number')
-        if not table:
-            continue
-        
-        waiters = db.get_waiters_for_table_on_date(table, today)
-        
-        for waiter_id in waiters:
-            if db.check_notification_sent(res['id'], waiter_id, '30min'):
-                continue
-            
-            deposit_status = ""
-            if res.get('deposit', 0) > 0:
-                if res.get('deposit_paid', 0) == 1:
-                    deposit_status = "✅ Оплачен"
-                else:
-                    deposit_status = "❌ Не оплачен"
-            
-            text = (
-                f"⏰ **Напоминание: через 30 минут**\n\n"
-                f"🪑 Стол {table}\n"
-                f"🕐 {res.get('time')} | 👤 {res.get('name')}\n"
-                f"📞 {res.get('phone')} | 👥 {res.get('guests')} чел.\n"
-            )
-            if res.get('occasion'):
-                text += f"🎉 Повод: {res.get('occasion')}\n"
-            if res.get('deposit', 0) > 0:
-                text += f"💰 Депозит: {res.get('deposit')}₽ {deposit_status}\n"
-            
-            try:
-                await bot.send_message(waiter_id, text, parse_mode="Markdown")
-                db.save_notification(res['id'], waiter_id, '30min')
-                print(f"✅ Уведомление за 30 мин отправлено официанту {waiter_id} для стола {table}")
-            except Exception as e:
-                print(f"❌ Ошибка отправки официанту {waiter_id}: {e}")
-
-async def send_birthday_notifications():
-    """Отправка уведомлений через 1 час после брони (для ДР и годовщин)"""
-    past = db.get_past_reservations(1)
-    today = get_today_str()
-    
-    for res in past:
+# Когда отправлять уведомление относительно времени брони
+NOTIFICATION_OFFSETS = {
+    '30min': timedelta(minutes=-30),    # за 30 минут до брони
+    'birthday': timedelta(hours=1),     # через час (ДР и годовщины)
+    'deposit': timedelta(hours=1.5),    # через полтора часа (неоплаченный депозит)
+}
+
+def get_reservation_datetime(res: dict) -> Optional[datetime]:
+    """Дата и время брони в часовом поясе ресторана"""
+    try:
+        naive = datetime.strptime(f"{res.get('date')} {res.get('time')}", "%Y-%m-%d %H:%M")
+    except (ValueError, TypeError):
+        return None
+    return pytz.timezone(TIMEZONE).localize(naive)
+
+def is_notification_needed(res: dict, notif_type: str) -> bool:
+    """Нужно ли уведомление этого типа для брони"""
+    if not res.get('table_number'):
+        return False
+    if notif_type == 'birthday':
         occasion = res.get('occasion', '').lower()
-        if 'день рождения' not in occasion and 'годовщина' not in occasion:
-            continue
+        return 'день рождения' in occasion or 'годовщина' in occasion
+    if notif_type == 'deposit':
+        return res.get('deposit', 0) > 0 and res.get('deposit_paid', 0) != 1
+    return True
+
+def get_notification_job_id(reservation_id: int, notif_type: str) -> str:
+    """ID задачи планировщика для уведомления по брони"""
+    return f"notify_{reservation_id}_{notif_type}"
+
+def schedule_reservation_notifications(res: dict):
+    """
+    Планирует уведомления официантам по брони: по одной задаче на тип
+    уведомления. Повторный вызов переносит задачи на новое время
+    или снимает те, что больше не нужны.
+    """
+    res_datetime = get_reservation_datetime(res)
+    now = datetime.now(pytz.timezone(TIMEZONE))
+    
+    for notif_type, offset in NOTIFICATION_OFFSETS.items():
+        job_id = get_notification_job_id(res['id'], notif_type)
+        run_date = res_datetime + offset if res_datetime else None
         
-        table = res.get('table_number')
-        if not table:
+        if run_date is None or run_date <= now or not is_notification_needed(res, notif_type):
+            if scheduler.get_job(job_id, jobstore='notifications'):
+                scheduler.remove_job(job_id, jobstore='notifications')
             continue
         
-        waiters = db.get_waiters_for_table_on_date(table, today)
-        
-        for waiter_id in waiters:
-            if db.check_notification_sent(res['id'], waiter_id, 'birthday'):
-                continue
-            
-            text = (
-                f"🎂 **Напоминание: не забудьте поздравить!**\n\n"
-                f"🪑 Стол {table}\n"
-                f"👤 {res.get('name')}\n"
-                f"🎉 Повод: {res.get('occasion')}\n\n"
-                f"Час назад была бронь, пора поздравить гостей!"
-            )
-            
-            try:
-                await bot.send_message(waiter_id, text, parse_mode="Markdown")
-                db.save_notification(res['id'], waiter_id, 'birthday')
-                print(f"✅ Поздравительное уведомление отправлено официанту {waiter_id}")
-            except Exception as e:
-                print(f"❌ Ошибка отправки: {e}")
-
-async def send_deposit_notifications():
-    """Отправка уведомлений через 1.5 часа после брони (напоминание о депозите)"""
-    past = db.get_past_reservations(1.5)
-    today = get_today_str()
+        scheduler.add_job(
+            send_reservation_notification,
+            'date',
+            run_date=run_date,
+            args=[res['id'], notif_type],
+            id=job_id,
+            jobstore='notifications',
+            replace_existing=True,
+            misfire_grace_time=NOTIFICATION_MISFIRE_GRACE_SECONDS
+        )
+
+async def run_notification_change(func, *args):
+    """
+    Изменение задач уведомлений (schedule_/cancel_reservation_notifications)
+    в пуле потоков. Задачи могли добавить не в ведущем процессе: счетчик
+    jobs_version в настройках говорит ведущему перечитать хранилище задач
+    """
+    await async_db.run(func, *args)
+    await async_db.bump_setting('jobs_version')
+
+def cancel_reservation_notifications(reservation_id: int):
+    """Снимает все запланированные уведомления по брони"""
+    for notif_type in NOTIFICATION_OFFSETS:
+        job_id = get_notification_job_id(reservation_id, notif_type)
+        if scheduler.get_job(job_id, jobstore='notifications'):
+            scheduler.remove_job(job_id, jobstore='notifications')
+
+def format_notification_text(res: dict, notif_type: str) -> str:
+    """Текст уведомления официанту"""
+    table = res.get('table_number')
+    
+    if notif_type == 'birthday':
+        return (
+            f"🎂 **Напоминание: не забудьте поздравить!**\n\n"
+            f"🪑 Стол {table}\n"
+            f"👤 {res.get('name')}\n"
+            f"🎉 Повод: {res.get('occasion')}\n\n"
+            f"Час назад была бронь, пора поздравить гостей!"
+        )
+    
+    if notif_type == 'deposit':
+        return (
+            f"💰 **Напоминание о депозите**\n\n"
+            f"🪑 Стол {table}\n"
+            f"👤 {res.get('name')}\n"
+            f"💰 Сумма: {res.get('deposit')}₽ (не оплачен)\n\n"
+            f"Полтора часа назад была бронь, не забудьте принять депозит!"
+        )
     
-    for res in past:
-        if res.get('deposit', 0) <= 0 or res.get('deposit_paid', 0) == 1:
+    deposit_status = ""
+    if res.get('deposit', 0) > 0:
+        if res.get('deposit_paid', 0) == 1:
+            deposit_status = "✅ Оплачен"
+        else:
+            deposit_status = "❌ Не оплачен"
+    
+    text = (
+        f"⏰ **Напоминание: через 30 минут**\n\n"
+        f"🪑 Стол {table}\n"
+        f"🕐 {res.get('time')} | 👤 {res.get('name')}\n"
+        f"📞 {res.get('phone')} | 👥 {res.get('guests')} чел.\n"
+    )
+    if res.get('occasion'):
+        text += f"🎉 Повод: {res.get('occasion')}\n"
+    if res.get('deposit', 0) > 0:
+        text += f"💰 Депозит: {res.get('deposit')}₽ {deposit_status}\n"
+    return text
+
+@job_metrics.timed
+async def send_reservation_notification(reservation_id: int, notif_type: str):
+    """Отправка уведомления официантам стола (задача планировщика по конкретной брони)"""
+    res = await async_db.get_reservation_by_id(reservation_id)
+    # Бронь могли удалить или изменить после планирования
+    if not res or not is_notification_needed(res, notif_type):
+        return
+    
+    table = res.get('table_number')
+    waiters = await async_db.get_waiters_for_table_on_date(table, res.get('date'))
+    text = format_notification_text(res, notif_type)
+    # Запланированное время уведомления - для метрики опоздания
+    res_datetime = get_reservation_datetime(res)
+    
+    # Уже отправленные уведомления - одним запросом на бронь
+    sent = await async_db.get_sent_notifications([reservation_id])
+    
+    for waiter_id in waiters:
+        if (reservation_id, waiter_id, notif_type) in sent:
             continue
-        
-        table = res.get('table_number')
-        if not table:
+        # Захват через уникальный индекс: два пересекающихся запуска
+        # задачи не отправят одно уведомление дважды
+        if not await async_db.claim_notification(reservation_id, waiter_id, notif_type):
             continue
         
-        waiters = db.get_waiters_for_table_on_date(table, today)
-        
-        for waiter_id in waiters:
-            if db.check_notification_sent(res['id'], waiter_id, 'deposit'):
-                continue
-            
-            text = (
-                f"💰 **Напоминание о депозите**\n\n"
-                f"🪑 Стол {table}\n"
-                f"👤 {res.get('name')}\n"
-                f"💰 Сумма: {res.get('deposit')}₽ (не оплачен)\n\n"
-                f"Полтора часа назад была бронь, не забудьте принять депозит!"
-            )
-            
-            try:
-                await bot.send_message(waiter_id, text, parse_mode="Markdown")
-                db.save_notification(res['id'], waiter_id, 'deposit')
-                print(f"✅ Напоминание о депозите отправлено официанту {waiter_id}")
-            except Exception as e:
-                print(f"❌ Ошибка отправки: {e}")
+        if await broadcaster.send(waiter_id, text, parse_mode="Markdown"):
+            print(f"✅ Уведомление '{notif_type}' отправлено официанту {waiter_id} для стола {table}")
+            if res_datetime:
+                delay = datetime.now(pytz.timezone(TIMEZONE)) - (res_datetime + NOTIFICATION_OFFSETS[notif_type])
+                notification_delay.observe(delay.total_seconds(), type=notif_type)
+        else:
+            await async_db.release_notification(reservation_id, waiter_id, notif_type)
+            print(f"❌ Ошибка отправки официанту {waiter_id}")
+
+async def sync_reservation_notifications():
+    """Планирование уведомлений для всех предстоящих броней (при запуске)"""
+    reservations = await async_db.get_reservations_from_date(get_today_str())
+    for res in reservations:
+        await async_db.run(schedule_reservation_notifications, res)
+    print(f"✅ Уведомления запланированы для {len(reservations)} броней")
 
 # ========== УТРЕННИЙ ОТЧЕТ ==========
+@job_metrics.timed
 async def send_morning_report():
     """Отправка утреннего отчета"""
     today = get_today_str()
-    reservations = db.get_today_reservations()
+    reservations = await async_db.get_today_reservations()
     
     if not reservations:
         text = f"📋 **Утренний отчет {today}**\n\nНа сегодня броней нет."
@@ -2309,27 +2913,66 @@ async def healthcheck(request):
     """Возвращает минимальный ответ для cron-job.org"""
     return web.Response(text="OK", status=200)
 
-async def run_web_server():
-    """Запуск веб-сервера для проверки"""
+async def metrics_endpoint(request):
+    """Метрики процесса в текстовом формате Prometheus"""
+    return web.Response(
+        text=metrics.render(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+def create_web_app(webhook: bool = False) -> web.Application:
+    """
+    Веб-приложение бота: проверка доступности, метрики (/metrics) и, в режиме webhook,
+    прием апдейтов от Telegram на WEBHOOK_PATH
+    """
     app = web.Application()
     
     # Основной маршрут для проверки
     app.router.add_get('/', healthcheck)
     app.router.add_get('/health', healthcheck)
     app.router.add_get('/ping', healthcheck)
-    
-    # Запускаем на всех интерфейсах, порт 10000
+    app.router.add_get('/metrics', metrics_endpoint)
+    
+    if webhook:
+        # Telegram сразу получает ответ 200, апдейты обрабатываются параллельно в фоне
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=WEBHOOK_SECRET
+        ).register(app, path=WEBHOOK_PATH)
+        # Запуск и остановка диспетчера (on_startup) вместе с веб-сервером
+        setup_application(app, dp, bot=bot)
+    
+    return app
+
+async def run_web_server(webhook: bool = False):
+    """Запуск веб-сервера (проверка доступности, в режиме webhook - и прием апдейтов)"""
+    app = create_web_app(webhook)
+    
+    # Запускаем на всех интерфейсах
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 10000)
+    site = web.TCPSite(runner, '0.0.0.0', WEB_SERVER_PORT)
     await site.start()
-    print("✅ Веб-сервер для проверки запущен на порту 10000")
+    print(f"✅ Веб-сервер запущен на порту {WEB_SERVER_PORT}")
     
     # Бесконечное ожидание
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 async def main_with_web():
     """Запуск и бота, и веб-сервера"""
+    if BOT_MODE == "webhook":
+        # Апдейты приходят на веб-сервер, polling не нужен
+        dp.startup.register(on_startup)
+        dp.shutdown.register(on_shutdown)
+        print(f"🚀 Бот запускается (webhook {WEBHOOK_PATH})...")
+        await run_web_server(webhook=True)
+        return
+    
     # Запускаем веб-сервер в фоне
     web_task = asyncio.create_task(run_web_server())
     
@@ -2340,19 +2983,25 @@ async def main_with_web():
 async def main():
     """Главная функция"""
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     print("🚀 Бот запускается...")
     await dp.start_polling(bot)
 
 # ========== ЗАПУСК ==========
 async def on_startup():
     """Действия при запуске"""
-    # Очищаем вебхуки перед запуском
-    await bot.delete_webhook(drop_pending_updates=True)
-    print("✅ Вебхук удален")
-    
-    print("🧹 Запуск очистки старых данных...")
-    db.cleanup_old_reservations()
-    db.cleanup_old_excel_files()
+    if BOT_MODE == "webhook":
+        # Апдейты, пришедшие во время перезапуска, не теряются
+        await bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        print(f"✅ Вебхук установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+    else:
+        # Очищаем вебхуки перед запуском
+        await bot.delete_webhook(drop_pending_updates=True)
+        print("✅ Вебхук удален")
     
     scheduler.add_job(
         send_morning_report,
@@ -2363,40 +3012,103 @@ async def on_startup():
     )
     
     scheduler.add_job(
-        send_30min_notifications,
-        'interval',
-        minutes=1,
-        id='30min_notifications'
-    )
-    
-    scheduler.add_job(
-        send_birthday_notifications,
-        'interval',
-        minutes=5,
-        id='birthday_notifications'
+        job_metrics.timed(async_db.cleanup_old_reservations),
+        'cron',
+        hour=3,
+        minute=0,
+        id='daily_cleanup'
     )
     
     scheduler.add_job(
-        send_deposit_notifications,
-        'interval',
-        minutes=5,
-        id='deposit_notifications'
+        job_metrics.timed(cleanup_excel_files),
+        'cron',
+        hour=3,
+        minute=10,
+        id='excel_cleanup'
     )
     
+    # Истекшие состояния диалогов - раз в час
     scheduler.add_job(
-        db.cleanup_old_reservations,
+        job_metrics.timed(async_db.cleanup_expired_fsm_records),
         'cron',
-        hour=3,
-        minute=0,
-        id='daily_cleanup'
+        minute=30,
+        id='fsm_cleanup'
     )
     
-    scheduler.start()
+    # Задачи выполняются, только пока процесс ведущий (см. on_leader_elected).
+    # Остальные процессы лишь записывают задачи уведомлений в общее хранилище
+    scheduler.start(paused=True)
     print(f"✅ Планировщик запущен")
+    
+    # Первый круг сразу: аренда, общие настройки (год, роли)
+    await leader_lease.check()
+    leader_lease.start()
     print(f"✅ Главный администратор ID: {MAIN_ADMIN_ID}")
     print(f"✅ Текущий год: {current_year}")
     print(f"✅ Автоочистка старых броней активирована")
 
+async def on_shutdown():
+    """Действия при остановке"""
+    # Останавливаем продление и отдаем аренду сразу, чтобы другой процесс не ждал ее истечения
+    await leader_lease.stop()
+    
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    
+    # Дожидаемся запросов в очереди потоков БД и закрываем соединения
+    await async_db.close()
+    print("✅ Соединения с БД закрыты")
+
+# ========== НЕСКОЛЬКО ПРОЦЕССОВ ==========
+async def sync_shared_state():
+    """
+    Общие настройки из БД (в каждом процессе, при каждом продлении аренды):
+    текущий год, сброс кэша ролей после изменения ролей в другом процессе,
+    а в ведущем - пробуждение планировщика после изменения задач уведомлений
+    """
+    global current_year, roles_version, jobs_version
+    settings = await async_db.get_settings()
+    current_year = int(settings.get('current_year', CURRENT_YEAR))
+    
+    # До первого изменения счетчика нет в настройках: считаем его нулем
+    version = settings.get('roles_version', '0')
+    if roles_version is not None and version != roles_version:
+        role_cache.invalidate()
+    roles_version = version
+    
+    # Планировщик ведущего опрашивает хранилище задач, только когда задачи менялись
+    version = settings.get('jobs_version', '0')
+    if jobs_version is not None and version != jobs_version and leader_lease.is_leader:
+        scheduler.wakeup()
+    jobs_version = version
+
+async def cleanup_excel_files():
+    """Удаление старых выгрузок за дни и забытых выгрузок за период"""
+    await async_db.cleanup_old_excel_files()
+    await async_db.run(ExcelGenerator.cleanup_range_files)
+
+async def on_leader_elected():
+    """Процесс стал ведущим: очистка данных и запуск задач планировщика"""
+    print(f"👑 Процесс {leader_lease.holder} стал ведущим")
+    
+    print("🧹 Запуск очистки старых данных...")
+    await async_db.cleanup_old_reservations()
+    await cleanup_excel_files()
+    
+    scheduler.resume()
+    
+    # Уведомления официантам: задачи по каждой брони (хранятся в БД)
+    await sync_reservation_notifications()
+
+async def on_leader_lost():
+    """Процесс больше не ведущий: задачи выполнит новый ведущий"""
+    scheduler.pause()
+    print(f"⚠️ Процесс {leader_lease.holder} больше не ведущий, планировщик приостановлен")
+
+leader_lease.on_elected(on_leader_elected)
+leader_lease.on_lost(on_leader_lost)
+leader_lease.on_tick(sync_shared_state)
+
 if __name__ == "__main__":
     try:
         asyncio.run(main_with_web())
@@ -0,0 +1,249 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, Sequence
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+# Границы гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    """Метки в формате Prometheus: {name="value",...}"""
+    parts = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Счетчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple([labels[name] for name in self.labelnames])
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}'
+
+
+class Histogram:
+    """Гистограмма с метками: число наблюдений по корзинам, сумма и количество"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по корзинам (+Inf последней), сумма, количество]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple([labels[name] for name in self.labelnames])
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            values = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{format_value(bound)}"'
+                yield f'{self.name}_bucket{format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labelnames, key)} {count}'
+
+
+class Gauge:
+    """Текущее значение: функция вызывается при каждом запросе /metrics"""
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        yield f'{self.name} {format_value(self.func())}'
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса бота в текстовом формате Prometheus (для /metrics).
+    Без внешних зависимостей: наблюдение - поиск корзины и прибавление
+    под блокировкой, поэтому метрики можно не выключать в работе.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, func: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, func))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время работы и ошибки обработчиков по имени функции-обработчика.
+    Регистрируется как внутренний middleware (dp.message.middleware(...)):
+    ожидание в очереди чата сюда не входит.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.seconds = registry.histogram(
+            'bot_handler_duration_seconds', 'Время работы обработчиков апдейтов', ['handler'])
+        self.errors = registry.counter(
+            'bot_handler_errors_total', 'Исключения в обработчиках апдейтов', ['handler'])
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc(handler=name)
+            raise
+        finally:
+            self.seconds.observe(time.perf_counter() - started, handler=name)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки запросов к Telegram Bot API (bot.session.middleware(...))"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.seconds = registry.histogram(
+            'bot_telegram_request_duration_seconds', 'Время запросов к Telegram Bot API', ['method'])
+        self.errors = registry.counter(
+            'bot_telegram_request_errors_total', 'Ошибки запросов к Telegram Bot API', ['method', 'error'])
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, '__api_method__', type(method).__name__)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.errors.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            self.seconds.observe(time.perf_counter() - started, method=name)
+
+
+class QueryMetrics:
+    """
+    Время выполнения и ошибки методов Database (см. AsyncDatabase.metrics).
+    Прочая блокирующая работа в пуле БД (AsyncDatabase.run: Excel, картинки,
+    планировщик) считается отдельно, чтобы не искажать время запросов.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.seconds = registry.histogram(
+            'bot_db_query_duration_seconds', 'Время выполнения методов БД (без ожидания потока)', ['method'])
+        self.errors = registry.counter(
+            'bot_db_query_errors_total', 'Исключения в методах БД', ['method'])
+        self.task_seconds = registry.histogram(
+            'bot_executor_task_duration_seconds', 'Время блокирующих задач в пуле БД (не запросов)', ['task'],
+            buckets=DEFAULT_BUCKETS + (30, 60))
+        self.task_errors = registry.counter(
+            'bot_executor_task_errors_total', 'Исключения в блокирующих задачах пула БД', ['task'])
+
+    def observe(self, name: str, seconds: float, failed: bool = False):
+        self.seconds.observe(seconds, method=name)
+        if failed:
+            self.errors.inc(method=name)
+    
+    def observe_task(self, name: str, seconds: float, failed: bool = False):
+        self.task_seconds.observe(seconds, task=name)
+        if failed:
+            self.task_errors.inc(task=name)
+
+
+class JobMetrics:
+    """Время выполнения и ошибки задач планировщика (обертка над функцией задачи)"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.seconds = registry.histogram(
+            'bot_job_duration_seconds', 'Время выполнения задач планировщика', ['job'],
+            buckets=DEFAULT_BUCKETS + (30, 60, 300))
+        self.errors = registry.counter(
+            'bot_job_errors_total', 'Исключения в задачах планировщика', ['job'])
+
+    def timed(self, func: Callable[..., Awaitable]):
+        """
+        Задача с замером времени. Имя и модуль функции сохраняются,
+        поэтому задачи из хранилища в БД находят ее по прежней ссылке.
+        """
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                self.errors.inc(job=func.__name__)
+                raise
+            finally:
+                self.seconds.observe(time.perf_counter() - started, job=func.__name__)
+        return wrapper
@@ -0,0 +1,186 @@
+import io
+from collections import OrderedDict
+from typing import Dict, List
+
+from PIL import Image, ImageDraw, ImageFont
+
+from availability import TableSchedule
+
+# Состояния ячейки сетки (стол x слот времени)
+FREE = 0
+BLOCKED = 1  # начинать новую бронь нельзя: ближе MIN_HOURS к следующей брони
+BUSY = 2     # стол занят бронью (MIN_HOURS от ее начала)
+START = 3    # начало брони
+
+# Символы для текстовой сетки
+CELL_SYMBOLS = {FREE: '·', BLOCKED: '×', BUSY: '▓', START: '█'}
+
+# Цвета для картинки
+CELL_COLORS = {
+    FREE: (236, 240, 241),
+    BLOCKED: (250, 215, 160),
+    BUSY: (231, 76, 60),
+    START: (146, 43, 33),
+}
+
+SLOT_MINUTES = 30
+DAY_START_MINUTES = 12 * 60
+DAY_END_MINUTES = 24 * 60
+
+
+def table_sort_key(table_number: str):
+    """Столы по номеру: сначала числовые, потом остальные"""
+    return (0, int(table_number), '') if table_number.isdigit() else (1, 0, table_number)
+
+
+def build_grid(reservations: List[dict], min_hours: float, slot_minutes: int = SLOT_MINUTES) -> dict:
+    """
+    Сетка занятости столов на дату: стол x слот времени.
+    Бронь занимает стол на min_hours от начала; в слотах, которые ближе
+    min_hours до начала брони, новую бронь начинать нельзя.
+    Возвращает {'slots': [минуты начала слотов], 'tables': [столы],
+    'cells': {стол: [состояния]}, 'reservations': количество}.
+    """
+    window = int(min_hours * 60)
+    starts: Dict[str, List[int]] = {}
+    for res in reservations:
+        table = res.get('table_number')
+        minutes = TableSchedule.time_to_minutes(res.get('time'))
+        if not table or table == 'Не назначен' or minutes is None:
+            continue
+        starts.setdefault(table, []).append(minutes)
+
+    first = min((m for times in starts.values() for m in times), default=DAY_START_MINUTES)
+    day_start = min(DAY_START_MINUTES, first - first % slot_minutes)
+    slots = list(range(day_start, DAY_END_MINUTES, slot_minutes))
+
+    cells = {}
+    for table in sorted(starts, key=table_sort_key):
+        row = [FREE] * len(slots)
+        for start in starts[table]:
+            for i, slot in enumerate(slots):
+                slot_end = slot + slot_minutes
+                if slot <= start < slot_end:
+                    state = START
+                elif start < slot_end and slot < start + window:
+                    state = BUSY
+                elif start - window < slot < start:
+                    state = BLOCKED
+                else:
+                    continue
+                if state > row[i]:
+                    row[i] = state
+        cells[table] = row
+
+    return {
+        'slots': slots,
+        'tables': list(cells),
+        'cells': cells,
+        'reservations': sum(len(times) for times in starts.values()),
+    }
+
+
+def render_text(grid: dict, date: str) -> str:
+    """Сетка моноширинным текстом (для сообщения в блоке кода)"""
+    slots = grid['slots']
+    label_width = max([len(t) for t in grid['tables']] + [2])
+
+    # Подписи часов над каждым вторым часом
+    header = [' '] * len(slots)
+    for i, slot in enumerate(slots):
+        hour = slot // 60
+        if slot % 60 == 0 and hour % 2 == 0:
+            for j, char in enumerate(f"{hour:02d}"):
+                if i + j < len(header):
+                    header[i + j] = char
+
+    lines = [f"{'':>{label_width}} {''.join(header)}"]
+    for table in grid['tables']:
+        row = ''.join(CELL_SYMBOLS[state] for state in grid['cells'][table])
+        lines.append(f"{table:>{label_width}} {row}")
+
+    legend = (
+        f"{CELL_SYMBOLS[START]} начало брони  {CELL_SYMBOLS[BUSY]} занят  "
+        f"{CELL_SYMBOLS[BLOCKED]} нельзя начать  {CELL_SYMBOLS[FREE]} свободен"
+    )
+    return (
+        f"🗺 Загрузка зала на {date}\n"
+        f"Броней: {grid['reservations']}, столов: {len(grid['tables'])}\n\n"
+        f"```\n" + "\n".join(lines) + "\n```\n"
+        f"{legend}\n1 клетка = {SLOT_MINUTES} мин"
+    )
+
+
+def render_png(grid: dict, date: str, cell: int = 20) -> bytes:
+    """Сетка картинкой PNG (подписи только цифрами - шрифт по умолчанию)"""
+    font = ImageFont.load_default()
+    slots = grid['slots']
+    label_width = 48
+    header_height = 44
+    width = label_width + cell * len(slots) + 10
+    height = header_height + cell * max(len(grid['tables']), 1) + 10
+
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    draw.text((6, 4), date, fill=(0, 0, 0), font=font)
+
+    for i, slot in enumerate(slots):
+        if slot % 60 == 0:
+            x = label_width + i * cell
+            draw.text((x + 2, 24), f"{slot // 60:02d}", fill=(80, 80, 80), font=font)
+            draw.line([(x, header_height - 4), (x, height - 10)], fill=(200, 200, 200))
+
+    for row_index, table in enumerate(grid['tables']):
+        y = header_height + row_index * cell
+        draw.text((6, y + 4), table, fill=(0, 0, 0), font=font)
+        for i, state in enumerate(grid['cells'][table]):
+            x = label_width + i * cell
+            draw.rectangle([x + 1, y + 1, x + cell - 1, y + cell - 1], fill=CELL_COLORS[state])
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class OccupancyCache:
+    """
+    Сетки занятости по датам. Сетка строится одним запросом броней на дату
+    и отдается из кэша, пока версия броней на дату не изменилась.
+    Картинка рисуется при первом запросе и хранится вместе с сеткой.
+    """
+
+    def __init__(self, async_db, min_hours: float, max_dates: int = 16):
+        self.async_db = async_db
+        self.min_hours = min_hours
+        self.max_dates = max_dates
+        # date -> {'version', 'grid', 'text', 'png'}
+        self._entries: OrderedDict = OrderedDict()
+
+    async def get(self, date: str) -> dict:
+        """Актуальная запись кэша для даты"""
+        version = await self.async_db.get_date_version(date)
+        entry = self._entries.get(date)
+        if entry and entry['version'] == version:
+            self._entries.move_to_end(date)
+            return entry
+
+        reservations = await self.async_db.get_reservations_by_date(date)
+        grid = build_grid(reservations, self.min_hours)
+        entry = {'version': version, 'grid': grid, 'text': render_text(grid, date), 'png': None}
+
+        self._entries[date] = entry
+        self._entries.move_to_end(date)
+        while len(self._entries) > self.max_dates:
+            self._entries.popitem(last=False)
+        return entry
+
+    async def get_text(self, date: str) -> str:
+        """Сетка текстом"""
+        return (await self.get(date))['text']
+
+    async def get_png(self, date: str) -> bytes:
+        """Сетка картинкой (рисуется в потоке, чтобы не блокировать бота)"""
+        entry = await self.get(date)
+        if entry['png'] is None:
+            entry['png'] = await self.async_db.run(render_png, entry['grid'], date)
+        return entry['png']
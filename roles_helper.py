@@ -0,0 +1,112 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class RoleCache:
+    """
+    Кэш ролей пользователей (администратор / официант).
+    Найденные роли живут ttl секунд, отсутствие ролей (обычный пользователь
+    или неизвестный ID) - negative_ttl секунд. При изменении ролей в БД
+    запись сбрасывается через invalidate() (из потока записи БД -
+    через invalidate_threadsafe()). Кэш используется только из цикла событий бота.
+    """
+
+    def __init__(self, loader: Callable[[int], Awaitable[Optional[dict]]], main_admin_id: int,
+                 ttl: float = 300, negative_ttl: float = 60):
+        self.loader = loader
+        self.main_admin_id = main_admin_id
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # user_id -> (роль, время истечения)
+        self._entries: Dict[int, tuple] = {}
+        # Поколения сброса: роль, загруженная до invalidate(), не попадает в кэш.
+        # Поколение пользователя нужно только пока его роль загружается:
+        # user_id -> [загрузок в процессе, поколение сброса]
+        self._generation = 0
+        self._loads: Dict[int, list] = {}
+        # Цикл событий, в котором работает кэш (для invalidate_threadsafe)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def get(self, user_id: int) -> dict:
+        """Роль пользователя: {'is_admin', 'is_waiter', 'is_main_admin'}"""
+        entry = self._entries.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+        self._loop = asyncio.get_running_loop()
+        load = self._loads.setdefault(user_id, [0, 0])
+        load[0] += 1
+        generation = (self._generation, load[1])
+        try:
+            user = await self.loader(user_id)
+        finally:
+            load[0] -= 1
+            if load[0] == 0:
+                del self._loads[user_id]
+        is_main_admin = user_id == self.main_admin_id
+        role = {
+            'is_admin': is_main_admin or bool(user and user.get('is_admin', 0) == 1),
+            'is_waiter': bool(user and user.get('is_waiter', 0) == 1),
+            'is_main_admin': is_main_admin,
+        }
+
+        # Пока роль загружалась, ее могли изменить и сбросить кэш
+        if generation == (self._generation, load[1]):
+            ttl = self.ttl if role['is_admin'] or role['is_waiter'] else self.negative_ttl
+            self._entries[user_id] = (role, time.monotonic() + ttl)
+        return role
+
+    def peek(self, user_id: int) -> Optional[dict]:
+        """Роль из кэша без обращения к БД (None, если записи нет или она устарела)"""
+        entry = self._entries.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def invalidate(self, user_id: int = None):
+        """Сброс кэша для пользователя (или целиком)"""
+        if user_id is None:
+            self._generation += 1
+            self._entries.clear()
+        else:
+            load = self._loads.get(user_id)
+            if load is not None:
+                load[1] += 1
+            self._entries.pop(user_id, None)
+
+    def invalidate_threadsafe(self, user_id: int = None):
+        """Сброс кэша из другого потока (подписчик изменений ролей в БД): выполняется в цикле событий"""
+        loop = self._loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None:
+            # Роли еще не загружались: сбрасывать нечего
+            return
+        if loop is running or loop.is_closed():
+            self.invalidate(user_id)
+        else:
+            loop.call_soon_threadsafe(self.invalidate, user_id)
+
+
+class RoleMiddleware(BaseMiddleware):
+    """Определяет роль автора апдейта один раз и передает ее в хендлеры как `role`"""
+
+    def __init__(self, cache: RoleCache):
+        self.cache = cache
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is not None:
+            data['role'] = await self.cache.get(user.id)
+        return await handler(event, data)
@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py при импорте создает restaurant.db в текущей папке,
+# main.py требует BOT_TOKEN: тесты работают во временной папке
+os.chdir(tempfile.mkdtemp(prefix='restaurant-tests-'))
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+
+
+class BotHarness:
+    """
+    Бот из main.py без сети: запросы к Telegram записываются в sent,
+    апдейты подаются через feed(). Все тесты с ботом работают в одном
+    цикле событий, как и настоящий бот.
+    """
+
+    def __init__(self):
+        from aiogram.client.session.base import BaseSession
+        from aiogram.types import Message, Chat, User
+        import main
+
+        harness = self
+        self.main = main
+        self.sent = []
+        self.loop = asyncio.new_event_loop()
+        self._ids = itertools.count(100)
+
+        class FakeSession(BaseSession):
+            async def make_request(self, bot, method, timeout=None):
+                harness.sent.append(method)
+                if method.__returning__ is Message:
+                    return Message(
+                        message_id=next(harness._ids),
+                        date=datetime.now(),
+                        chat=Chat(id=getattr(method, 'chat_id', 1), type='private'),
+                        text=getattr(method, 'text', None)
+                    )
+                if method.__returning__ is User:
+                    return User(id=1, is_bot=True, first_name='bot')
+                return True
+
+            async def close(self):
+                pass
+
+            async def stream_content(self, *args, **kwargs):
+                yield b''
+
+        session = FakeSession()
+        # Middleware запросов (метрики) переносим на подмененную сессию
+        for middleware in main.bot.session.middleware:
+            session.middleware(middleware)
+        main.bot.session = session
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def message(self, text: str, user_id: int = None, **fields):
+        from aiogram.types import Update, Message, Chat, User
+        user_id = user_id or self.main.MAIN_ADMIN_ID
+        return Update(update_id=next(self._ids), message=Message(
+            message_id=next(self._ids),
+            date=datetime.now(),
+            chat=Chat(id=user_id, type='private'),
+            from_user=User(id=user_id, is_bot=False, first_name='Тест'),
+            text=text,
+            **fields
+        ))
+
+    def callback(self, data: str, user_id: int = None, text: str = ''):
+        from aiogram.types import Update, Message, Chat, User, CallbackQuery
+        user_id = user_id or self.main.MAIN_ADMIN_ID
+        message = Message(message_id=next(self._ids), date=datetime.now(),
+                          chat=Chat(id=user_id, type='private'), text=text)
+        return Update(update_id=next(self._ids), callback_query=CallbackQuery(
+            id=str(next(self._ids)),
+            from_user=User(id=user_id, is_bot=False, first_name='Тест'),
+            chat_instance='test',
+            message=message,
+            data=data
+        ))
+
+    async def feed(self, update) -> list:
+        """Обработка апдейта; возвращает тексты отправленных ботом сообщений"""
+        start = len(self.sent)
+        await self.main.dp.feed_update(self.main.bot, update)
+        return self.texts(self.sent[start:])
+
+    @staticmethod
+    def texts(methods) -> list:
+        return [getattr(m, 'text', None) or type(m).__name__ for m in methods]
+
+
+@pytest.fixture(scope='session')
+def bot():
+    harness = BotHarness()
+    yield harness
+    harness.loop.close()
@@ -0,0 +1,44 @@
+"""
+Процесс бота для test_cluster_helper: аренда и захват уведомлений
+на общей с другими процессами БД. Результат - JSON в stdout.
+
+Запуск: python lease_worker.py <путь к БД> <время старта> <число уведомлений> <ttl>
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.py при импорте создает restaurant.db в текущей папке
+os.chdir(tempfile.mkdtemp(prefix='lease-worker-'))
+
+from cluster_helper import LeaderLease
+from database import Database, AsyncDatabase
+
+
+async def run(path: str, start_at: float, notifications: int, ttl: float) -> dict:
+    async_db = AsyncDatabase(Database(path))
+    lease = LeaderLease(async_db, ttl=ttl)
+    # Оба процесса начинают одновременно
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    leader = await lease.check()
+
+    # Одни и те же наступившие уведомления в обоих процессах
+    # (как после переключения ведущего во время отправки)
+    sent = []
+    for reservation_id in range(1, notifications + 1):
+        if await async_db.claim_notification(reservation_id, 42, '30min'):
+            sent.append(reservation_id)
+
+    # Аренда не освобождается: процесс "падает", другой ждет ttl
+    await async_db.close()
+    return {'holder': lease.holder, 'leader': leader, 'sent': sent}
+
+
+if __name__ == '__main__':
+    path, start_at, notifications, ttl = sys.argv[1:5]
+    result = asyncio.run(run(path, float(start_at), int(notifications), float(ttl)))
+    print(json.dumps(result))
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from availability import TableSchedule, TableRegistry, suggest_free_tables
+
+
+def make_schedule(*bookings) -> TableSchedule:
+    schedule = TableSchedule(3)
+    for n, (table, time) in enumerate(bookings, 1):
+        schedule.add({'id': n, 'table_number': table, 'time': time, 'name': f'Гость {n}', 'guests': 2})
+    return schedule
+
+
+def test_exactly_min_hours_apart_is_free():
+    schedule = make_schedule(('5', '19:00'))
+    assert schedule.find_conflicts('5', '16:00') == []
+    assert schedule.find_conflicts('5', '22:00') == []
+
+
+def test_less_than_min_hours_apart_conflicts():
+    schedule = make_schedule(('5', '19:00'))
+    assert [c['id'] for c in schedule.find_conflicts('5', '16:01')] == [1]
+    conflicts = schedule.find_conflicts('5', '21:59')
+    assert [c['id'] for c in conflicts] == [1]
+    assert abs(conflicts[0]['diff_hours'] - (179 / 60)) < 1e-9
+    # Другой стол и исключенная (редактируемая) бронь не мешают
+    assert schedule.find_conflicts('6', '19:00') == []
+    assert schedule.find_conflicts('5', '19:00', exclude_reservation_id=1) == []
+
+
+def test_times_near_midnight_do_not_wrap():
+    # Расписание - на одну дату: 00:30 и 23:30 одного дня разделяют 23 часа
+    schedule = make_schedule(('5', '00:30'), ('5', '23:30'))
+    assert [c['id'] for c in schedule.find_conflicts('5', '00:00')] == [1]
+    assert [c['id'] for c in schedule.find_conflicts('5', '23:59')] == [2]
+    assert schedule.find_conflicts('5', '12:00') == []
+    assert schedule.find_conflicts('5', '03:30') == []
+    assert schedule.find_conflicts('5', '20:30') == []
+
+
+def test_invalid_times_are_ignored():
+    schedule = make_schedule(('5', 'вечером'), ('5', '19:00'))
+    assert [c['id'] for c in schedule.find_conflicts('5', '18:00')] == [2]
+    assert schedule.find_conflicts('5', '25:00') == []
+
+
+def test_suggest_free_tables_respects_boundaries():
+    registry = TableRegistry({'Зал': {'1': 2, '2': 4, '3': 4, '4': 6}, 'Веранда': {'5': 4}})
+    # Стол 2 занят ровно за 3 часа - свободен, стол 3 - за 2:59 - занят
+    schedule = make_schedule(('1', '19:00'), ('2', '16:00'), ('3', '16:01'))
+
+    suggestions = suggest_free_tables(registry, schedule, '19:00', 3, near_table='1')
+    assert [t['table'] for t in suggestions] == ['2', '5', '4']
+
+    suggestions = suggest_free_tables(registry, schedule, '19:00', 3, near_table='5', limit=2)
+    assert [t['table'] for t in suggestions] == ['2', '4']
+
+
+def test_booking_late_evening_does_not_block_next_day(bot):
+    main = bot.main
+    date = '2031-05-10'
+    next_date = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    bot.run(main.async_db.add_reservation({
+        'date': date, 'time': '23:00', 'name': 'Анна', 'phone': '+79120000000',
+        'table_number': '9', 'guests': 2, 'deposit': 0, 'deposit_paid': 0, 'occasion': '',
+    }))
+
+    assert bot.run(main.check_table_availability('9', next_date, '01:00'))['available']
+    assert not bot.run(main.check_table_availability('9', date, '21:00'))['available']
+    assert bot.run(main.check_table_availability('9', date, '20:00'))['available']
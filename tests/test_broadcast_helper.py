@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from broadcast_helper import Broadcaster
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+
+
+def test_old_chat_slots_are_evicted():
+    bot = FakeBot()
+    broadcaster = Broadcaster(bot, global_rate=10000, per_chat_interval=0.05)
+
+    async def run():
+        stats = await broadcaster.broadcast(range(1, 201), 'Тест')
+        assert stats['sent'] == 200
+
+        await asyncio.sleep(0.1)
+        assert await broadcaster.send(500, 'Тест')
+
+    asyncio.run(run())
+    # Остался только слот последнего чата
+    assert list(broadcaster._chat_next_slot) == [500]
+    assert len(bot.sent) == 201
+
+
+def test_recent_chat_slot_still_limits_rate():
+    bot = FakeBot()
+    broadcaster = Broadcaster(bot, global_rate=10000, per_chat_interval=0.2)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await broadcaster.send(1, 'Первое')
+        # Очистка слотов между отправками не снимает ограничение чата
+        broadcaster._next_prune = 0.0
+        await broadcaster.send(1, 'Второе')
+        return loop.time() - started
+
+    assert asyncio.run(run()) >= 0.19
+
+
+class FakeBotApi:
+    """Локальный Bot API: 429 с retry_after при первой отправке в часть чатов,
+    403 для заблокировавших бота, 400 для несуществующих"""
+
+    RETRY_AFTER = 1
+
+    def __init__(self, flood_chats=(), blocked_chats=(), missing_chats=()):
+        self.flood_chats = set(flood_chats)
+        self.blocked_chats = set(blocked_chats)
+        self.missing_chats = set(missing_chats)
+        self.calls = {}
+        self.delivered = []
+        self.received = []
+        self.flood_answers = []
+
+    async def send_message(self, request):
+        form = await request.post()
+        chat_id = int(form['chat_id'])
+        now = time.monotonic()
+        self.received.append(now)
+        self.calls[chat_id] = self.calls.get(chat_id, 0) + 1
+
+        if chat_id in self.flood_chats and self.calls[chat_id] == 1:
+            self.flood_answers.append(now)
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.RETRY_AFTER}',
+                'parameters': {'retry_after': self.RETRY_AFTER},
+            }, status=429)
+        if chat_id in self.blocked_chats:
+            return web.json_response({
+                'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user',
+            }, status=403)
+        if chat_id in self.missing_chats:
+            return web.json_response({
+                'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found',
+            }, status=400)
+
+        self.delivered.append(chat_id)
+        return web.json_response({'ok': True, 'result': {
+            'message_id': len(self.delivered), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': form['text'],
+        }})
+
+
+def test_broadcast_against_fake_bot_api():
+    api = FakeBotApi(flood_chats={5, 17}, blocked_chats={9}, missing_chats={13})
+    app = web.Application()
+    app.router.add_post('/bot{token}/sendMessage', api.send_message)
+
+    async def run():
+        server = TestServer(app)
+        await server.start_server()
+        session = AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url('')).rstrip('/')))
+        bot = Bot('123456:TEST', session=session)
+        try:
+            broadcaster = Broadcaster(bot, concurrency=8, global_rate=20, per_chat_interval=0.05)
+            return await broadcaster.broadcast(range(1, 31), 'Объявление')
+        finally:
+            await session.close()
+            await server.close()
+
+    stats = asyncio.run(run())
+
+    assert stats['total'] == 30
+    assert stats['sent'] == 28
+    assert stats['failed'] == 2
+    assert stats['blocked'] == 1
+    assert stats['retries'] == 2
+
+    # Чаты с флуд-контролем получили сообщение со второй попытки
+    assert api.calls[5] == api.calls[17] == 2
+    assert sorted(api.delivered) == sorted(set(range(1, 31)) - {9, 13})
+    # Ошибки 403 и 400 не повторяются
+    assert api.calls[9] == api.calls[13] == 1
+
+    # Глобальная пауза: после первого 429 никто не отправляет retry_after секунд
+    # (кроме запросов, ушедших до того, как клиент получил ответ)
+    paused_from = api.flood_answers[0]
+    during_pause = [t for t in api.received if paused_from + 0.1 < t < paused_from + FakeBotApi.RETRY_AFTER - 0.05]
+    assert during_pause == []
+    assert stats['duration'] >= FakeBotApi.RETRY_AFTER
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from cluster_helper import LeaderLease
+from database import Database, AsyncDatabase
+
+
+class FakeLeaseDb:
+    """Аренда в памяти вместо таблицы leases"""
+
+    def __init__(self):
+        self.holder = None
+
+    async def acquire_lease(self, name, holder, ttl):
+        if self.holder in (None, holder):
+            self.holder = holder
+            return True
+        return False
+
+    async def release_lease(self, name, holder):
+        if self.holder == holder:
+            self.holder = None
+
+
+def test_failed_election_steps_down():
+    db = FakeLeaseDb()
+    lease = LeaderLease(db)
+    calls = []
+
+    async def broken_start():
+        calls.append('elected')
+        raise RuntimeError("планировщик не запустился")
+
+    async def pause():
+        calls.append('lost')
+
+    async def tick():
+        calls.append('tick')
+
+    lease.on_elected(broken_start)
+    lease.on_lost(pause)
+    lease.on_tick(tick)
+
+    assert asyncio.run(lease.check()) is False
+    assert calls == ['elected', 'lost', 'tick']
+    # Аренда свободна: ее может взять другой процесс
+    assert db.holder is None
+
+
+def test_other_process_takes_lease_after_step_down():
+    db = FakeLeaseDb()
+    first, second = LeaderLease(db), LeaderLease(db)
+
+    async def broken_start():
+        raise RuntimeError("ошибка")
+
+    first.on_elected(broken_start)
+
+    async def run():
+        await first.check()
+        return await second.check()
+
+    assert asyncio.run(run()) is True
+    assert db.holder == second.holder and not first.is_leader
+
+
+def test_renewal_loop_survives_errors():
+    db = FakeLeaseDb()
+    lease = LeaderLease(db, renew_interval=0.01)
+    ticks = []
+
+    async def broken_tick():
+        ticks.append(1)
+        raise RuntimeError("ошибка синхронизации")
+
+    lease.on_tick(broken_tick)
+
+    async def run():
+        task = asyncio.create_task(lease.run())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(run())
+    assert len(ticks) > 2 and lease.is_leader
+
+
+def test_stop_cancels_loop_and_releases():
+    db = FakeLeaseDb()
+    lease = LeaderLease(db, renew_interval=0.01)
+
+    async def run():
+        await lease.check()
+        lease.start()
+        task = lease._task
+        await asyncio.sleep(0.03)
+        await lease.stop()
+        return task
+
+    task = asyncio.run(run())
+    assert task.cancelled()
+    assert db.holder is None and not lease.is_leader
+
+
+def test_two_processes_share_lease_and_notifications(tmp_path):
+    path = str(tmp_path / 'cluster.db')
+    Database(path).close()  # схема создается до старта процессов
+    worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lease_worker.py')
+    start_at = time.time() + 1.0
+    processes = [
+        subprocess.Popen([sys.executable, worker, path, str(start_at), '300', '3'],
+                         stdout=subprocess.PIPE, text=True)
+        for _ in range(2)
+    ]
+    results = [json.loads(p.communicate(timeout=60)[0].strip().splitlines()[-1]) for p in processes]
+    assert all(p.returncode == 0 for p in processes)
+
+    # Ведущий ровно один
+    leaders = [r for r in results if r['leader']]
+    assert len(leaders) == 1
+
+    # Каждое уведомление отправлено ровно одним процессом
+    first, second = (set(r['sent']) for r in results)
+    assert not first & second
+    assert first | second == set(range(1, 301))
+
+    # Процессы остановились, не освободив аренду: новый процесс
+    # получает ее только после ttl
+    async_db = AsyncDatabase(Database(path))
+    lease = LeaderLease(async_db, ttl=3)
+
+    async def take_over():
+        assert await lease.check() is False
+        await asyncio.sleep(max(0.0, start_at + 3.2 - time.time()))
+        assert await lease.check() is True
+        await lease.release()
+        await async_db.close()
+
+    asyncio.run(take_over())
+    assert lease.holder != leaders[0]['holder']
+
+
+def test_lease_moves_after_ttl_between_db_instances(tmp_path):
+    path = str(tmp_path / 'lease.db')
+    first = LeaderLease(AsyncDatabase(Database(path)), ttl=0.5)
+    second = LeaderLease(AsyncDatabase(Database(path)), ttl=0.5)
+    lost = []
+
+    async def on_lost():
+        lost.append(first.holder)
+
+    first.on_lost(on_lost)
+
+    async def run():
+        assert await first.check() is True
+        # Пока ведущий продлевает аренду, второй процесс ее не получает
+        for _ in range(4):
+            await asyncio.sleep(0.2)
+            assert await first.check() is True
+            assert await second.check() is False
+        # Ведущий перестал продлевать (завис): после ttl аренда переходит
+        await asyncio.sleep(0.6)
+        assert await second.check() is True
+        assert await first.check() is False
+        for lease in (first, second):
+            await lease.async_db.close()
+
+    asyncio.run(run())
+    assert lost == [first.holder]
+    assert second.is_leader and not first.is_leader
+
+
+def test_leader_wakes_scheduler_only_after_job_changes(bot, monkeypatch):
+    main = bot.main
+    wakeups = []
+    monkeypatch.setattr(main.scheduler, 'wakeup', lambda: wakeups.append(1))
+    monkeypatch.setattr(main.leader_lease, 'is_leader', True)
+
+    # Первое чтение настроек запоминает версию задач
+    bot.run(main.sync_shared_state())
+    wakeups.clear()
+    for _ in range(3):
+        bot.run(main.sync_shared_state())
+    assert wakeups == []
+
+    # Задачи изменил обработчик (в любом процессе): ведущий один раз перечитывает их
+    bot.run(main.run_notification_change(main.cancel_reservation_notifications, 999999))
+    for _ in range(3):
+        bot.run(main.sync_shared_state())
+    assert wakeups == [1]
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import sqlite3
+import threading
+
+from database import Database, AsyncDatabase, RESERVATION_COLUMNS_SCHEMA_VERSION
+
+
+def make_reservation(**fields) -> dict:
+    reservation = {
+        'date': '2026-03-14', 'time': '19:00', 'name': 'Анна', 'phone': '+79120000000',
+        'table_number': '5', 'guests': 2, 'deposit': 5000, 'deposit_paid': 0, 'occasion': '',
+    }
+    reservation.update(fields)
+    return reservation
+
+
+def test_close_connections_of_other_threads(tmp_path):
+    async_db = AsyncDatabase(Database(str(tmp_path / 'close.db')), readers=3)
+
+    async def run():
+        reservation_id = await async_db.add_reservation(make_reservation())
+        # Соединения открываются в потоках записи и чтения
+        await asyncio.gather(*(async_db.get_reservation_by_id(reservation_id) for _ in range(20)))
+        assert len(async_db.db._connections) > 1
+        await async_db.close()
+
+    asyncio.run(run())
+    assert async_db.db._connections == []
+
+
+def test_executor_tasks_are_not_counted_as_queries(tmp_path):
+    from metrics_helper import MetricsRegistry, QueryMetrics
+
+    registry = MetricsRegistry()
+    async_db = AsyncDatabase(Database(str(tmp_path / 'metrics.db')))
+    async_db.metrics = QueryMetrics(registry)
+
+    def render_report():
+        return 'ok'
+
+    async def run():
+        await async_db.get_settings()
+        assert await async_db.run(render_report) == 'ok'
+        await async_db.close()
+
+    asyncio.run(run())
+    text = registry.render()
+    assert 'bot_db_query_duration_seconds_count{method="get_settings"} 1' in text
+    assert 'bot_executor_task_duration_seconds_count{task="render_report"} 1' in text
+    assert 'method="render_report"' not in text
+
+
+def test_concurrent_cas_has_one_winner(tmp_path):
+    path = str(tmp_path / 'cas.db')
+    # Два процесса бота: у каждого свой Database на общем файле
+    writers = [Database(path), Database(path)]
+    reservation_id = writers[0].add_reservation(make_reservation())
+    barrier = threading.Barrier(2)
+
+    def write(db, deposit, seen, results):
+        barrier.wait()
+        results.append(db.update_reservation(reservation_id, {'deposit': deposit}, {'deposit': seen}))
+
+    for round_number in range(30):
+        before = writers[0].get_reservation_by_id(reservation_id)
+        results = []
+        threads = [
+            threading.Thread(target=write, args=(db, 10000 + round_number * 10 + i, before['deposit'], results))
+            for i, db in enumerate(writers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [r for r in results if r['updated']]
+        losers = [r for r in results if not r['updated']]
+        assert len(winners) == 1 and len(losers) == 1
+        after = writers[1].get_reservation_by_id(reservation_id)
+        assert after['version'] == before['version'] + 1
+        assert after['deposit'] == winners[0]['reservation']['deposit']
+        assert losers[0]['conflicts'] == {'deposit': after['deposit']}
+
+
+def test_waiter_rename_bumps_assigned_dates(tmp_path):
+    db = Database(str(tmp_path / 'rename.db'))
+    db.add_user(7, 'waiter', 'Анна')
+    db.set_waiter_tables_for_date(7, 'Анна', ['5', '6'], '2026-03-14')
+    db.set_waiter_tables_for_date(8, 'Олег', ['7'], '2026-03-15')
+    versions = {date: db.get_date_version(date) for date in ('2026-03-14', '2026-03-15')}
+
+    # Повторный /start с тем же именем выгрузки не сбрасывает
+    db.add_user(7, 'waiter', 'Анна')
+    assert db.get_date_version('2026-03-14') == versions['2026-03-14']
+
+    assert db.update_user_name(7, 'Анна Петрова')
+    assert db.get_date_version('2026-03-14') == versions['2026-03-14'] + 1
+    assert db.get_date_version('2026-03-15') == versions['2026-03-15']
+    assert db.get_table_assignment_map('2026-03-14') == {'5': ['Анна Петрова'], '6': ['Анна Петрова']}
+
+    db.add_user(7, 'waiter', 'Аня')
+    assert db.get_date_version('2026-03-14') == versions['2026-03-14'] + 2
+
+
+def make_old_database(path: str, *reservations: dict):
+    """База старой версии: брони только в JSON"""
+    with sqlite3.connect(path) as conn:
+        conn.execute('''
+            CREATE TABLE reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT NOT NULL, created_at TEXT NOT NULL, date TEXT NOT NULL
+            )
+        ''')
+        for reservation in reservations:
+            conn.execute('INSERT INTO reservations (data, created_at, date) VALUES (?, ?, ?)',
+                         (json.dumps(reservation, ensure_ascii=False), '', reservation['date']))
+    conn.close()
+
+
+def test_reservation_columns_backfill_runs_once(tmp_path):
+    path = str(tmp_path / 'old.db')
+    make_old_database(path, make_reservation(date='2099-01-01'))
+
+    db = Database(path)
+    assert db.get_connection().execute('SELECT time, table_number, deposit FROM reservations').fetchone() == ('19:00', '5', 5000)
+    assert db.get_connection().execute('PRAGMA user_version').fetchone()[0] == RESERVATION_COLUMNS_SCHEMA_VERSION
+    db.get_connection().execute('UPDATE reservations SET time = NULL')
+    db.get_connection().commit()
+    db.close()
+
+    # При следующих запусках заполнение не повторяется
+    db = Database(path)
+    assert db.get_connection().execute('SELECT time FROM reservations').fetchone() == (None,)
+    db.close()
+
+
+def test_migration_fills_missing_numbers_and_builds_search_index(tmp_path):
+    path = str(tmp_path / 'old.db')
+    # Старые брони без депозита в JSON
+    old = make_reservation(date='2099-01-01', name='Листаев', phone='+79125550011')
+    del old['deposit'], old['deposit_paid']
+    make_old_database(path, old, make_reservation(date='2099-01-02', name='Петров'))
+
+    db = Database(path)
+    rows = db.get_connection().execute('SELECT name, deposit, deposit_paid FROM reservations ORDER BY id').fetchall()
+    assert rows == [('Листаев', 0, 0), ('Петров', 5000, 0)]
+    # Индекс построен той же миграцией
+    assert search_ids(db, 'лист') == {1}
+    assert search_ids(db, '5550011') == {1}
+
+    # Индекс перестраивается только миграцией, а не при каждом запуске
+    db.get_connection().execute("DELETE FROM reservations_fts WHERE rowid = 2")
+    db.get_connection().commit()
+    db.close()
+    db = Database(path)
+    assert search_ids(db, 'петр') == set()
+    db.close()
+
+
+def search_ids(db, query: str) -> set:
+    return {res['id'] for res in db.search_reservations(query)}
+
+
+def test_search_matches_cyrillic_prefixes(tmp_path):
+    db = Database(str(tmp_path / 'search.db'))
+    alexey = db.add_reservation(make_reservation(name='Алексей Пётров', occasion='День рождения'))
+    alla = db.add_reservation(make_reservation(name='Алла', phone='+79120000001'))
+    db.add_reservation(make_reservation(name='Борис', phone='+79120000002'))
+
+    assert search_ids(db, 'Ал') == {alexey, alla}
+    assert search_ids(db, 'але') == {alexey}
+    # ё и е не различаются, повод тоже ищется
+    assert search_ids(db, 'Петров') == {alexey}
+    assert search_ids(db, 'рожд') == {alexey}
+    assert search_ids(db, 'Алексей Пет') == {alexey}
+    assert search_ids(db, 'Ксения') == set()
+    assert db.count_search_reservations('Ал') == 2
+
+
+def test_search_matches_phone_suffixes(tmp_path):
+    db = Database(str(tmp_path / 'phones.db'))
+    anna = db.add_reservation(make_reservation(phone='+79126191729'))
+    db.add_reservation(make_reservation(name='Борис', phone='+79130000000'))
+
+    assert search_ids(db, '9126') == {anna}
+    assert search_ids(db, '191729') == {anna}
+    assert search_ids(db, '+7 912 619') == {anna}
+    # 8XXXXXXXXXX хранится как +7XXXXXXXXXX
+    assert search_ids(db, '89126191729') == {anna}
+    assert search_ids(db, '8 (912) 619-17-29') == {anna}
+    assert search_ids(db, '9127') == set()
+
+
+def test_search_index_follows_update_and_delete(tmp_path):
+    db = Database(str(tmp_path / 'sync.db'))
+    reservation_id = db.add_reservation(make_reservation(name='Алексей', phone='+79126191729'))
+
+    db.update_reservation(reservation_id, {'name': 'Геннадий', 'phone': '+79990001122'})
+    assert search_ids(db, 'Ал') == set()
+    assert search_ids(db, '9126') == set()
+    assert search_ids(db, 'Генн') == {reservation_id}
+    assert search_ids(db, '0001122') == {reservation_id}
+
+    assert db.delete_reservation(reservation_id)
+    assert search_ids(db, 'Генн') == set()
+    assert db.count_search_reservations('Генн') == 0
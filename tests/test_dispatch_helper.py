@@ -0,0 +1,106 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+from dispatch_helper import ChatOrderMiddleware
+from metrics_helper import Histogram
+
+
+class FakeState:
+    """FSMContext: хранит одно состояние"""
+
+    def __init__(self):
+        self.value = None
+
+    async def get_state(self):
+        await asyncio.sleep(0)
+        return self.value
+
+
+def make_data(chat_id: int, state: FakeState = None) -> dict:
+    data = {'event_chat': SimpleNamespace(id=chat_id)}
+    if state is not None:
+        data['state'] = state
+        data['raw_state'] = state.value
+    return data
+
+
+def test_chat_order_under_load():
+    middleware = ChatOrderMiddleware(max_workers=8)
+    middleware.wait_histogram = Histogram('wait', 'Ожидание в очереди')
+    chats, per_chat = 100, 100
+    seen = {chat_id: [] for chat_id in range(chats)}
+    running = {'now': 0, 'max': 0}
+    rng = random.Random(1)
+
+    async def handler(event, data):
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        await asyncio.sleep(rng.random() / 2000)
+        seen[data['event_chat'].id].append(event)
+        running['now'] -= 1
+
+    async def run():
+        updates = [(chat_id, n) for n in range(per_chat) for chat_id in range(chats)]
+        await asyncio.gather(*(
+            middleware(handler, n, make_data(chat_id)) for chat_id, n in updates
+        ))
+
+    asyncio.run(run())
+
+    total = chats * per_chat
+    assert all(events == list(range(per_chat)) for events in seen.values())
+    stats = middleware.stats()
+    assert stats['processed'] == total
+    assert stats['waiting'] == 0 and stats['active'] == 0 and stats['chats'] == 0
+
+    # Обработчиков одновременно не больше семафора, и под нагрузкой он заполнен;
+    # остальные апдейты ждут в очереди
+    assert running['max'] == stats['max_active'] == stats['workers']
+    assert stats['workers'] < stats['max_waiting'] <= total
+    assert 0 < stats['avg_wait'] <= stats['max_wait']
+
+    # Ожидание каждого апдейта попало в гистограмму
+    [(counts, wait_sum, count)] = middleware.wait_histogram._values.values()
+    assert count == sum(counts) == total
+    assert abs(wait_sum - stats['avg_wait'] * total) < 1e-6
+    # Под нагрузкой часть апдейтов ждала дольше первой корзины
+    assert sum(counts[1:]) > 0
+
+
+def test_state_is_reread_after_chat_lock():
+    middleware = ChatOrderMiddleware()
+    state = FakeState()
+    routed = []
+
+    async def handler(event, data):
+        routed.append((event, data['raw_state']))
+        await asyncio.sleep(0.01)
+        if event == 'button':
+            state.value = 'waiting_for_search'
+
+    async def run():
+        # Оба апдейта прочитали состояние до очереди чата (как FSMContextMiddleware)
+        first, second = make_data(1, state), make_data(1, state)
+        await asyncio.gather(middleware(handler, 'button', first), middleware(handler, 'text', second))
+
+    asyncio.run(run())
+
+    assert routed == [('button', None), ('text', 'waiting_for_search')]
+
+
+def test_bot_routes_next_message_by_new_state(bot):
+    start = len(bot.sent)
+
+    async def run():
+        await asyncio.gather(
+            bot.feed(bot.message("🔍 Поиск")),
+            bot.feed(bot.message("Несуществующий гость"))
+        )
+
+    bot.run(run())
+
+    # Текст попал в шаг поиска, а не в общий обработчик текста
+    answers = bot.texts(bot.sent[start:])
+    assert answers[0].startswith("🔍 Введите имя")
+    assert answers[1] == "❌ Ничего не найдено."
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+
+from excel_helper import ExcelGenerator, ExcelExportPipeline, RANGE_FILES_DIR
+
+
+def test_range_export_file_is_removed_after_sending(bot):
+    main = bot.main
+    bot.run(main.async_db.add_reservation({
+        'date': main.get_today_str(), 'time': '19:00', 'name': 'Анна', 'phone': '+79120000000',
+        'table_number': '5', 'guests': 2, 'deposit': 0, 'deposit_paid': 0, 'occasion': '',
+    }))
+    start = len(bot.sent)
+
+    bot.run(bot.feed(bot.callback('excel_week')))
+
+    documents = [m for m in bot.sent[start:] if type(m).__name__ == 'SendDocument']
+    assert len(documents) == 1
+    assert documents[0].document.filename.startswith('reservations_')
+    assert os.listdir(RANGE_FILES_DIR) == []
+
+
+def test_cleanup_removes_only_old_range_files():
+    os.makedirs(RANGE_FILES_DIR, exist_ok=True)
+    old_path = os.path.join(RANGE_FILES_DIR, 'old.xlsx')
+    new_path = os.path.join(RANGE_FILES_DIR, 'new.xlsx')
+    for path in (old_path, new_path):
+        with open(path, 'wb'):
+            pass
+    two_days_ago = time.time() - 2 * 24 * 3600
+    os.utime(old_path, (two_days_ago, two_days_ago))
+
+    assert ExcelGenerator.cleanup_range_files() == 1
+    assert os.listdir(RANGE_FILES_DIR) == ['new.xlsx']
+    os.remove(new_path)
+
+
+class FakeExcelDb:
+    """Даты без броней: get_file ничего не собирает"""
+
+    async def get_date_version(self, date):
+        await asyncio.sleep(0)
+        return 0
+
+    async def get_excel_file(self, date):
+        return None
+
+    async def get_reservations_by_date(self, date):
+        return []
+
+
+def test_date_locks_are_dropped_when_released():
+    pipeline = ExcelExportPipeline(FakeExcelDb())
+    dates = [f'2031-01-{day:02d}' for day in range(1, 29)]
+
+    async def run():
+        # По несколько сборок на дату одновременно: блокировка общая, пока они идут
+        results = await asyncio.gather(*(pipeline.get_file(date) for date in dates * 3))
+        assert results == [None] * len(dates) * 3
+
+    asyncio.run(run())
+    assert pipeline._locks == {}
+
+
+def test_schedule_does_not_cancel_running_rebuild():
+    started, finished = [], []
+    release = asyncio.Event()
+
+    class SlowPipeline(ExcelExportPipeline):
+        async def get_file(self, date):
+            started.append(date)
+            await release.wait()
+            finished.append(date)
+
+    pipeline = SlowPipeline(FakeExcelDb(), delay=0.01)
+
+    async def run():
+        # Серия изменений во время задержки - одна пересборка
+        for _ in range(3):
+            pipeline.schedule('2031-01-01')
+        while not started:
+            await asyncio.sleep(0.005)
+        # Изменение во время пересборки не прерывает ее, а планирует следующую
+        pipeline.schedule('2031-01-01')
+        await asyncio.sleep(0.03)
+        release.set()
+        await asyncio.sleep(0.03)
+
+    asyncio.run(run())
+    assert started == finished == ['2031-01-01', '2031-01-01']
+    assert pipeline._timers == {} and pipeline._rebuilds == set()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from database import Database, AsyncDatabase
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+def make_storages(tmp_path, ttl=60):
+    """Два процесса бота на одной БД: свои Database и хранилища"""
+    path = str(tmp_path / 'fsm.db')
+    return [SQLiteStorage(AsyncDatabase(Database(path)), ttl=ttl) for _ in range(2)]
+
+
+def test_changes_are_visible_to_other_process(tmp_path):
+    first, second = make_storages(tmp_path)
+
+    async def run():
+        await first.set_state(KEY, 'ReservationStates:waiting_for_edit_value')
+        await first.set_data(KEY, {'edit_reservation_id': 5})
+        assert await second.get_state(KEY) == 'ReservationStates:waiting_for_edit_value'
+        assert await second.get_data(KEY) == {'edit_reservation_id': 5}
+
+        # Смена состояния в другом процессе не затирает данные
+        await second.set_state(KEY, None)
+        assert await first.get_state(KEY) is None
+        assert await first.get_data(KEY) == {'edit_reservation_id': 5}
+
+        await first.set_data(KEY, {})
+        assert await second.get_data(KEY) == {}
+
+    asyncio.run(run())
+    row = first.async_db.db.get_connection().execute('SELECT COUNT(*) FROM fsm_storage').fetchone()
+    assert row == (0,)
+
+
+def test_expired_record_is_empty(tmp_path):
+    first, second = make_storages(tmp_path, ttl=0.05)
+
+    async def run():
+        await first.set_state(KEY, 'ReservationStates:waiting_for_year')
+        await first.set_data(KEY, {'pending_payment': 1})
+        await asyncio.sleep(0.1)
+        assert await second.get_state(KEY) is None
+        # Новое состояние не поднимает данные истекшей записи
+        await second.set_state(KEY, 'ReservationStates:waiting_for_search_delete')
+        assert await first.get_data(KEY) == {}
+
+    asyncio.run(run())
+
+
+def test_concurrent_writes_share_one_transaction(tmp_path):
+    first, second = make_storages(tmp_path)
+    batches = []
+    save = first.async_db.save_fsm_values
+
+    async def counting_save(records):
+        batches.append(len(records))
+        return await save(records)
+
+    first.async_db.save_fsm_values = counting_save
+    keys = [StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id) for chat_id in range(100, 300)]
+
+    async def run():
+        await asyncio.gather(*(
+            first.set_state(key, f'ReservationStates:step_{n}') for n, key in enumerate(keys)
+        ), first.set_state(KEY, 'ReservationStates:waiting_for_search'), first.set_data(KEY, {'page': 2}))
+        # Каждое изменение записано к возврату из set_state/set_data
+        states = [await second.get_state(key) for key in keys]
+        assert states == [f'ReservationStates:step_{n}' for n in range(len(keys))]
+        assert await second.get_state(KEY) == 'ReservationStates:waiting_for_search'
+        assert await second.get_data(KEY) == {'page': 2}
+
+    asyncio.run(run())
+    # Изменения, сделанные в одной итерации цикла событий, ушли одной транзакцией
+    assert batches == [len(keys) + 2]
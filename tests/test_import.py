@@ -0,0 +1,28 @@
+from aiogram.types import Document
+
+
+def get_context(bot):
+    main = bot.main
+    return main.dp.fsm.resolve_context(main.bot, main.MAIN_ADMIN_ID, main.MAIN_ADMIN_ID)
+
+
+def test_document_outside_import_is_ignored(bot):
+    start = len(bot.sent)
+    document = Document(file_id='file', file_unique_id='file', file_name='брони.csv', file_size=10)
+
+    bot.run(bot.feed(bot.message(None, document=document)))
+
+    # Без кнопки "📥 Импорт" файл не скачивается и не импортируется
+    assert bot.sent[start:] == []
+
+
+def test_import_keeps_other_fsm_data(bot):
+    context = get_context(bot)
+    bot.run(context.set_data({'pending_payment': 42}))
+
+    bot.run(bot.feed(bot.message("📥 Импорт")))
+    answers = bot.run(bot.feed(bot.message("Анна 26.02 18:00 21 89126191729 2")))
+
+    assert answers[0].startswith("📥 Импорт завершен")
+    assert bot.run(context.get_state()) is None
+    assert bot.run(context.get_data()) == {'pending_payment': 42}
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import time
+
+from excel_helper import ExcelGenerator
+
+SAMPLES = 200
+# Допустимый рост p99 под нагрузкой; нижняя граница - несколько интервалов
+# переключения GIL (sys.getswitchinterval() = 5 мс), которые поток выгрузки
+# неизбежно добавляет к переходам в пул БД
+LATENCY_FACTOR = 10
+LATENCY_FLOOR = 0.025
+
+
+def p99(latencies: list) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+def make_reservations(count: int) -> list:
+    return [{
+        'id': n + 1, 'date': '2031-03-14', 'time': f"{12 + n % 10}:00", 'name': f'Гость {n}',
+        'phone': f'+7912{n:07d}', 'table_number': str(n % 28 + 1), 'guests': 2,
+        'deposit': (n % 3) * 5000, 'deposit_paid': n % 2, 'occasion': '',
+    } for n in range(count)]
+
+
+async def measure(bot, samples: int, until: asyncio.Future = None) -> list:
+    """Задержка легкого обработчика (/myrole): samples замеров (и пока идет until)"""
+    latencies = []
+    while len(latencies) < samples or (until is not None and not until.done()):
+        started = time.perf_counter()
+        await bot.feed(bot.message('/myrole'))
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def test_handler_latency_during_bulk_export(bot):
+    main = bot.main
+    reservations = make_reservations(5000)
+
+    async def run():
+        await measure(bot, 20)  # прогрев: кэш ролей, соединения потоков
+        idle = await measure(bot, SAMPLES)
+
+        started = time.perf_counter()
+        export = asyncio.ensure_future(main.async_db.run(
+            ExcelGenerator.create_range_file, reservations, '2031-03-01', '2031-03-31', None, {}
+        ))
+        loaded = await measure(bot, SAMPLES, until=export)
+        os.remove(await export)
+        return idle, loaded, time.perf_counter() - started
+
+    idle, loaded, export_seconds = bot.run(run())
+    print(f"p99 без нагрузки {p99(idle) * 1000:.1f} мс, во время выгрузки {p99(loaded) * 1000:.1f} мс, "
+          f"выгрузка {export_seconds:.2f} с, замеров {len(loaded)}")
+
+    # Выгрузка не блокирует цикл событий: обработчики продолжают отвечать
+    assert len(loaded) >= SAMPLES
+    assert p99(loaded) < export_seconds / 5
+    assert p99(loaded) <= max(p99(idle) * LATENCY_FACTOR, LATENCY_FLOOR)
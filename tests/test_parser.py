@@ -0,0 +1,17 @@
+import json
+import os
+
+import pytest
+
+from main import parse_reservation_text
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'data', 'parser_corpus.json')
+
+# Эталон: разбор исходной (до предкомпиляции шаблонов) версии parse_reservation_text
+with open(CORPUS_PATH, encoding='utf-8') as corpus_file:
+    CORPUS = json.load(corpus_file)
+
+
+@pytest.mark.parametrize('case', CORPUS, ids=[str(i) for i in range(len(CORPUS))])
+def test_parse_matches_golden_corpus(case):
+    assert parse_reservation_text(case['text'], case['year']) == case['expected']
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+
+from database import Database, AsyncDatabase
+from roles_helper import RoleCache
+
+
+def test_invalidate_during_load_is_not_lost():
+    users = {7: {'is_admin': 1, 'is_waiter': 0}}
+    loading = asyncio.Event()
+    release = asyncio.Event()
+
+    async def loader(user_id):
+        user = dict(users[user_id])
+        loading.set()
+        await release.wait()
+        return user
+
+    cache = RoleCache(loader, main_admin_id=1)
+
+    async def run():
+        task = asyncio.create_task(cache.get(7))
+        await loading.wait()
+        # Права сняли, пока читалась старая роль
+        users[7]['is_admin'] = 0
+        cache.invalidate(7)
+        release.set()
+        stale = await task
+        assert stale['is_admin'] and cache.peek(7) is None
+        return await cache.get(7)
+
+    assert asyncio.run(run())['is_admin'] is False
+
+
+def test_full_invalidate_during_load():
+    release = asyncio.Event()
+
+    async def loader(user_id):
+        await release.wait()
+        return {'is_admin': 0, 'is_waiter': 1}
+
+    cache = RoleCache(loader, main_admin_id=1)
+
+    async def run():
+        task = asyncio.create_task(cache.get(7))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        release.set()
+        await task
+
+    asyncio.run(run())
+    assert cache.peek(7) is None
+
+
+def test_roles_are_cached():
+    calls = []
+
+    async def loader(user_id):
+        calls.append(user_id)
+        return {'is_admin': 1, 'is_waiter': 0}
+
+    cache = RoleCache(loader, main_admin_id=1)
+
+    async def run():
+        for _ in range(3):
+            await cache.get(7)
+
+    asyncio.run(run())
+    assert calls == [7]
+
+
+def test_user_generations_are_dropped_after_load():
+    release = asyncio.Event()
+
+    async def loader(user_id):
+        await release.wait()
+        return {'is_admin': 0, 'is_waiter': 1}
+
+    cache = RoleCache(loader, main_admin_id=1)
+
+    async def run():
+        tasks = [asyncio.create_task(cache.get(user_id)) for user_id in range(100, 200)]
+        await asyncio.sleep(0)
+        for user_id in range(100, 200):
+            cache.invalidate(user_id)
+        release.set()
+        await asyncio.gather(*tasks)
+        # Сброс без загрузки в процессе ничего не запоминает
+        for user_id in range(1000, 2000):
+            cache.invalidate(user_id)
+
+    asyncio.run(run())
+    assert cache._loads == {}
+    assert all(cache.peek(user_id) is None for user_id in range(100, 200))
+
+
+def test_role_change_in_db_writer_invalidates_on_loop(tmp_path):
+    async_db = AsyncDatabase(Database(str(tmp_path / 'roles.db')))
+    cache = RoleCache(async_db.get_user, main_admin_id=1)
+    async_db.db.add_role_listener(cache.invalidate_threadsafe)
+    threads = []
+    invalidate = cache.invalidate
+
+    def recording_invalidate(user_id=None):
+        threads.append(threading.current_thread())
+        invalidate(user_id)
+
+    cache.invalidate = recording_invalidate
+
+    async def run():
+        await async_db.add_user(7, 'waiter', 'Официант')
+        assert (await cache.get(7))['is_waiter'] is False
+        await async_db.set_waiter(7, True)
+        # Сброс выполнен в цикле событий к моменту возврата из записи
+        assert cache.peek(7) is None
+        assert (await cache.get(7))['is_waiter'] is True
+        await async_db.close()
+
+    asyncio.run(run())
+    assert threads and all(thread is threading.main_thread() for thread in threads)
@@ -0,0 +1,69 @@
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, SendMessage
+
+
+def add_guests(bot, name: str, count: int):
+    bot.run(bot.main.async_db.add_reservations_bulk([{
+        'date': f'2031-04-{n % 28 + 1:02d}', 'time': '19:00', 'name': f'{name} {n}',
+        'phone': f'+7913{n:07d}', 'table_number': str(n % 28 + 1), 'guests': 2,
+        'deposit': 0, 'deposit_paid': 0, 'occasion': '',
+    } for n in range(count)]))
+
+
+def search(bot, query: str, user_id: int = None) -> SendMessage:
+    """Поиск через бота; возвращает сообщение с первой страницей результатов"""
+    bot.run(bot.feed(bot.message("🔍 Поиск", user_id=user_id)))
+    start = len(bot.sent)
+    bot.run(bot.feed(bot.message(query, user_id=user_id)))
+    return bot.sent[start]
+
+
+def nav_buttons(message) -> dict:
+    """Кнопки листания: {'◀️ Назад' / 'Вперед ▶️': callback_data}"""
+    return {
+        button.text: button.callback_data
+        for row in message.reply_markup.inline_keyboard for button in row
+        if button.callback_data.startswith('lst_')
+    }
+
+
+def turn_page(bot, callback_data: str, user_id: int = None):
+    start = len(bot.sent)
+    bot.run(bot.feed(bot.callback(callback_data, user_id=user_id)))
+    return bot.sent[start:]
+
+
+def test_search_pages_are_read_from_db_past_first_hundred(bot):
+    add_guests(bot, 'Листаев', 125)
+    first = search(bot, 'Листаев')
+    assert first.text.startswith('🔍 Найдено: 125 - стр. 1/13')
+
+    # Переход сразу на последнюю страницу: результаты после сотой брони доступны
+    token = nav_buttons(first)['Вперед ▶️'].split('_')[2]
+    answers = turn_page(bot, f'lst_search_{token}_12')
+    edited = [m for m in answers if isinstance(m, EditMessageText)]
+    assert len(edited) == 1
+    assert edited[0].text.startswith('🔍 Найдено: 125 - стр. 13/13')
+    assert edited[0].text.count('Листаев') == 5
+    assert nav_buttons(edited[0]) == {'◀️ Назад': f'lst_search_{token}_11'}
+
+
+def test_old_or_foreign_search_buttons_are_stale(bot):
+    main = bot.main
+    add_guests(bot, 'Устаревов', 15)
+    old_next = nav_buttons(search(bot, 'Устаревов'))['Вперед ▶️']
+    new_next = nav_buttons(search(bot, 'Устаревов'))['Вперед ▶️']
+    assert old_next != new_next
+
+    # Кнопка прежнего поиска не открывает результаты нового
+    answers = turn_page(bot, old_next)
+    assert [type(m) for m in answers] == [AnswerCallbackQuery]
+    assert answers[0].text.startswith('⚠️ Список устарел')
+
+    # У другого администратора своя метка поиска: чужая кнопка не сработает
+    other_admin = 777000111
+    bot.run(main.async_db.add_user(other_admin, 'admin2', 'Админ', 1))
+    answers = turn_page(bot, new_next, user_id=other_admin)
+    assert answers[0].text.startswith('⚠️ Список устарел')
+
+    answers = turn_page(bot, new_next)
+    assert any(isinstance(m, EditMessageText) and 'стр. 2/2' in m.text for m in answers)
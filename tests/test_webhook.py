@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    """Апдейт в том виде, в каком его присылает Telegram"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'},
+            'text': text,
+        },
+    }
+
+
+def test_webhook_runs_handler_and_checks_secret(bot, monkeypatch):
+    main = bot.main
+    monkeypatch.setattr(main, 'WEBHOOK_SECRET', 'test-secret')
+    user_id = main.MAIN_ADMIN_ID
+
+    async def run():
+        app = main.create_web_app(webhook=True)
+        async with TestClient(TestServer(app)) as client:
+            # Без секрета и с чужим секретом апдейт не принимается
+            response = await client.post(main.WEBHOOK_PATH, json=make_update(9001, user_id, '/start'))
+            assert response.status == 401
+            response = await client.post(
+                main.WEBHOOK_PATH, json=make_update(9002, user_id, '/start'),
+                headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}
+            )
+            assert response.status == 401
+            await asyncio.sleep(0.2)
+            assert bot.sent == sent_before
+
+            response = await client.post(
+                main.WEBHOOK_PATH, json=make_update(9003, user_id, '/start'),
+                headers={'X-Telegram-Bot-Api-Secret-Token': 'test-secret'}
+            )
+            assert response.status == 200
+            # Апдейт обрабатывается в фоне: ждем ответа бота
+            for _ in range(100):
+                if len(bot.sent) > len(sent_before):
+                    break
+                await asyncio.sleep(0.05)
+
+    sent_before = list(bot.sent)
+    bot.run(run())
+    answers = bot.sent[len(sent_before):]
+    assert answers and all(getattr(m, 'chat_id', user_id) == user_id for m in answers)
+    assert type(answers[0]).__name__ == 'SendMessage'